@@ -3,35 +3,239 @@ Browse API module for mrepo.
 
 Provides hierarchical browsing by category, genre, artist, album.
 Uses offset-based pagination (cursor is offset as string).
+All endpoints are read-only and run on the per-thread reader connection.
 """
 
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
 from ..app import api_method
-from ..db import get_db, row_to_dict, rows_to_list
+from ..db import cursor_columns, get_data_version, get_read_db, row_to_dict, rows_to_list
 
 
-@api_method('browse_categories', require='user')
-def browse_categories(sort=None):
-    """List all categories with song counts.
+# SQL templates. Only the set of optional filters present (the request
+# "shape") changes the statement text, so each template is rendered once per
+# shape and the same string object is reused afterwards. Identical SQL text
+# lets sqlite3 serve every call from the connection's statement cache.
 
-    Args:
-        sort: 'name' (default) or 'song_count' for descending by count
-    """
-    conn = get_db()
-    cur = conn.cursor()
+_SONG_COLUMNS = """uuid, type, category, genre, artist, album, title, file,
+               album_artist, track_number, disc_number, year, duration_seconds,
+               seekable, replay_gain_track, replay_gain_album, key, bpm"""
+
+_CATEGORIES_SQL = """
+    SELECT category as name, COUNT(*) as song_count
+    FROM songs
+    WHERE category IS NOT NULL AND category != ''
+    GROUP BY category
+    {order}
+"""
 
-    order_clause = "ORDER BY song_count DESC, category" if sort == 'song_count' else "ORDER BY category"
+_GENRES_SQL = """
+    SELECT genre as name, COUNT(*) as song_count
+    FROM songs
+    WHERE {where}
+    GROUP BY genre
+    {having}
+    {order}
+"""
+
+_COUNT_SONGS_SQL = "SELECT COUNT(*) FROM songs WHERE {where}"
+
+_COUNT_GROUPS_SQL = """
+    SELECT COUNT(*) FROM (
+        SELECT 1 FROM songs WHERE {where}
+        GROUP BY {group} {having}
+    )
+"""
+
+# Same count as _COUNT_GROUPS_SQL when there is no HAVING clause, without
+# materializing the groups
+_COUNT_DISTINCT_SQL = "SELECT COUNT(DISTINCT {group}) FROM songs WHERE {where}"
+
+_ARTISTS_SQL = """
+    SELECT artist as name, COUNT(*) as song_count
+    FROM songs
+    WHERE {where}
+    GROUP BY artist
+    {having}
+    {order}
+    LIMIT ?
+    OFFSET ?
+"""
+
+_ALBUMS_PAGE_SQL = """
+    SELECT
+        album as name,
+        COALESCE(album_artist, artist) as display_artist,
+        COUNT(*) as song_count,
+        MIN(year) as year
+    FROM songs
+    WHERE {where}
+    GROUP BY album, COALESCE(album_artist, artist)
+    {order}
+    LIMIT ?
+    OFFSET ?
+"""
+
+# Same page as _ALBUMS_PAGE_SQL with the totals for the [All Albums] and
+# [Unknown Album] entries folded in; used when the totals aren't cached.
+_ALBUMS_SQL = """
+    WITH base AS (
+        SELECT album, album_artist, artist, year FROM songs WHERE {where}
+    ),
+    grouped AS (
+        SELECT
+            album as name,
+            COALESCE(album_artist, artist) as display_artist,
+            COUNT(*) as song_count,
+            MIN(year) as year
+        FROM base
+        WHERE album IS NOT NULL AND album != ''
+        GROUP BY album, COALESCE(album_artist, artist)
+    ),
+    page AS (
+        SELECT * FROM grouped
+        {order}
+        LIMIT ?
+        OFFSET ?
+    )
+    SELECT
+        (SELECT COUNT(*) FROM grouped) as total_album_count,
+        (SELECT COUNT(*) FROM base WHERE album IS NOT NULL AND album != '') as total_song_count,
+        (SELECT COUNT(*) FROM base WHERE album IS NULL OR album = '') as unknown_count,
+        page.*
+    FROM (SELECT 1) LEFT JOIN page
+    {order}
+"""
+
+_ALBUM_STATS_SQL = """
+    SELECT COUNT(*) as total,
+           COUNT(track_number) as with_tracks,
+           MAX(track_number) as max_track,
+           COUNT(DISTINCT disc_number) as disc_count,
+           COUNT(DISTINCT album) as album_count
+    FROM songs
+    WHERE {where}
+"""
+
+_SONGS_PAGE_SQL = f"""
+    SELECT {_SONG_COLUMNS}
+    FROM songs
+    WHERE {{where}}
+    {{order}}
+    LIMIT ?
+    OFFSET ?
+"""
+
+_ALBUM_ARTISTS_SQL = """
+    SELECT album_artist as name, COUNT(DISTINCT album) as album_count, COUNT(*) as song_count
+    FROM songs
+    WHERE {where}
+    GROUP BY album_artist
+    {having}
+    ORDER BY album_artist
+    LIMIT ?
+    OFFSET ?
+"""
+
+# Folder listings work on songs.parent_dir (indexed): songs are first counted
+# per distinct directory from the index, then those directories are folded
+# into their first path segment below the browsed folder, so the string
+# slicing runs once per directory instead of once per file.
+_PATH_ROOT_DIRS_SQL = """
+    SELECT name, SUM(song_count) as song_count FROM (
+        SELECT SUBSTR(dir, 1, INSTR(dir || '/', '/') - 1) as name, song_count FROM (
+            SELECT CASE WHEN parent_dir LIKE '/%' THEN SUBSTR(parent_dir, 2) ELSE parent_dir END as dir,
+                   COUNT(*) as song_count
+            FROM songs
+            WHERE parent_dir != ''
+            GROUP BY parent_dir
+        )
+        UNION ALL
+        -- Files at the very top level are listed under their own name
+        SELECT basename as name, 1 as song_count FROM songs WHERE parent_dir = ''
+    )
+    GROUP BY name
+    HAVING name IS NOT NULL AND name != ''
+    {order}
+"""
 
-    cur.execute(f"""
-        SELECT category as name, COUNT(*) as song_count
+_PATH_SUBDIRS_SQL = """
+    SELECT name, SUM(song_count) as song_count FROM (
+        SELECT SUBSTR(parent_dir, ?, INSTR(SUBSTR(parent_dir, ?) || '/', '/') - 1) as name,
+               COUNT(*) as song_count
         FROM songs
-        WHERE category IS NOT NULL AND category != ''
-        GROUP BY category
-        {order_clause}
-    """)
+        WHERE parent_dir >= ? AND parent_dir < ?
+        GROUP BY parent_dir
+    )
+    GROUP BY name
+    HAVING name IS NOT NULL AND name != ''
+    {order}
+"""
 
-    rows = cur.fetchall()
-    items = rows_to_list(rows)
+_PATH_FILES_SQL = f"""
+    SELECT {_SONG_COLUMNS},
+           COALESCE(NULLIF(title, ''), basename) as name
+    FROM songs
+    WHERE parent_dir = ?
+    ORDER BY title COLLATE NOCASE, uuid
+    LIMIT ?
+    OFFSET ?
+"""
+
+_PATH_FILE_COUNT_SQL = "SELECT COUNT(*) FROM songs WHERE parent_dir = ?"
 
+_HAVING_MIN_SONGS = "HAVING COUNT(*) >= ?"
+
+_GENRES_TABLE_SQL = """
+    SELECT COUNT(*) FROM pragma_table_info('genres') WHERE name = 'song_count'
+"""
+
+
+@lru_cache(maxsize=512)
+def _render(template, conditions=(), group='', having='', order=''):
+    """Render a SQL template for one filter shape (cached per shape)."""
+    where = " AND ".join(conditions) if conditions else "1=1"
+    return template.format(where=where, group=group, having=having, order=order)
+
+
+def _min_songs_value(min_songs):
+    """Normalize the min_songs filter; None means no HAVING clause."""
+    return int(min_songs) if min_songs is not None and int(min_songs) > 0 else None
+
+
+# Aggregates (totals, [All X]/[Unknown X] counts, category and genre lists)
+# only change when the library changes. They are cached under keys that start
+# with the database data version, so any write makes old entries unreachable
+# and they age out of the LRU.
+_AGGREGATE_CACHE_SIZE = 1024
+_aggregate_cache = OrderedDict()
+_aggregate_lock = threading.Lock()
+
+
+def _cache_get(key):
+    with _aggregate_lock:
+        value = _aggregate_cache.get(key)
+        if value is not None:
+            _aggregate_cache.move_to_end(key)
+        return value
+
+
+def _cache_put(key, value):
+    with _aggregate_lock:
+        _aggregate_cache[key] = value
+        _aggregate_cache.move_to_end(key)
+        while len(_aggregate_cache) > _AGGREGATE_CACHE_SIZE:
+            _aggregate_cache.popitem(last=False)
+
+
+def _name_count_listing(rows):
+    """A listing result built fresh from cached (name, song_count) rows.
+
+    The cache holds tuples so no caller can change what later callers get.
+    """
+    items = [{'name': name, 'song_count': song_count} for name, song_count in rows]
     return {
         'items': items,
         'totalCount': len(items),
@@ -39,7 +243,42 @@ def browse_categories(sort=None):
     }
 
 
-@api_method('browse_genres', require='user')
+def _aggregate(cur, version, sql, params):
+    """Run a single-row aggregate query, cached until the database changes."""
+    key = (version, sql, tuple(params))
+    row = _cache_get(key)
+    if row is None:
+        cur.execute(sql, params)
+        row = tuple(cur.fetchone())
+        _cache_put(key, row)
+    return row
+
+
+@api_method('browse_categories', require='user', etag=get_data_version)
+def browse_categories(sort=None):
+    """List all categories with song counts.
+
+    Args:
+        sort: 'name' (default) or 'song_count' for descending by count
+    """
+    key = (get_data_version(), 'categories', sort == 'song_count')
+    rows = _cache_get(key)
+    if rows is not None:
+        return _name_count_listing(rows)
+
+    conn = get_read_db()
+    cur = conn.cursor()
+
+    order_clause = "ORDER BY song_count DESC, category" if sort == 'song_count' else "ORDER BY category"
+
+    cur.execute(_render(_CATEGORIES_SQL, order=order_clause))
+
+    rows = tuple(map(tuple, cur))
+    _cache_put(key, rows)
+    return _name_count_listing(rows)
+
+
+@api_method('browse_genres', require='user', etag=get_data_version)
 def browse_genres(category=None, min_songs=None, sort=None):
     """List genres with song counts, optionally filtered by category.
 
@@ -48,60 +287,37 @@ def browse_genres(category=None, min_songs=None, sort=None):
         min_songs: Minimum song count to include (default None = no filter)
         sort: 'name' (default) or 'song_count' for descending by count
     """
-    conn = get_db()
-    cur = conn.cursor()
-
     # Use parameterized HAVING clause for safety
-    min_songs_val = int(min_songs) if min_songs is not None and int(min_songs) > 0 else None
-    having_clause = "HAVING COUNT(*) >= ?" if min_songs_val else ""
+    min_songs_val = _min_songs_value(min_songs)
+    having_clause = _HAVING_MIN_SONGS if min_songs_val else ""
+
+    key = (get_data_version(), 'genres', category or None, min_songs_val, sort == 'song_count')
+    rows = _cache_get(key)
+    if rows is not None:
+        return _name_count_listing(rows)
+
+    conn = get_read_db()
+    cur = conn.cursor()
 
     order_clause = "ORDER BY song_count DESC, genre" if sort == 'song_count' else "ORDER BY genre"
 
-    if category:
-        params = [category]
-        if min_songs_val:
-            params.append(min_songs_val)
-        cur.execute(f"""
-            SELECT genre as name, COUNT(*) as song_count
-            FROM songs
-            WHERE genre IS NOT NULL AND genre != '' AND category = ?
-            GROUP BY genre
-            {having_clause}
-            {order_clause}
-        """, params)
-    else:
-        params = [min_songs_val] if min_songs_val else []
-        cur.execute(f"""
-            SELECT genre as name, COUNT(*) as song_count
-            FROM songs
-            WHERE genre IS NOT NULL AND genre != ''
-            GROUP BY genre
-            {having_clause}
-            {order_clause}
-        """, params)
+    filters = ("category = ?",) if category else ()
+    filter_params = [category] if category else []
 
-    rows = cur.fetchall()
-    items = rows_to_list(rows)
+    params = filter_params + ([min_songs_val] if min_songs_val else [])
+    cur.execute(_render(_GENRES_SQL, ("genre IS NOT NULL AND genre != ''",) + filters,
+                        having=having_clause, order=order_clause), params)
+
+    genres = tuple(map(tuple, cur))
 
     # Calculate total songs for [All Genres] entry
-    if category:
-        cur.execute("SELECT COUNT(*) FROM songs WHERE category = ?", (category,))
-    else:
-        cur.execute("SELECT COUNT(*) FROM songs")
+    cur.execute(_render(_COUNT_SONGS_SQL, filters), filter_params)
     total_songs = cur.fetchone()[0]
 
     # Prepend [All Genres] entry to skip genre selection
-    all_genres_entry = {
-        'name': '[All Genres]',
-        'song_count': total_songs
-    }
-    items.insert(0, all_genres_entry)
-
-    return {
-        'items': items,
-        'totalCount': len(items),
-        'hasMore': False
-    }
+    rows = (('[All Genres]', total_songs),) + genres
+    _cache_put(key, rows)
+    return _name_count_listing(rows)
 
 
 @api_method('browse_artists', require='user')
@@ -117,56 +333,40 @@ def browse_artists(category=None, genre=None, cursor=None, limit=100, min_songs=
         sort: 'name' (default) or 'song_count' for descending by count
     """
     limit = min(int(limit), 1000)
-    conn = get_db()
+    conn = get_read_db()
     cur = conn.cursor()
 
-    conditions = ["artist IS NOT NULL AND artist != ''"]
+    filters = []
     params = []
 
     if category:
-        conditions.append("category = ?")
+        filters.append("category = ?")
         params.append(category)
     if genre:
-        conditions.append("genre = ?")
+        filters.append("genre = ?")
         params.append(genre)
 
-    where_clause = " AND ".join(conditions)
+    conditions = ("artist IS NOT NULL AND artist != ''", *filters)
 
     # Use parameterized HAVING clause for safety
-    min_songs_val = int(min_songs) if min_songs is not None and int(min_songs) > 0 else None
-    having_clause = "HAVING COUNT(*) >= ?" if min_songs_val else ""
+    min_songs_val = _min_songs_value(min_songs)
+    having_clause = _HAVING_MIN_SONGS if min_songs_val else ""
+
+    version = get_data_version()
 
     # Get total artist count (with min_songs filter but without cursor)
     count_params = params + ([min_songs_val] if min_songs_val else [])
-    cur.execute(f"""
-        SELECT COUNT(*) FROM (
-            SELECT artist FROM songs WHERE {where_clause}
-            GROUP BY artist {having_clause}
-        )
-    """, count_params)
-    total_artist_count = cur.fetchone()[0]
+    count_template = _COUNT_GROUPS_SQL if min_songs_val else _COUNT_DISTINCT_SQL
+    total_artist_count, = _aggregate(
+        cur, version, _render(count_template, conditions, group='artist', having=having_clause),
+        count_params)
 
     # Get total song count for [All Artists] entry
-    cur.execute(f"""
-        SELECT COUNT(*) FROM songs WHERE {where_clause}
-    """, params)
-    total_song_count = cur.fetchone()[0]
+    total_song_count, = _aggregate(cur, version, _render(_COUNT_SONGS_SQL, conditions), params)
 
     # Count songs without artist (for [Unknown Artist] entry)
-    unknown_conditions = ["(artist IS NULL OR artist = '')"]
-    unknown_params = []
-    if category:
-        unknown_conditions.append("category = ?")
-        unknown_params.append(category)
-    if genre:
-        unknown_conditions.append("genre = ?")
-        unknown_params.append(genre)
-    unknown_where = " AND ".join(unknown_conditions)
-
-    cur.execute(f"""
-        SELECT COUNT(*) FROM songs WHERE {unknown_where}
-    """, unknown_params)
-    unknown_count = cur.fetchone()[0]
+    unknown_conditions = ("(artist IS NULL OR artist = '')", *filters)
+    unknown_count, = _aggregate(cur, version, _render(_COUNT_SONGS_SQL, unknown_conditions), params)
 
     # Use offset-based pagination (cursor is offset as string)
     offset = int(cursor) if cursor else 0
@@ -174,19 +374,11 @@ def browse_artists(category=None, genre=None, cursor=None, limit=100, min_songs=
     order_clause = "ORDER BY song_count DESC, artist" if sort == 'song_count' else "ORDER BY artist"
 
     main_params = params + ([min_songs_val] if min_songs_val else []) + [limit + 1, offset]
-    cur.execute(f"""
-        SELECT artist as name, COUNT(*) as song_count
-        FROM songs
-        WHERE {where_clause}
-        GROUP BY artist
-        {having_clause}
-        {order_clause}
-        LIMIT ?
-        OFFSET ?
-    """, main_params)
+    cur.execute(_render(_ARTISTS_SQL, conditions, having=having_clause, order=order_clause),
+                main_params)
 
     rows = cur.fetchall()
-    items = rows_to_list(rows[:limit])
+    items = rows_to_list(rows[:limit], cursor_columns(cur))
     has_more = len(rows) > limit
     next_cursor = str(offset + limit) if has_more else None
 
@@ -231,90 +423,58 @@ def browse_albums(artist=None, category=None, genre=None, cursor=None, limit=100
         sort: 'name' (default) or 'song_count' for descending by count
     """
     limit = min(int(limit), 1000)
-    conn = get_db()
+    conn = get_read_db()
     cur = conn.cursor()
 
-    conditions = ["album IS NOT NULL AND album != ''"]
+    filters = []
     params = []
 
     # Handle special artist values
     if artist == '[Unknown Artist]':
-        conditions.append("(artist IS NULL OR artist = '')")
+        filters.append("(artist IS NULL OR artist = '')")
     elif artist:
-        conditions.append("artist = ?")
+        filters.append("artist = ?")
         params.append(artist)
     if category:
-        conditions.append("category = ?")
+        filters.append("category = ?")
         params.append(category)
     if genre:
-        conditions.append("genre = ?")
+        filters.append("genre = ?")
         params.append(genre)
 
-    where_clause = " AND ".join(conditions)
-
-    # Get total album count
-    cur.execute(f"""
-        SELECT COUNT(*) FROM (
-            SELECT album FROM songs WHERE {where_clause}
-            GROUP BY album, COALESCE(album_artist, artist)
-        )
-    """, params)
-    total_album_count = cur.fetchone()[0]
-
-    # Get total song count for [All Albums]
-    cur.execute(f"""
-        SELECT COUNT(*) FROM songs WHERE {where_clause}
-    """, params)
-    total_song_count = cur.fetchone()[0]
-
-    # Check for songs without albums (unknown album)
-    unknown_conditions = ["(album IS NULL OR album = '')"]
-    unknown_params = []
-    if artist == '[Unknown Artist]':
-        unknown_conditions.append("(artist IS NULL OR artist = '')")
-    elif artist:
-        unknown_conditions.append("artist = ?")
-        unknown_params.append(artist)
-    if category:
-        unknown_conditions.append("category = ?")
-        unknown_params.append(category)
-    if genre:
-        unknown_conditions.append("genre = ?")
-        unknown_params.append(genre)
-    unknown_where = " AND ".join(unknown_conditions)
-
-    cur.execute(f"""
-        SELECT COUNT(*) FROM songs WHERE {unknown_where}
-    """, unknown_params)
-    unknown_count = cur.fetchone()[0]
-
-    # If there are songs without albums, add to total album count
-    if unknown_count > 0:
-        total_album_count += 1
-
     # Use offset-based pagination
     offset = int(cursor) if cursor else 0
 
     if sort == 'song_count':
-        order_clause = "ORDER BY song_count DESC, album, display_artist"
+        order_clause = "ORDER BY song_count DESC, name, display_artist"
     else:
-        order_clause = "ORDER BY album, display_artist"
+        order_clause = "ORDER BY name, display_artist"
 
-    cur.execute(f"""
-        SELECT
-            album as name,
-            COALESCE(album_artist, artist) as display_artist,
-            COUNT(*) as song_count,
-            MIN(year) as year
-        FROM songs
-        WHERE {where_clause}
-        GROUP BY album, COALESCE(album_artist, artist)
-        {order_clause}
-        LIMIT ?
-        OFFSET ?
-    """, params + [limit + 1, offset])
+    totals_key = (get_data_version(), 'albums', tuple(filters), tuple(params))
+    totals = _cache_get(totals_key)
 
-    rows = cur.fetchall()
+    if totals is not None:
+        conditions = ("album IS NOT NULL AND album != ''", *filters)
+        cur.execute(_render(_ALBUMS_PAGE_SQL, conditions, order=order_clause),
+                    params + [limit + 1, offset])
+        rows = cur.fetchall()
+    else:
+        # Page of albums plus the album/song/unknown totals in one statement.
+        # The totals repeat on every row, and an empty page still yields one
+        # row (with NULL album columns) carrying them.
+        cur.execute(_render(_ALBUMS_SQL, tuple(filters), order=order_clause),
+                    params + [limit + 1, offset])
+        rows = cur.fetchall()
+        totals = (rows[0]['total_album_count'], rows[0]['total_song_count'], rows[0]['unknown_count'])
+        _cache_put(totals_key, totals)
+        if rows[0]['name'] is None:
+            rows = []
+
+    total_album_count, total_song_count, unknown_count = totals
+
+    # If there are songs without albums, add to total album count
+    if unknown_count > 0:
+        total_album_count += 1
 
     # Convert to list with 'artist' key for compatibility
     items = []
@@ -362,7 +522,8 @@ def browse_albums(artist=None, category=None, genre=None, cursor=None, limit=100
 
 
 @api_method('browse_album_songs', require='user')
-def browse_album_songs(album, artist=None, category=None, genre=None, cursor=None, limit=100):
+def browse_album_songs(album, artist=None, category=None, genre=None, cursor=None, limit=100,
+                       format=None):
     """Get all songs in an album with smart ordering.
 
     Special cases:
@@ -376,9 +537,11 @@ def browse_album_songs(album, artist=None, category=None, genre=None, cursor=Non
         genre: Optional genre filter
         cursor: Pagination cursor (offset as string)
         limit: Max items to return
+        format: 'columnar' to return 'columns' + 'rows' (lists of values)
+            instead of 'items' (one dict per song)
     """
     limit = min(int(limit), 1000)
-    conn = get_db()
+    conn = get_read_db()
     cur = conn.cursor()
 
     # Handle special album values
@@ -405,25 +568,14 @@ def browse_album_songs(album, artist=None, category=None, genre=None, cursor=Non
         base_conditions.append("genre = ?")
         base_params.append(genre)
 
-    base_where = " AND ".join(base_conditions) if base_conditions else "1=1"
+    base_conditions = tuple(base_conditions)
 
     # Check album completeness for smart sorting
-    cur.execute(f"""
-        SELECT COUNT(*) as total,
-               COUNT(track_number) as with_tracks,
-               MAX(track_number) as max_track,
-               COUNT(DISTINCT disc_number) as disc_count,
-               COUNT(DISTINCT album) as album_count
-        FROM songs
-        WHERE {base_where}
-    """, base_params)
-
-    stats = cur.fetchone()
-    total_songs = stats['total']
-    with_tracks = stats['with_tracks']
-    max_track = stats['max_track'] or 0
-    disc_count = stats['disc_count'] or 1
-    album_count = stats['album_count'] or 0
+    total_songs, with_tracks, max_track, disc_count, album_count = _aggregate(
+        cur, get_data_version(), _render(_ALBUM_STATS_SQL, base_conditions), base_params)
+    max_track = max_track or 0
+    disc_count = disc_count or 1
+    album_count = album_count or 0
 
     # Album is "complete" if:
     # 1. Most songs have track numbers (>80%)
@@ -438,31 +590,27 @@ def browse_album_songs(album, artist=None, category=None, genre=None, cursor=Non
 
     # Choose sort order based on completeness
     if is_sorted_by_track:
-        order_clause = "disc_number ASC NULLS FIRST, track_number ASC NULLS LAST, title ASC, uuid ASC"
+        order_clause = "ORDER BY disc_number ASC NULLS FIRST, track_number ASC NULLS LAST, title ASC, uuid ASC"
     else:
-        order_clause = "title ASC, uuid ASC"
+        order_clause = "ORDER BY title ASC, uuid ASC"
 
     # Use offset-based pagination
     offset = int(cursor) if cursor else 0
 
-    cur.execute(f"""
-        SELECT uuid, type, category, genre, artist, album, title, file,
-               album_artist, track_number, disc_number, year, duration_seconds,
-               seekable, replay_gain_track, replay_gain_album, key, bpm
-        FROM songs
-        WHERE {base_where}
-        ORDER BY {order_clause}
-        LIMIT ?
-        OFFSET ?
-    """, base_params + [limit + 1, offset])
+    cur.execute(_render(_SONGS_PAGE_SQL, base_conditions, order=order_clause),
+                base_params + [limit + 1, offset])
 
     rows = cur.fetchall()
-    items = rows_to_list(rows[:limit])
     has_more = len(rows) > limit
     next_cursor = str(offset + limit) if has_more else None
 
+    if format == 'columnar':
+        page = {'columns': cursor_columns(cur), 'rows': [tuple(row) for row in rows[:limit]]}
+    else:
+        page = {'items': rows_to_list(rows[:limit], cursor_columns(cur))}
+
     return {
-        'items': items,
+        **page,
         'nextCursor': next_cursor,
         'hasMore': has_more,
         'totalCount': total_songs,
@@ -471,11 +619,11 @@ def browse_album_songs(album, artist=None, category=None, genre=None, cursor=Non
     }
 
 
-@api_method('browse_album_artists', require='user')
+@api_method('browse_album_artists', require='user', etag=get_data_version)
 def browse_album_artists(category=None, genre=None, cursor=None, limit=100, min_songs=None):
     """List album artists (from album_artist field)."""
     limit = min(int(limit), 1000)
-    conn = get_db()
+    conn = get_read_db()
     cur = conn.cursor()
 
     conditions = ["album_artist IS NOT NULL AND album_artist != ''"]
@@ -488,39 +636,28 @@ def browse_album_artists(category=None, genre=None, cursor=None, limit=100, min_
         conditions.append("genre = ?")
         params.append(genre)
 
-    where_clause = " AND ".join(conditions)
+    conditions = tuple(conditions)
 
     # Use parameterized HAVING clause for safety
-    min_songs_val = int(min_songs) if min_songs is not None and int(min_songs) > 0 else None
-    having_clause = "HAVING COUNT(*) >= ?" if min_songs_val else ""
+    min_songs_val = _min_songs_value(min_songs)
+    having_clause = _HAVING_MIN_SONGS if min_songs_val else ""
 
     # Get total count
     count_params = params + ([min_songs_val] if min_songs_val else [])
-    cur.execute(f"""
-        SELECT COUNT(*) FROM (
-            SELECT album_artist FROM songs WHERE {where_clause}
-            GROUP BY album_artist {having_clause}
-        )
-    """, count_params)
-    total_count = cur.fetchone()[0]
+    count_template = _COUNT_GROUPS_SQL if min_songs_val else _COUNT_DISTINCT_SQL
+    total_count, = _aggregate(
+        cur, get_data_version(),
+        _render(count_template, conditions, group='album_artist', having=having_clause),
+        count_params)
 
     # Use offset-based pagination
     offset = int(cursor) if cursor else 0
 
     main_params = params + ([min_songs_val] if min_songs_val else []) + [limit + 1, offset]
-    cur.execute(f"""
-        SELECT album_artist as name, COUNT(DISTINCT album) as album_count, COUNT(*) as song_count
-        FROM songs
-        WHERE {where_clause}
-        GROUP BY album_artist
-        {having_clause}
-        ORDER BY album_artist
-        LIMIT ?
-        OFFSET ?
-    """, main_params)
+    cur.execute(_render(_ALBUM_ARTISTS_SQL, conditions, having=having_clause), main_params)
 
     rows = cur.fetchall()
-    items = rows_to_list(rows[:limit])
+    items = rows_to_list(rows[:limit], cursor_columns(cur))
     has_more = len(rows) > limit
     next_cursor = str(offset + limit) if has_more else None
 
@@ -543,7 +680,7 @@ def browse_artist_songs(artist_id, role=None, cursor=None, limit=100):
         limit: Maximum songs to return
     """
     limit = min(int(limit), 1000)
-    conn = get_db()
+    conn = get_read_db()
     cur = conn.cursor()
 
     artist_name = artist_id
@@ -551,7 +688,7 @@ def browse_artist_songs(artist_id, role=None, cursor=None, limit=100):
         raise ValueError('artist_id is required')
 
     # Default order: album, disc, track, title
-    order_by = 'album, disc_number, track_number, title'
+    order_by = 'ORDER BY album, disc_number, track_number, title'
 
     # Build condition based on role filter
     if role == 'artist':
@@ -565,27 +702,16 @@ def browse_artist_songs(artist_id, role=None, cursor=None, limit=100):
         params = [artist_name, artist_name]
 
     # Get total count
-    cur.execute(f"""
-        SELECT COUNT(*) FROM songs WHERE {condition}
-    """, params)
+    cur.execute(_render(_COUNT_SONGS_SQL, (condition,)), params)
     total_count = cur.fetchone()[0]
 
     # Use offset-based pagination
     offset = int(cursor) if cursor else 0
 
-    cur.execute(f"""
-        SELECT uuid, type, category, genre, artist, album, title, file,
-               album_artist, track_number, disc_number, year, duration_seconds,
-               seekable, replay_gain_track, replay_gain_album, key, bpm
-        FROM songs
-        WHERE {condition}
-        ORDER BY {order_by}
-        LIMIT ?
-        OFFSET ?
-    """, params + [limit + 1, offset])
+    cur.execute(_render(_SONGS_PAGE_SQL, (condition,), order=order_by), params + [limit + 1, offset])
 
     rows = cur.fetchall()
-    items = rows_to_list(rows[:limit])
+    items = rows_to_list(rows[:limit], cursor_columns(cur))
     has_more = len(rows) > limit
     next_cursor = str(offset + limit) if has_more else None
 
@@ -601,8 +727,9 @@ def browse_artist_songs(artist_id, role=None, cursor=None, limit=100):
 def browse_path(path='/', cursor=None, limit=100, sort=None, details=None):
     """Browse by file path (directory listing style).
 
-    Returns directories and files at the given path level.
-    Uses offset-based pagination.
+    Returns directories and files at the given path level, directories
+    first. Uses offset-based pagination; totalCount is only returned for the
+    first page (no cursor).
 
     For absolute paths (starting with /), the first directory level shows
     top-level folders like 'home', 'media', etc.
@@ -615,7 +742,7 @@ def browse_path(path='/', cursor=None, limit=100, sort=None, details=None):
     """
     limit = min(int(limit), 1000)
     offset = int(cursor) if cursor else 0
-    conn = get_db()
+    conn = get_read_db()
     cur = conn.cursor()
 
     # Normalize path - keep leading slash for absolute paths
@@ -625,35 +752,17 @@ def browse_path(path='/', cursor=None, limit=100, sort=None, details=None):
 
     # Order clause
     if sort == 'song_count':
-        dir_order = "song_count DESC, name COLLATE NOCASE ASC"
+        dir_order = "ORDER BY song_count DESC, name COLLATE NOCASE ASC"
     else:
-        dir_order = "name COLLATE NOCASE ASC"
+        dir_order = "ORDER BY name COLLATE NOCASE ASC"
 
     if path == '/':
         # Root level for absolute paths
         # Extract first directory component after leading /
         # e.g., /home/user/music/song.mp3 -> 'home'
-        cur.execute(f"""
-            SELECT
-                CASE
-                    WHEN file LIKE '/%' AND INSTR(SUBSTR(file, 2), '/') > 0
-                    THEN SUBSTR(file, 2, INSTR(SUBSTR(file, 2), '/') - 1)
-                    WHEN file LIKE '/%'
-                    THEN SUBSTR(file, 2)
-                    WHEN INSTR(file, '/') > 0
-                    THEN SUBSTR(file, 1, INSTR(file, '/') - 1)
-                    ELSE file
-                END as name,
-                COUNT(*) as song_count
-            FROM songs
-            GROUP BY name
-            HAVING name IS NOT NULL AND name != ''
-            ORDER BY {dir_order}
-        """)
-
+        cur.execute(_render(_PATH_ROOT_DIRS_SQL, order=dir_order))
         dir_rows = cur.fetchall()
-        directories = [{'type': 'directory', 'name': row['name'], 'song_count': row['song_count']} for row in dir_rows]
-        files = []
+        file_params = None
 
     else:
         # Non-root: get subdirectories and files in this path
@@ -661,51 +770,49 @@ def browse_path(path='/', cursor=None, limit=100, sort=None, details=None):
         prefix = path + '/'
         prefix_len = len(prefix) + 1
 
-        # Get subdirectories with song counts
-        cur.execute(f"""
-            SELECT
-                CASE
-                    WHEN INSTR(SUBSTR(file, ?), '/') > 0
-                    THEN SUBSTR(file, ?, INSTR(SUBSTR(file, ?), '/') - 1)
-                    ELSE NULL
-                END as name,
-                COUNT(*) as song_count
-            FROM songs
-            WHERE file LIKE ?
-              AND LENGTH(file) > ?
-            GROUP BY name
-            HAVING name IS NOT NULL AND name != ''
-            ORDER BY {dir_order}
-        """, (prefix_len, prefix_len, prefix_len, prefix + '%', len(prefix)))
-
+        # Get subdirectories with song counts. Every directory below this
+        # one sorts between prefix and prefix with '/' bumped to '0'.
+        cur.execute(_render(_PATH_SUBDIRS_SQL, order=dir_order),
+                    (prefix_len, prefix_len, prefix, path + '0'))
         dir_rows = cur.fetchall()
-        directories = [{'type': 'directory', 'name': row['name'], 'song_count': row['song_count']} for row in dir_rows]
-
-        # Get files directly in this folder (files that start with prefix but have no more slashes)
-        cur.execute("""
-            SELECT uuid, type, category, genre, artist, album, title, file,
-                   album_artist, track_number, disc_number, year, duration_seconds,
-                   seekable, replay_gain_track, replay_gain_album, key, bpm
-            FROM songs
-            WHERE file LIKE ? AND file NOT LIKE ?
-            ORDER BY title COLLATE NOCASE
-        """, (prefix + '%', prefix + '%/%'))
 
+        # Files directly in this folder
+        file_params = (path,)
+
+    # Directories are listed first. There are few of them, so the grouped
+    # rows are sliced here and only this page is turned into items.
+    dir_count = len(dir_rows)
+    items = [{'type': 'directory', 'name': row['name'], 'song_count': row['song_count']}
+             for row in dir_rows[offset:offset + limit]]
+    has_more = (offset + limit) < dir_count
+
+    if file_params:
+        # Files follow the directories and are paginated in SQL. One extra
+        # row is fetched to tell whether another page exists.
+        file_limit = limit - len(items)
+        file_offset = max(0, offset - dir_count)
+        cur.execute(_PATH_FILES_SQL, file_params + (file_limit + 1, file_offset))
         file_rows = cur.fetchall()
-        files = [dict(row) | {'type': 'file', 'name': row['title'] or row['file'].rsplit('/', 1)[-1]} for row in file_rows]
+        has_more = has_more or len(file_rows) > file_limit
+        columns = cursor_columns(cur)
+        items += [dict(zip(columns, row), type='file') for row in file_rows[:file_limit]]
 
-    # Combine directories and files
-    all_items = directories + files
-    total_count = len(all_items)
+    # Total count is only needed on the first page (the client sizes its
+    # list from it); skip the count when everything fit on this page.
+    total_count = None
+    if not cursor:
+        total_count = len(items)
+        if has_more:
+            total_count = dir_count
+            if file_params:
+                cur.execute(_PATH_FILE_COUNT_SQL, file_params)
+                total_count += cur.fetchone()[0]
 
-    # Apply pagination
-    paginated_items = all_items[offset:offset + limit]
-    has_more = (offset + limit) < total_count
     next_cursor = str(offset + limit) if has_more else None
 
     return {
         'path': path,
-        'items': paginated_items,
+        'items': items,
         'nextCursor': next_cursor,
         'hasMore': has_more,
         'totalCount': total_count
@@ -715,20 +822,21 @@ def browse_path(path='/', cursor=None, limit=100, sort=None, details=None):
 @api_method('browse_genres_normalized', require='user')
 def browse_genres_normalized(category=None, cursor=None, limit=100, min_songs=None):
     """List genres from normalized genre table if available."""
-    conn = get_db()
+    conn = get_read_db()
     cur = conn.cursor()
 
-    # Check if normalized genres table exists
-    cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='genres'")
-    if not cur.fetchone():
-        # Fall back to non-normalized
-        return browse_genres(category=category, cursor=cursor, limit=limit, min_songs=min_songs)
+    # Check if normalized genres table exists (and has the maintained
+    # song_count column added by the migration)
+    has_genres, = _aggregate(cur, get_data_version(), _GENRES_TABLE_SQL, ())
+    if not has_genres:
+        # Fall back to non-normalized (unpaginated, so cursor/limit don't apply)
+        return browse_genres(category=category, min_songs=min_songs)
 
     limit = min(int(limit), 200)
     offset = int(cursor) if cursor else 0
 
     # Use parameterized HAVING clause for safety
-    min_songs_val = int(min_songs) if min_songs is not None and int(min_songs) > 0 else None
+    min_songs_val = _min_songs_value(min_songs)
     having_clause = "HAVING COUNT(DISTINCT sg.song_uuid) >= ?" if min_songs_val else ""
 
     # Build query with optional category filter
@@ -760,20 +868,19 @@ def browse_genres_normalized(category=None, cursor=None, limit=100, min_songs=No
         cur.execute("SELECT COUNT(*) FROM genres")
         total_count = cur.fetchone()[0]
 
-        main_params = ([min_songs_val] if min_songs_val else []) + [limit + 1, offset]
-        cur.execute(f"""
-            SELECT g.id as genre_id, g.display_name as name, COUNT(DISTINCT sg.song_uuid) as song_count
-            FROM genres g
-            LEFT JOIN song_genres sg ON g.id = sg.genre_id
-            GROUP BY g.id
-            {having_clause}
-            ORDER BY g.display_name
+        # Without a category filter the maintained counter replaces the
+        # join + COUNT(DISTINCT)
+        cur.execute("""
+            SELECT id as genre_id, display_name as name, song_count
+            FROM genres
+            WHERE song_count >= ?
+            ORDER BY display_name
             LIMIT ?
             OFFSET ?
-        """, main_params)
+        """, (min_songs_val or 0, limit + 1, offset))
 
     rows = cur.fetchall()
-    items = rows_to_list(rows[:limit])
+    items = rows_to_list(rows[:limit], cursor_columns(cur))
     has_more = len(rows) > limit
     next_cursor = str(offset + limit) if has_more else None
 
@@ -4,42 +4,117 @@ History API module for mrepo.
 Provides play history tracking and retrieval.
 """
 
+import json
+import os
+import queue
+import threading
+from concurrent.futures import Future
 from datetime import datetime
+from functools import lru_cache
 
 from ..app import api_method
-from ..db import get_db, rows_to_list
+from ..db import cursor_columns, get_db, rows_to_list
 
 
-@api_method('history_record', require='user')
-def history_record(song_uuid, duration_seconds=0, skipped=False,
-                   source='browse', details=None, _conn=None):
-    """Record a play event. Returns the history entry id for later updates."""
-    own_conn = _conn is None
-    conn = _conn if _conn else get_db()
-    cur = conn.cursor()
-    user_id = details['user_id']
+_INSERT_HISTORY = """
+    INSERT INTO play_history (user_id, song_uuid, play_duration_seconds, skipped, source)
+    VALUES (?, ?, ?, ?, ?)
+"""
 
-    try:
-        if own_conn:
+# Most play events committed together by the history writer
+_WRITER_BATCH = 256
+
+
+class _HistoryWriter:
+    """Group commit for play events.
+
+    Callers hand their row to a background thread and wait for its id.
+    Everything queued while the previous batch was committing goes out in
+    the next single transaction, so concurrent plays share one commit
+    instead of each taking the write lock in turn.
+    """
+
+    def __init__(self):
+        self.pending = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+        self.thread.start()
+
+    def record(self, row):
+        """Insert one play_history row and return its id."""
+        future = Future()
+        self.pending.put((row, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self.pending.get()]
+            while len(batch) < _WRITER_BATCH:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._commit(batch)
+            except Exception:
+                # A bad row fails the whole transaction; retry one by one so
+                # only that caller sees the error.
+                for item in batch:
+                    try:
+                        self._commit([item])
+                    except Exception as e:
+                        item[1].set_exception(e)
+
+    def _commit(self, batch):
+        cur = get_db().cursor()
+        try:
             cur.execute("BEGIN IMMEDIATE")
-
-        cur.execute("""
-            INSERT INTO play_history (user_id, song_uuid, play_duration_seconds, skipped, source)
-            VALUES (?, ?, ?, ?, ?)
-        """, (user_id, song_uuid, duration_seconds, 1 if skipped else 0, source))
-
-        history_id = cur.lastrowid
-
-        if own_conn:
+            ids = []
+            for row, _ in batch:
+                cur.execute(_INSERT_HISTORY, row)
+                ids.append(cur.lastrowid)
             cur.execute("COMMIT")
-        return {'success': True, 'id': history_id}
-    except Exception as e:
-        if own_conn:
+        except Exception:
             try:
                 cur.execute("ROLLBACK")
             except:
                 pass
-        raise
+            raise
+        for (_, future), history_id in zip(batch, ids):
+            future.set_result(history_id)
+
+
+_writer = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+
+def _get_writer():
+    """The history writer for this process (started lazily, after any fork)."""
+    global _writer, _writer_pid
+    with _writer_lock:
+        if _writer is None or _writer_pid != os.getpid():
+            _writer = _HistoryWriter()
+            _writer_pid = os.getpid()
+        return _writer
+
+
+@api_method('history_record', require='user')
+def history_record(song_uuid, duration_seconds=0, skipped=False,
+                   source='browse', details=None, _conn=None):
+    """Record a play event. Returns the history entry id for later updates.
+
+    On its own the insert goes through the group-commit writer; inside a
+    caller's transaction (_conn) it runs directly on that connection.
+    """
+    user_id = details['user_id']
+    row = (user_id, song_uuid, duration_seconds, 1 if skipped else 0, source)
+
+    if _conn is None:
+        return {'success': True, 'id': _get_writer().record(row)}
+
+    cur = _conn.cursor()
+    cur.execute(_INSERT_HISTORY, row)
+    return {'success': True, 'id': cur.lastrowid}
 
 
 @api_method('history_update', require='user')
@@ -81,58 +156,178 @@ def history_recent(limit=50, details=None):
         LIMIT ?
     """, (user_id, limit))
 
-    rows = cur.fetchall()
-    return {'items': rows_to_list(rows)}
-
+    return {'items': rows_to_list(cur, cursor_columns(cur))}
 
-@api_method('history_list', require='user')
-def history_list(start_date=None, end_date=None, exclude_skipped=False,
-                 offset=0, limit=100, details=None):
-    """Get play history with pagination and date filters."""
-    conn = get_db()
-    cur = conn.cursor()
-    user_id = details['user_id']
 
-    limit = min(int(limit), 200)
-    offset = int(offset) if offset else 0
-    conditions = ["h.user_id = ?"]
-    params = [user_id]
+def _history_filters(user_id, start_date, end_date, exclude_skipped):
+    """Return (shape, params) for the date and skip filters of a history query.
 
+    The shape tuple selects one of a fixed set of WHERE clauses, so the SQL
+    built from it can be cached and always reaches SQLite as the same text.
+    """
+    params = (user_id,)
     if start_date:
-        conditions.append("h.played_at >= ?")
-        params.append(start_date)
+        params += (start_date,)
     if end_date:
-        conditions.append("h.played_at <= ?")
         # Append time to include the entire day
         if len(end_date) == 10:  # YYYY-MM-DD format
-            params.append(end_date + ' 23:59:59')
+            params += (end_date + ' 23:59:59',)
         else:
-            params.append(end_date)
+            params += (end_date,)
+    return (bool(start_date), bool(end_date), bool(exclude_skipped)), params
+
+
+@lru_cache(maxsize=None)
+def _history_where(shape):
+    """WHERE clause for a filter shape from _history_filters."""
+    has_start, has_end, exclude_skipped = shape
+    conditions = ["h.user_id = ?"]
+    if has_start:
+        conditions.append("h.played_at >= ?")
+    if has_end:
+        conditions.append("h.played_at <= ?")
     if exclude_skipped:
         conditions.append("h.skipped = 0")
+    return " AND ".join(conditions)
 
-    where_clause = " AND ".join(conditions)
 
-    # Get total count
-    cur.execute(f"SELECT COUNT(*) FROM play_history h WHERE {where_clause}", params)
-    total_count = cur.fetchone()[0]
+@lru_cache(maxsize=None)
+def _history_list_sql(shape, after_cursor):
+    """SQL for one history_list page; returns (count_sql, page_sql)."""
+    where_clause = _history_where(shape)
+    count_sql = f"SELECT COUNT(*) FROM play_history h WHERE {where_clause}"
 
-    cur.execute(f"""
+    # Cursor condition (cursor is the last history id of the previous page)
+    if after_cursor:
+        where_clause += (" AND (h.played_at, h.id) < "
+                         "((SELECT played_at FROM play_history WHERE id = ?), ?)")
+
+    page_sql = f"""
         SELECT s.uuid, s.title, s.artist, s.album, s.type, s.seekable,
+               h.id as history_id,
                h.played_at, h.play_duration_seconds, h.skipped, h.source
         FROM play_history h
         JOIN songs s ON h.song_uuid = s.uuid
         WHERE {where_clause}
-        ORDER BY h.played_at DESC
+        ORDER BY h.played_at DESC, h.id DESC
         LIMIT ? OFFSET ?
-    """, params + [limit, offset])
+    """
+    return count_sql, page_sql
+
+
+@lru_cache(maxsize=None)
+def _history_grouped_sql(shape, after_cursor):
+    """SQL for one history_grouped page; returns (count_sql, page_sql)."""
+    where_clause = _history_where(shape)
+
+    # Count unique songs. Group the plays first so the songs lookup (which
+    # keeps the count in line with the joined listing) runs once per
+    # distinct song rather than once per play.
+    count_sql = f"""
+        SELECT COUNT(*) FROM (
+            SELECT h.song_uuid
+            FROM play_history h
+            WHERE {where_clause}
+            GROUP BY h.song_uuid
+        ) g
+        JOIN songs s ON s.uuid = g.song_uuid
+    """
+
+    # Cursor condition (cursor is the sort key of the previous page's last row)
+    having_clause = ""
+    if after_cursor:
+        having_clause = "HAVING (play_count, last_played, s.uuid) < (?, ?, ?)"
+
+    page_sql = f"""
+        SELECT s.uuid, s.title, s.artist, s.album, s.type, s.seekable,
+               COUNT(*) as play_count,
+               MAX(h.played_at) as last_played,
+               SUM(h.play_duration_seconds) as total_duration
+        FROM play_history h
+        JOIN songs s ON h.song_uuid = s.uuid
+        WHERE {where_clause}
+        GROUP BY s.uuid
+        {having_clause}
+        ORDER BY play_count DESC, last_played DESC, s.uuid DESC
+        LIMIT ? OFFSET ?
+    """
+    return count_sql, page_sql
+
+
+@lru_cache(maxsize=None)
+def _history_uuids_sql(shape, grouped, include_total):
+    """SQL for history_get_uuids."""
+    where_clause = _history_where(shape)
+    if grouped:
+        # Unique UUIDs ordered by play count
+        matches = f"""
+            SELECT h.song_uuid, COUNT(*) as sort_key
+            FROM play_history h
+            WHERE {where_clause}
+            GROUP BY h.song_uuid
+        """
+    else:
+        # All UUIDs ordered by played_at
+        matches = f"""
+            SELECT h.song_uuid, h.played_at as sort_key
+            FROM play_history h
+            WHERE {where_clause}
+        """
+
+    if include_total:
+        # Count and page from one materialized scan instead of two queries
+        return f"""
+            WITH matches AS MATERIALIZED ({matches})
+            SELECT song_uuid, (SELECT COUNT(*) FROM matches) as total_count
+            FROM matches
+            ORDER BY sort_key DESC
+            LIMIT ?
+        """
+    return f"{matches} ORDER BY sort_key DESC LIMIT ?"
+
+
+@api_method('history_list', require='user')
+def history_list(start_date=None, end_date=None, exclude_skipped=False,
+                 cursor=None, offset=0, limit=100, include_total=None, details=None):
+    """Get play history with pagination and date filters.
+
+    Pages are keyed on (played_at, id): pass the previous page's nextCursor
+    as `cursor`. `offset` is still accepted from older clients. totalCount
+    is computed when include_total is true; by default only for the first
+    page, and it is None otherwise.
+    """
+    conn = get_db()
+    cur = conn.cursor()
+    user_id = details['user_id']
+
+    limit = min(int(limit), 200)
+    offset = int(offset) if offset else 0
+    if include_total is None:
+        include_total = not cursor and not offset
+    shape, params = _history_filters(user_id, start_date, end_date, exclude_skipped)
+    count_sql, page_sql = _history_list_sql(shape, bool(cursor))
+
+    # Get total count
+    total_count = None
+    if include_total:
+        cur.execute(count_sql, params)
+        total_count = cur.fetchone()[0]
+
+    if cursor:
+        params += (int(cursor), int(cursor))
+        offset = 0
+
+    # Query with limit + 1 to check if more exist
+    cur.execute(page_sql, (*params, limit + 1, offset))
 
     rows = cur.fetchall()
-    items = rows_to_list(rows)
-    has_more = (offset + len(items)) < total_count
+    items = rows_to_list(rows[:limit])
+    has_more = len(rows) > limit
+    next_cursor = str(items[-1]['history_id']) if has_more and items else None
 
     return {
         'items': items,
+        'nextCursor': next_cursor,
         'totalCount': total_count,
         'hasMore': has_more
     }
@@ -140,60 +335,48 @@ def history_list(start_date=None, end_date=None, exclude_skipped=False,
 
 @api_method('history_grouped', require='user')
 def history_grouped(start_date=None, end_date=None, exclude_skipped=False,
-                    offset=0, limit=100, details=None):
-    """Get play history grouped by song."""
+                    cursor=None, offset=0, limit=100, include_total=None, details=None):
+    """Get play history grouped by song.
+
+    Pages are keyed on (play_count, last_played, uuid): pass the previous
+    page's nextCursor as `cursor`. `offset` is still accepted from older
+    clients. totalCount is computed when include_total is true; by default
+    only for the first page, and it is None otherwise.
+    """
     conn = get_db()
     cur = conn.cursor()
     user_id = details['user_id']
 
     limit = min(int(limit), 200)
     offset = int(offset) if offset else 0
-    conditions = ["h.user_id = ?"]
-    params = [user_id]
+    if include_total is None:
+        include_total = not cursor and not offset
+    shape, params = _history_filters(user_id, start_date, end_date, exclude_skipped)
+    count_sql, page_sql = _history_grouped_sql(shape, bool(cursor))
 
-    if start_date:
-        conditions.append("h.played_at >= ?")
-        params.append(start_date)
-    if end_date:
-        conditions.append("h.played_at <= ?")
-        # Append time to include the entire day
-        if len(end_date) == 10:  # YYYY-MM-DD format
-            params.append(end_date + ' 23:59:59')
-        else:
-            params.append(end_date)
-    if exclude_skipped:
-        conditions.append("h.skipped = 0")
+    total_count = None
+    if include_total:
+        cur.execute(count_sql, params)
+        total_count = cur.fetchone()[0]
 
-    where_clause = " AND ".join(conditions)
+    if cursor:
+        params += tuple(json.loads(cursor))
+        offset = 0
 
-    # Get total count of unique songs
-    cur.execute(f"""
-        SELECT COUNT(DISTINCT s.uuid)
-        FROM play_history h
-        JOIN songs s ON h.song_uuid = s.uuid
-        WHERE {where_clause}
-    """, params)
-    total_count = cur.fetchone()[0]
-
-    cur.execute(f"""
-        SELECT s.uuid, s.title, s.artist, s.album, s.type, s.seekable,
-               COUNT(*) as play_count,
-               MAX(h.played_at) as last_played,
-               SUM(h.play_duration_seconds) as total_duration
-        FROM play_history h
-        JOIN songs s ON h.song_uuid = s.uuid
-        WHERE {where_clause}
-        GROUP BY s.uuid
-        ORDER BY play_count DESC, last_played DESC
-        LIMIT ? OFFSET ?
-    """, params + [limit, offset])
+    # Query with limit + 1 to check if more exist
+    cur.execute(page_sql, (*params, limit + 1, offset))
 
     rows = cur.fetchall()
-    items = rows_to_list(rows)
-    has_more = (offset + len(items)) < total_count
+    items = rows_to_list(rows[:limit])
+    has_more = len(rows) > limit
+    next_cursor = None
+    if has_more and items:
+        last = items[-1]
+        next_cursor = json.dumps([last['play_count'], last['last_played'], last['uuid']])
 
     return {
         'items': items,
+        'nextCursor': next_cursor,
         'totalCount': total_count,
         'hasMore': has_more
     }
@@ -201,69 +384,31 @@ def history_grouped(start_date=None, end_date=None, exclude_skipped=False,
 
 @api_method('history_get_uuids', require='user')
 def history_get_uuids(start_date=None, end_date=None, exclude_skipped=False,
-                      grouped=False, limit=5000, details=None):
-    """Get UUIDs from play history (for creating playlists from history)."""
+                      grouped=False, limit=5000, include_total=False, details=None):
+    """Get UUIDs from play history (for creating playlists from history).
+
+    totalCount (the number of matches ignoring limit) is only computed when
+    include_total is true, and is None otherwise.
+    """
     conn = get_db()
     cur = conn.cursor()
     user_id = details['user_id']
 
     limit = min(int(limit), 10000)
-    conditions = ["h.user_id = ?"]
-    params = [user_id]
-
-    if start_date:
-        conditions.append("h.played_at >= ?")
-        params.append(start_date)
-    if end_date:
-        conditions.append("h.played_at <= ?")
-        # Append time to include the entire day
-        if len(end_date) == 10:  # YYYY-MM-DD format
-            params.append(end_date + ' 23:59:59')
-        else:
-            params.append(end_date)
-    if exclude_skipped:
-        conditions.append("h.skipped = 0")
-
-    where_clause = " AND ".join(conditions)
-
-    if grouped:
-        # Get unique UUIDs ordered by play count
-        cur.execute(f"""
-            SELECT h.song_uuid, COUNT(*) as play_count
-            FROM play_history h
-            WHERE {where_clause}
-            GROUP BY h.song_uuid
-            ORDER BY play_count DESC
-            LIMIT ?
-        """, params + [limit])
+    shape, params = _history_filters(user_id, start_date, end_date, exclude_skipped)
+    cur.execute(_history_uuids_sql(shape, bool(grouped), bool(include_total)),
+                (*params, limit))
+
+    total_count = None
+    if include_total:
+        uuids = []
+        total_count = 0
+        for song_uuid, total_count in cur:
+            uuids.append(song_uuid)
     else:
-        # Get all UUIDs ordered by played_at
-        cur.execute(f"""
-            SELECT h.song_uuid
-            FROM play_history h
-            WHERE {where_clause}
-            ORDER BY h.played_at DESC
-            LIMIT ?
-        """, params + [limit])
-
-    rows = cur.fetchall()
-
-    # Get total count
-    if grouped:
-        cur.execute(f"""
-            SELECT COUNT(DISTINCT h.song_uuid)
-            FROM play_history h
-            WHERE {where_clause}
-        """, params)
-    else:
-        cur.execute(f"""
-            SELECT COUNT(*)
-            FROM play_history h
-            WHERE {where_clause}
-        """, params)
-    total_count = cur.fetchone()[0]
+        uuids = [row[0] for row in cur]
 
     return {
-        'uuids': [row['song_uuid'] for row in rows],
+        'uuids': uuids,
         'totalCount': total_count
     }
@@ -4,45 +4,79 @@ Playlists API module for mrepo.
 Provides playlist management with sharing support.
 """
 
+import json
 import secrets
 from datetime import datetime
 
 from ..app import api_method
-from ..db import get_db, row_to_dict, rows_to_list
+from ..db import get_db, get_read_db, row_to_dict, rows_to_list
+
+# Values bound per IN (...) list, kept well under SQLite's host parameter limit
+_IN_CHUNK = 500
+
+
+def _rank_playlist(cur, playlist_id, order_by, join=''):
+    """Rewrite positions to a contiguous 0-based sequence in `order_by` order
+    (an SQL ORDER BY list over playlist_songs ps plus any `join`), in place.
+    Rows are matched by rowid (stable per physical row) so duplicate
+    song_uuids are handled unambiguously, and a two-pass negative range dodges
+    the (playlist_id, position) PRIMARY KEY mid-rewrite. Returns the number
+    of rows renumbered."""
+    cur.execute(f"""
+        UPDATE playlist_songs SET position = -ranked.rn
+        FROM (
+            SELECT ps.rowid AS rid, ROW_NUMBER() OVER (ORDER BY {order_by}) AS rn
+            FROM playlist_songs ps {join}
+            WHERE ps.playlist_id = ?
+        ) AS ranked
+        WHERE playlist_songs.rowid = ranked.rid
+    """, (playlist_id,))
+    count = cur.rowcount
+    cur.execute("UPDATE playlist_songs SET position = -position - 1 WHERE playlist_id = ?",
+                (playlist_id,))
+    return count
+
+
+def _touch_owned(cur, playlist_id, user_id):
+    """Bump updated_at on a playlist owned by user_id. Doubles as the
+    ownership check for mutations: returns False when the playlist doesn't
+    exist or belongs to someone else."""
+    cur.execute("UPDATE playlists SET updated_at = ? WHERE id = ? AND user_id = ?",
+               (datetime.utcnow(), playlist_id, user_id))
+    return cur.rowcount > 0
+
+
+def _reserve_positions(cur, playlist_id, user_id, count):
+    """Claim `count` consecutive positions at the end of a playlist owned by
+    user_id (bumping updated_at as well). Returns the first claimed position,
+    or None when the playlist doesn't exist or belongs to someone else."""
+    cur.execute("""
+        UPDATE playlists SET next_position = next_position + ?, updated_at = ?
+        WHERE id = ? AND user_id = ?
+        RETURNING next_position
+    """, (count, datetime.utcnow(), playlist_id, user_id))
+    rows = cur.fetchall()
+    return rows[0][0] - count if rows else None
 
 
 def _renumber_playlist(cur, playlist_id):
     """Rewrite positions to a contiguous 0-based sequence, preserving order and
-    duplicates. Uses rowid (stable per physical row) so duplicate song_uuids are
-    handled unambiguously, and a two-pass negative range to dodge the
-    (playlist_id, position) PRIMARY KEY mid-rewrite."""
-    cur.execute("""
-        SELECT rowid FROM playlist_songs WHERE playlist_id = ? ORDER BY position
-    """, (playlist_id,))
-    rowids = [r[0] for r in cur.fetchall()]
-    for i, rid in enumerate(rowids):
-        cur.execute("UPDATE playlist_songs SET position = ? WHERE rowid = ?",
-                    (-(i + 1), rid))
-    for i, rid in enumerate(rowids):
-        cur.execute("UPDATE playlist_songs SET position = ? WHERE rowid = ?",
-                    (i, rid))
+    duplicates."""
+    _rank_playlist(cur, playlist_id, 'ps.position')
 
 
 @api_method('playlists_list', require='user')
 def playlists_list(details=None):
     """List all playlists for the current user."""
-    conn = get_db()
+    conn = get_read_db()
     cur = conn.cursor()
     user_id = details['user_id']
 
     cur.execute("""
         SELECT p.id, p.name, p.description, p.is_public, p.share_token,
-               p.created_at, p.updated_at,
-               COUNT(ps.song_uuid) as song_count
+               p.created_at, p.updated_at, p.song_count
         FROM playlists p
-        LEFT JOIN playlist_songs ps ON p.id = ps.playlist_id
         WHERE p.user_id = ?
-        GROUP BY p.id
         ORDER BY p.name
     """, (user_id,))
 
@@ -62,24 +96,18 @@ def playlists_public(cursor=None, limit=50):
     if cursor:
         cur.execute("""
             SELECT p.id, p.name, p.description, p.user_id, p.share_token,
-                   p.created_at,
-                   COUNT(ps.song_uuid) as song_count
+                   p.created_at, p.song_count
             FROM playlists p
-            LEFT JOIN playlist_songs ps ON p.id = ps.playlist_id
             WHERE p.is_public = 1 AND p.id > ?
-            GROUP BY p.id
             ORDER BY p.id
             LIMIT ?
         """, (int(cursor), limit + 1))
     else:
         cur.execute("""
             SELECT p.id, p.name, p.description, p.user_id, p.share_token,
-                   p.created_at,
-                   COUNT(ps.song_uuid) as song_count
+                   p.created_at, p.song_count
             FROM playlists p
-            LEFT JOIN playlist_songs ps ON p.id = ps.playlist_id
             WHERE p.is_public = 1
-            GROUP BY p.id
             ORDER BY p.id
             LIMIT ?
         """, (limit + 1,))
@@ -133,12 +161,6 @@ def playlists_update(playlist_id, name=None, description=None, is_public=None, d
     cur = conn.cursor()
     user_id = details['user_id']
 
-    # Verify ownership
-    cur.execute("SELECT id FROM playlists WHERE id = ? AND user_id = ?",
-               (playlist_id, user_id))
-    if not cur.fetchone():
-        raise ValueError('Playlist not found or access denied')
-
     updates = []
     params = []
 
@@ -152,12 +174,21 @@ def playlists_update(playlist_id, name=None, description=None, is_public=None, d
         updates.append("is_public = ?")
         params.append(1 if is_public else 0)
 
+    # Ownership is part of the WHERE clause; no matching row means no access
     if updates:
         updates.append("updated_at = ?")
         params.append(datetime.utcnow())
-        params.append(playlist_id)
+        params.extend([playlist_id, user_id])
 
-        cur.execute(f"UPDATE playlists SET {', '.join(updates)} WHERE id = ?", params)
+        cur.execute(f"UPDATE playlists SET {', '.join(updates)} WHERE id = ? AND user_id = ?",
+                    params)
+        found = cur.rowcount > 0
+    else:
+        cur.execute("SELECT id FROM playlists WHERE id = ? AND user_id = ?",
+                   (playlist_id, user_id))
+        found = cur.fetchone() is not None
+    if not found:
+        raise ValueError('Playlist not found or access denied')
 
     return {'success': True}
 
@@ -174,18 +205,21 @@ def playlists_delete(playlist_id, details=None, _conn=None):
         if own_conn:
             cur.execute("BEGIN IMMEDIATE")
 
-        # Verify ownership
-        cur.execute("SELECT id FROM playlists WHERE id = ? AND user_id = ?",
+        # Delete songs first (cascade should handle this, but be explicit).
+        # Both statements only match the owner's playlist, so nothing is
+        # touched unless the playlist row itself is deleted.
+        cur.execute("""
+            DELETE FROM playlist_songs WHERE playlist_id IN (
+                SELECT id FROM playlists WHERE id = ? AND user_id = ?
+            )
+        """, (playlist_id, user_id))
+        cur.execute("DELETE FROM playlists WHERE id = ? AND user_id = ?",
                    (playlist_id, user_id))
-        if not cur.fetchone():
+        if cur.rowcount == 0:
             if own_conn:
                 cur.execute("ROLLBACK")
             raise ValueError('Playlist not found or access denied')
 
-        # Delete songs first (cascade should handle this, but be explicit)
-        cur.execute("DELETE FROM playlist_songs WHERE playlist_id = ?", (playlist_id,))
-        cur.execute("DELETE FROM playlists WHERE id = ?", (playlist_id,))
-
         if own_conn:
             cur.execute("COMMIT")
         return {'success': True}
@@ -200,15 +234,13 @@ def playlists_delete(playlist_id, details=None, _conn=None):
         raise
 
 
-def _playlist_songs_page(cur, playlist_id, cursor, offset, limit):
-    """Fetch one page of a playlist's songs. Access must be checked by the caller."""
-    limit = min(int(limit), 500)
+def _playlist_songs_page(cur, playlist_id, cursor, offset, limit, include_total=None):
+    """Fetch one page of a playlist's songs. Access must be checked by the caller.
 
-    # Get total count
-    cur.execute("""
-        SELECT COUNT(*) FROM playlist_songs WHERE playlist_id = ?
-    """, (playlist_id,))
-    total_count = cur.fetchone()[0]
+    totalCount is computed when include_total is true; by default only for
+    the first page, and it is None otherwise.
+    """
+    limit = min(int(limit), 500)
 
     # Determine offset - cursor takes precedence, then offset, then 0
     if cursor:
@@ -218,16 +250,29 @@ def _playlist_songs_page(cur, playlist_id, cursor, offset, limit):
     else:
         start_offset = 0
 
+    # Get total count
+    total_count = None
+    if include_total or (include_total is None and start_offset == 0):
+        cur.execute("SELECT song_count FROM playlists WHERE id = ?", (playlist_id,))
+        total_count = cur.fetchone()[0]
+
+    # Deferred join: pick the page from the narrow playlist_songs primary key
+    # (skipping rows whose song is gone with a PK probe), then fetch the wide
+    # song rows for that page only.
     cur.execute("""
         SELECT s.uuid, s.type, s.category, s.genre, s.artist, s.album, s.title,
                s.file, s.album_artist, s.track_number, s.disc_number, s.year,
                s.duration_seconds, s.seekable, s.replay_gain_track, s.replay_gain_album,
                s.key, s.bpm, ps.position
-        FROM playlist_songs ps
+        FROM (
+            SELECT song_uuid, position FROM playlist_songs
+            WHERE playlist_id = ?
+              AND EXISTS (SELECT 1 FROM songs WHERE uuid = playlist_songs.song_uuid)
+            ORDER BY position
+            LIMIT ? OFFSET ?
+        ) ps
         JOIN songs s ON ps.song_uuid = s.uuid
-        WHERE ps.playlist_id = ?
         ORDER BY ps.position
-        LIMIT ? OFFSET ?
     """, (playlist_id, limit + 1, start_offset))
 
     rows = cur.fetchall()
@@ -245,7 +290,8 @@ def _playlist_songs_page(cur, playlist_id, cursor, offset, limit):
 
 
 @api_method('playlists_get_songs', require='user')
-def playlists_get_songs(playlist_id, cursor=None, offset=None, limit=100, details=None):
+def playlists_get_songs(playlist_id, cursor=None, offset=None, limit=100,
+                        include_total=None, details=None):
     """Get songs in a playlist with pagination."""
     conn = get_db()
     cur = conn.cursor()
@@ -263,11 +309,12 @@ def playlists_get_songs(playlist_id, cursor=None, offset=None, limit=100, detail
     if str(playlist['user_id']) != str(user_id) and not playlist['is_public']:
         raise ValueError('Access denied')
 
-    return _playlist_songs_page(cur, playlist_id, cursor, offset, limit)
+    return _playlist_songs_page(cur, playlist_id, cursor, offset, limit, include_total)
 
 
 @api_method('playlists_get_songs_by_token', require=None, public=True)
-def playlists_get_songs_by_token(share_token, cursor=None, offset=None, limit=100):
+def playlists_get_songs_by_token(share_token, cursor=None, offset=None, limit=100,
+                                 include_total=None):
     """Get songs of a shared playlist by its share token (public access).
 
     Least-privilege by construction: the unguessable share token is the
@@ -290,7 +337,7 @@ def playlists_get_songs_by_token(share_token, cursor=None, offset=None, limit=10
     if not playlist:
         raise ValueError('Playlist not found')
 
-    return _playlist_songs_page(cur, playlist['id'], cursor, offset, limit)
+    return _playlist_songs_page(cur, playlist['id'], cursor, offset, limit, include_total)
 
 
 @api_method('playlists_add_song', require='user')
@@ -306,34 +353,23 @@ def playlists_add_song(playlist_id, song_uuid, details=None, _conn=None):
         if own_conn:
             cur.execute("BEGIN IMMEDIATE")
 
-        # Verify ownership
-        cur.execute("SELECT id FROM playlists WHERE id = ? AND user_id = ?",
-                   (playlist_id, user_id))
-        if not cur.fetchone():
-            if own_conn:
-                cur.execute("ROLLBACK")
-            raise ValueError('Playlist not found or access denied')
-
         # Duplicates are a first-class feature: a playlist may contain the same
         # song more than once (e.g. the VVVVVV soundtrack repeats tracks
         # intentionally), so this always appends. The table's PRIMARY KEY is
         # (playlist_id, position), so a repeated add lands at a fresh position
         # rather than colliding.
-        # Get next position (now protected by write lock)
-        cur.execute("SELECT MAX(position) FROM playlist_songs WHERE playlist_id = ?",
-                   (playlist_id,))
-        result = cur.fetchone()
-        next_pos = (result[0] or 0) + 1
+        # Reserve the next position (also the ownership check)
+        next_pos = _reserve_positions(cur, playlist_id, user_id, 1)
+        if next_pos is None:
+            if own_conn:
+                cur.execute("ROLLBACK")
+            raise ValueError('Playlist not found or access denied')
 
         cur.execute("""
             INSERT INTO playlist_songs (playlist_id, song_uuid, position)
             VALUES (?, ?, ?)
         """, (playlist_id, song_uuid, next_pos))
 
-        # Update playlist timestamp
-        cur.execute("UPDATE playlists SET updated_at = ? WHERE id = ?",
-                   (datetime.utcnow(), playlist_id))
-
         if own_conn:
             cur.execute("COMMIT")
         return {'success': True, 'position': next_pos}
@@ -367,36 +403,25 @@ def playlists_add_songs(playlist_id, song_uuids, details=None, _conn=None):
         if own_conn:
             cur.execute("BEGIN IMMEDIATE")
 
-        # Verify ownership
-        cur.execute("SELECT id FROM playlists WHERE id = ? AND user_id = ?",
-                   (playlist_id, user_id))
-        if not cur.fetchone():
+        # Reserve positions for the whole batch (also the ownership check)
+        next_pos = _reserve_positions(cur, playlist_id, user_id, len(song_uuids))
+        if next_pos is None:
             if own_conn:
                 cur.execute("ROLLBACK")
             raise ValueError('Playlist not found or access denied')
 
-        # Get next position (now protected by write lock)
-        cur.execute("SELECT MAX(position) FROM playlist_songs WHERE playlist_id = ?",
-                   (playlist_id,))
-        result = cur.fetchone()
-        next_pos = (result[0] or 0) + 1
-
         # Duplicates are a first-class feature: append every uuid given, in
         # order, even if it already appears in the playlist. `skipped` stays in
         # the response shape (always 0 now) so callers that read it don't break.
-        added = 0
+        # The uuid list is bound once as JSON.
+        cur.execute("""
+            INSERT INTO playlist_songs (playlist_id, song_uuid, position)
+            SELECT ?, j.value, ? + j.key
+            FROM json_each(?) j
+            ORDER BY j.key
+        """, (playlist_id, next_pos, json.dumps(song_uuids)))
+        added = cur.rowcount
         skipped = 0
-        for uuid in song_uuids:
-            cur.execute("""
-                INSERT INTO playlist_songs (playlist_id, song_uuid, position)
-                VALUES (?, ?, ?)
-            """, (playlist_id, uuid, next_pos))
-            added += 1
-            next_pos += 1
-
-        # Update playlist timestamp
-        cur.execute("UPDATE playlists SET updated_at = ? WHERE id = ?",
-                   (datetime.utcnow(), playlist_id))
 
         if own_conn:
             cur.execute("COMMIT")
@@ -433,10 +458,8 @@ def playlists_remove_song(playlist_id, song_uuid, index=None, details=None, _con
         if own_conn:
             cur.execute("BEGIN IMMEDIATE")
 
-        # Verify ownership
-        cur.execute("SELECT id FROM playlists WHERE id = ? AND user_id = ?",
-                   (playlist_id, user_id))
-        if not cur.fetchone():
+        # Verify ownership (the timestamp bump only matches the owner's row)
+        if not _touch_owned(cur, playlist_id, user_id):
             if own_conn:
                 cur.execute("ROLLBACK")
             raise ValueError('Playlist not found or access denied')
@@ -467,9 +490,6 @@ def playlists_remove_song(playlist_id, song_uuid, index=None, details=None, _con
                 DELETE FROM playlist_songs WHERE playlist_id = ? AND song_uuid = ?
             """, (playlist_id, song_uuid))
 
-        cur.execute("UPDATE playlists SET updated_at = ? WHERE id = ?",
-                   (datetime.utcnow(), playlist_id))
-
         if own_conn:
             cur.execute("COMMIT")
         return {'success': True}
@@ -509,10 +529,8 @@ def playlists_remove_songs(playlist_id, song_uuids, indices=None, details=None,
         if own_conn:
             cur.execute("BEGIN IMMEDIATE")
 
-        # Verify ownership
-        cur.execute("SELECT id FROM playlists WHERE id = ? AND user_id = ?",
-                   (playlist_id, user_id))
-        if not cur.fetchone():
+        # Verify ownership (the timestamp bump only matches the owner's row)
+        if not _touch_owned(cur, playlist_id, user_id):
             if own_conn:
                 cur.execute("ROLLBACK")
             raise ValueError('Playlist not found or access denied')
@@ -530,23 +548,26 @@ def playlists_remove_songs(playlist_id, song_uuids, indices=None, details=None,
                     target_positions.append(rows[int(rank)]['position'])
                 except (IndexError, ValueError, TypeError):
                     continue
-            for pos in target_positions:
-                cur.execute("""
-                    DELETE FROM playlist_songs WHERE playlist_id = ? AND position = ?
-                """, (playlist_id, pos))
+            for i in range(0, len(target_positions), _IN_CHUNK):
+                chunk = target_positions[i:i + _IN_CHUNK]
+                placeholders = ','.join('?' * len(chunk))
+                cur.execute(f"""
+                    DELETE FROM playlist_songs
+                    WHERE playlist_id = ? AND position IN ({placeholders})
+                """, [playlist_id, *chunk])
                 removed += cur.rowcount
             if removed:
                 _renumber_playlist(cur, playlist_id)
         else:
-            for uuid in song_uuids:
-                cur.execute("""
-                    DELETE FROM playlist_songs WHERE playlist_id = ? AND song_uuid = ?
-                """, (playlist_id, uuid))
+            for i in range(0, len(song_uuids), _IN_CHUNK):
+                chunk = song_uuids[i:i + _IN_CHUNK]
+                placeholders = ','.join('?' * len(chunk))
+                cur.execute(f"""
+                    DELETE FROM playlist_songs
+                    WHERE playlist_id = ? AND song_uuid IN ({placeholders})
+                """, [playlist_id, *chunk])
                 removed += cur.rowcount
 
-        cur.execute("UPDATE playlists SET updated_at = ? WHERE id = ?",
-                   (datetime.utcnow(), playlist_id))
-
         if own_conn:
             cur.execute("COMMIT")
         return {'success': True, 'removed': removed}
@@ -573,10 +594,8 @@ def playlists_reorder(playlist_id, positions, details=None, _conn=None):
         if own_conn:
             cur.execute("BEGIN IMMEDIATE")
 
-        # Verify ownership
-        cur.execute("SELECT id FROM playlists WHERE id = ? AND user_id = ?",
-                   (playlist_id, user_id))
-        if not cur.fetchone():
+        # Verify ownership (the timestamp bump only matches the owner's row)
+        if not _touch_owned(cur, playlist_id, user_id):
             if own_conn:
                 cur.execute("ROLLBACK")
             raise ValueError('Playlist not found or access denied')
@@ -603,40 +622,33 @@ def playlists_reorder(playlist_id, positions, details=None, _conn=None):
             if len(valid) == current_count:
                 cur.execute("DELETE FROM playlist_songs WHERE playlist_id = ?",
                            (playlist_id,))
-                for uuid, position in sorted(valid, key=lambda x: x[1]):
-                    cur.execute("""
-                        INSERT INTO playlist_songs (playlist_id, song_uuid, position)
-                        VALUES (?, ?, ?)
-                    """, (playlist_id, uuid, position))
-            cur.execute("UPDATE playlists SET updated_at = ? WHERE id = ?",
-                       (datetime.utcnow(), playlist_id))
+                cur.executemany("""
+                    INSERT INTO playlist_songs (playlist_id, song_uuid, position)
+                    VALUES (?, ?, ?)
+                """, [(playlist_id, uuid, position)
+                      for uuid, position in sorted(valid, key=lambda x: x[1])])
             if own_conn:
                 cur.execute("COMMIT")
             return {'success': True}
 
         # Use negative positions temporarily to avoid UNIQUE constraint violations
         # First pass: set all positions to negative
-        for item in positions:
-            uuid = item.get('uuid')
-            position = item.get('position')
-            if uuid is not None and position is not None:
-                cur.execute("""
-                    UPDATE playlist_songs SET position = ?
-                    WHERE playlist_id = ? AND song_uuid = ?
-                """, (-(position + 1), playlist_id, uuid))
+        cur.executemany("""
+            UPDATE playlist_songs SET position = ?
+            WHERE playlist_id = ? AND song_uuid = ?
+        """, [(-(position + 1), playlist_id, uuid) for uuid, position in valid])
 
         # Second pass: set to final positive positions
-        for item in positions:
-            uuid = item.get('uuid')
-            position = item.get('position')
-            if uuid is not None and position is not None:
-                cur.execute("""
-                    UPDATE playlist_songs SET position = ?
-                    WHERE playlist_id = ? AND song_uuid = ?
-                """, (position, playlist_id, uuid))
+        cur.executemany("""
+            UPDATE playlist_songs SET position = ?
+            WHERE playlist_id = ? AND song_uuid = ?
+        """, [(position, playlist_id, uuid) for uuid, position in valid])
 
-        cur.execute("UPDATE playlists SET updated_at = ? WHERE id = ?",
-                   (datetime.utcnow(), playlist_id))
+        # Client-chosen positions must stay below the next append position
+        if valid:
+            cur.execute("""
+                UPDATE playlists SET next_position = MAX(next_position, ?) WHERE id = ?
+            """, (max(position for _, position in valid) + 1, playlist_id))
 
         if own_conn:
             cur.execute("COMMIT")
@@ -659,21 +671,17 @@ def playlists_share(playlist_id, details=None):
     cur = conn.cursor()
     user_id = details['user_id']
 
-    # Verify ownership
-    cur.execute("SELECT id, share_token FROM playlists WHERE id = ? AND user_id = ?",
-               (playlist_id, user_id))
-    playlist = cur.fetchone()
-    if not playlist:
-        raise ValueError('Playlist not found or access denied')
-
-    # Generate or reuse token
-    token = playlist['share_token'] or secrets.token_urlsafe(16)
-
+    # Reuse the existing token or set a new one, owner's playlist only
     cur.execute("""
-        UPDATE playlists SET share_token = ? WHERE id = ?
-    """, (token, playlist_id))
+        UPDATE playlists SET share_token = COALESCE(share_token, ?)
+        WHERE id = ? AND user_id = ?
+        RETURNING share_token
+    """, (secrets.token_urlsafe(16), playlist_id, user_id))
+    rows = cur.fetchall()
+    if not rows:
+        raise ValueError('Playlist not found or access denied')
 
-    return {'share_token': token}
+    return {'share_token': rows[0]['share_token']}
 
 
 @api_method('playlists_by_token', require=None, public=True)
@@ -685,12 +693,9 @@ def playlists_by_token(share_token):
     # Deliberately no p.user_id: this is an unauthenticated endpoint and
     # the share view never uses the owner identity.
     cur.execute("""
-        SELECT p.id, p.name, p.description, p.is_public, p.created_at,
-               COUNT(ps.song_uuid) as song_count
+        SELECT p.id, p.name, p.description, p.is_public, p.created_at, p.song_count
         FROM playlists p
-        LEFT JOIN playlist_songs ps ON p.id = ps.playlist_id
         WHERE p.share_token = ?
-        GROUP BY p.id
     """, (share_token,))
 
     playlist = cur.fetchone()
@@ -707,32 +712,40 @@ def playlists_clone(playlist_id, new_name=None, details=None):
     cur = conn.cursor()
     user_id = details['user_id']
 
-    # Get source playlist
-    cur.execute("""
-        SELECT id, name, user_id, is_public FROM playlists WHERE id = ?
-    """, (playlist_id,))
-    source = cur.fetchone()
-
-    if not source:
-        raise ValueError('Playlist not found')
-    if str(source['user_id']) != str(user_id) and not source['is_public']:
-        raise ValueError('Access denied')
+    try:
+        cur.execute("BEGIN IMMEDIATE")
 
-    # Create new playlist
-    final_name = new_name or f"{source['name']} (Copy)"
-    cur.execute("""
-        INSERT INTO playlists (user_id, name)
-        VALUES (?, ?)
-    """, (user_id, final_name))
-    new_id = cur.lastrowid
+        # Create the copy straight from the source row; the access check is
+        # part of the WHERE, so an unreadable source inserts nothing
+        cur.execute("""
+            INSERT INTO playlists (user_id, name)
+            SELECT ?, COALESCE(?, name || ' (Copy)')
+            FROM playlists
+            WHERE id = ? AND (user_id = ? OR is_public = 1)
+            RETURNING id, name
+        """, (user_id, new_name or None, playlist_id, user_id))
+        created = cur.fetchall()
+        if not created:
+            cur.execute("ROLLBACK")
+            raise ValueError('Playlist not found or access denied')
+        new_id, final_name = created[0]
 
-    # Copy songs
-    cur.execute("""
-        INSERT INTO playlist_songs (playlist_id, song_uuid, position)
-        SELECT ?, song_uuid, position FROM playlist_songs WHERE playlist_id = ?
-    """, (new_id, playlist_id))
+        # Copy songs (triggers keep song_count and next_position in step)
+        cur.execute("""
+            INSERT INTO playlist_songs (playlist_id, song_uuid, position)
+            SELECT ?, song_uuid, position FROM playlist_songs WHERE playlist_id = ?
+        """, (new_id, playlist_id))
 
-    return {'id': new_id, 'name': final_name}
+        cur.execute("COMMIT")
+        return {'id': new_id, 'name': final_name}
+    except ValueError:
+        raise
+    except Exception:
+        try:
+            cur.execute("ROLLBACK")
+        except:
+            pass
+        raise
 
 
 @api_method('playlists_sort', require='user')
@@ -747,10 +760,8 @@ def playlists_sort(playlist_id, sort_by='artist', order='asc', details=None, _co
         if own_conn:
             cur.execute("BEGIN IMMEDIATE")
 
-        # Verify ownership
-        cur.execute("SELECT id FROM playlists WHERE id = ? AND user_id = ?",
-                   (playlist_id, user_id))
-        if not cur.fetchone():
+        # Verify ownership (the timestamp bump only matches the owner's row)
+        if not _touch_owned(cur, playlist_id, user_id):
             if own_conn:
                 cur.execute("ROLLBACK")
             raise ValueError('Playlist not found or access denied')
@@ -767,32 +778,15 @@ def playlists_sort(playlist_id, sort_by='artist', order='asc', details=None, _co
         order_by = sort_map.get(sort_by, 's.artist, s.album, s.disc_number, s.track_number')
         order_dir = 'DESC' if order.lower() == 'desc' else 'ASC'
 
-        # Get sorted songs
-        cur.execute(f"""
-            SELECT ps.song_uuid
-            FROM playlist_songs ps
-            JOIN songs s ON ps.song_uuid = s.uuid
-            WHERE ps.playlist_id = ?
-            ORDER BY {order_by} {order_dir if sort_by != 'random' else ''}
-        """, (playlist_id,))
-
-        songs = [row['song_uuid'] for row in cur.fetchall()]
-
-        # Update positions
-        cur.execute("DELETE FROM playlist_songs WHERE playlist_id = ?", (playlist_id,))
-
-        for i, uuid in enumerate(songs):
-            cur.execute("""
-                INSERT INTO playlist_songs (playlist_id, song_uuid, position)
-                VALUES (?, ?, ?)
-            """, (playlist_id, uuid, i))
-
-        cur.execute("UPDATE playlists SET updated_at = ? WHERE id = ?",
-                   (datetime.utcnow(), playlist_id))
+        # Reassign positions in place; current position breaks ties
+        song_count = _rank_playlist(
+            cur, playlist_id,
+            f"{order_by} {order_dir if sort_by != 'random' else ''}, ps.position",
+            join='LEFT JOIN songs s ON ps.song_uuid = s.uuid')
 
         if own_conn:
             cur.execute("COMMIT")
-        return {'success': True, 'songCount': len(songs)}
+        return {'success': True, 'songCount': song_count}
     except ValueError:
         raise
     except Exception as e:
@@ -5,46 +5,179 @@ Provides user preferences and EQ presets management.
 """
 
 import secrets
-from datetime import datetime
+import threading
+import time
+from functools import lru_cache
 
 from ..app import api_method
-from ..db import get_db, row_to_dict, rows_to_list
+from ..db import (cursor_columns, get_data_version, get_db, get_read_db, rows_to_list,
+                  write_transaction)
+from ..jsonutil import json_dumpb, json_loads
+
+
+# Statements are kept as module constants so every call hands sqlite3 the
+# same text and hits the connection's prepared statement cache
+_PREFS_SELECT = """
+    SELECT volume, shuffle, repeat_mode, radio_eopp, dark_mode,
+           replay_gain_mode, replay_gain_preamp, replay_gain_fallback,
+           radio_algorithm, ai_search_max, ai_search_diversity, ai_radio_queue_diversity
+    FROM user_preferences WHERE user_id = ?
+"""
+
+_EQ_SUMMARY = """
+    SELECT uuid, name,
+           CASE WHEN json_valid(bands) THEN json_array_length(bands) ELSE 0 END as band_count,
+           created_at, updated_at
+    FROM eq_presets WHERE user_id = ?
+    ORDER BY name
+"""
+
+# SQLite validates the JSON, so only well-formed bands reach the parser. They
+# are fetched as UTF-8 bytes, which the parser reads without a str round trip.
+_EQ_LIST = """
+    SELECT uuid, name,
+           CASE WHEN json_valid(bands) THEN CAST(bands AS BLOB) END as bands,
+           created_at, updated_at
+    FROM eq_presets WHERE user_id = ?
+    ORDER BY name
+"""
 
+# Preset timestamps are taken by SQLite in the statement itself, in the same
+# UTC text format as the existing rows, so no datetime is bound per write
+_EQ_NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+# Encoded bands arrive as UTF-8 bytes; the cast stores them as TEXT, which the
+# JSON functions above require
+_EQ_UPDATE = f"""
+    UPDATE eq_presets SET name = ?, bands = CAST(? AS TEXT), updated_at = {_EQ_NOW}
+    WHERE uuid = ? AND user_id = ?
+"""
+
+_EQ_INSERT = f"""
+    INSERT INTO eq_presets (uuid, user_id, name, bands, created_at, updated_at)
+    VALUES (?, ?, ?, CAST(? AS TEXT), {_EQ_NOW}, {_EQ_NOW})
+"""
 
-@api_method('preferences_get', require='user')
+# Bulk save: creates presets with client-chosen uuids, and only overwrites a
+# conflicting row that belongs to the same user
+_EQ_UPSERT = f"""
+    INSERT INTO eq_presets (uuid, user_id, name, bands, created_at, updated_at)
+    VALUES (?, ?, ?, CAST(? AS TEXT), {_EQ_NOW}, {_EQ_NOW})
+    ON CONFLICT(uuid) DO UPDATE SET
+        name = excluded.name, bands = excluded.bands, updated_at = excluded.updated_at
+    WHERE eq_presets.user_id = excluded.user_id
+"""
+
+_EQ_DELETE = "DELETE FROM eq_presets WHERE uuid = ? AND user_id = ?"
+
+
+# preferences_get results per user: user_id -> (expires_at, data_version,
+# prefs). preferences_set drops its user's entry; the data version catches
+# writes made by other worker processes.
+_PREFS_CACHE_TTL = 60
+_prefs_cache = {}
+_prefs_cache_lock = threading.Lock()
+
+
+@api_method('preferences_get', require='user', raw_json=True)
 def preferences_get(details=None):
     """Get user preferences."""
-    conn = get_db()
-    cur = conn.cursor()
     user_id = details['user_id']
+    version = get_data_version()
+    now = time.monotonic()
 
-    cur.execute("""
-        SELECT volume, shuffle, repeat_mode, radio_eopp, dark_mode,
-               replay_gain_mode, replay_gain_preamp, replay_gain_fallback,
-               radio_algorithm, ai_search_max, ai_search_diversity, ai_radio_queue_diversity
-        FROM user_preferences WHERE user_id = ?
-    """, (user_id,))
+    with _prefs_cache_lock:
+        entry = _prefs_cache.get(user_id)
+    if entry is not None and entry[0] > now and entry[1] == version:
+        return dict(entry[2])
+
+    conn = get_read_db()
+    cur = conn.cursor()
+
+    cur.execute(_PREFS_SELECT, (user_id,))
 
     row = cur.fetchone()
 
     if row:
-        return row_to_dict(row)
-
-    # Return defaults
-    return {
-        'volume': 1.0,
-        'shuffle': False,
-        'repeat_mode': 'none',
-        'radio_eopp': True,
-        'dark_mode': False,
-        'replay_gain_mode': 'off',
-        'replay_gain_preamp': 0.0,
-        'replay_gain_fallback': -6.0,
-        'radio_algorithm': 'sca',
-        'ai_search_max': 2000,
-        'ai_search_diversity': 0.3,
-        'ai_radio_queue_diversity': 0.3
-    }
+        # Built positionally from _PREFS_SELECT's column order; the 0/1 flags
+        # come back as booleans, matching the defaults below
+        prefs = {
+            'volume': row[0],
+            'shuffle': bool(row[1]),
+            'repeat_mode': row[2],
+            'radio_eopp': bool(row[3]),
+            'dark_mode': bool(row[4]),
+            'replay_gain_mode': row[5],
+            'replay_gain_preamp': row[6],
+            'replay_gain_fallback': row[7],
+            'radio_algorithm': row[8],
+            'ai_search_max': row[9],
+            'ai_search_diversity': row[10],
+            'ai_radio_queue_diversity': row[11]
+        }
+    else:
+        # Defaults
+        prefs = {
+            'volume': 1.0,
+            'shuffle': False,
+            'repeat_mode': 'none',
+            'radio_eopp': True,
+            'dark_mode': False,
+            'replay_gain_mode': 'off',
+            'replay_gain_preamp': 0.0,
+            'replay_gain_fallback': -6.0,
+            'radio_algorithm': 'sca',
+            'ai_search_max': 2000,
+            'ai_search_diversity': 0.3,
+            'ai_radio_queue_diversity': 0.3
+        }
+
+    with _prefs_cache_lock:
+        _prefs_cache[user_id] = (now + _PREFS_CACHE_TTL, version, prefs)
+    return dict(prefs)
+
+
+def _flag(value):
+    """Store a boolean preference as 0/1."""
+    return 1 if value else 0
+
+
+# Columns preferences_set writes, in its argument order: (column, coercion
+# for supplied values, value written when creating a row without it)
+_PREF_FIELDS = (
+    ('volume', float, 1.0),
+    ('shuffle', _flag, 0),
+    ('repeat_mode', str, 'none'),
+    ('radio_eopp', _flag, 0),
+    ('dark_mode', _flag, 0),
+    ('replay_gain_mode', str, 'off'),
+    ('replay_gain_preamp', float, 0.0),
+    ('replay_gain_fallback', float, -6.0),
+    ('radio_algorithm', str, 'sca'),
+    ('ai_search_max', int, 2000),
+    ('ai_search_diversity', float, 0.3),
+    ('ai_radio_queue_diversity', float, 0.3),
+)
+
+
+@lru_cache(maxsize=256)
+def _preferences_upsert_sql(updates):
+    """UPSERT for preferences_set that overwrites only the given columns.
+
+    `updates` lists columns in _PREF_FIELDS order, so callers that change
+    the same fields always get the same statement text. Any subset of the
+    12 columns is possible, so the cache is bounded; in practice a handful
+    of single-field toggles dominate.
+    """
+    if updates:
+        on_conflict = "DO UPDATE SET " + ", ".join(f"{col} = excluded.{col}" for col in updates)
+    else:
+        on_conflict = "DO NOTHING"
+    return f"""
+        INSERT INTO user_preferences (user_id, {', '.join(name for name, _, _ in _PREF_FIELDS)})
+        VALUES (?, {', '.join('?' * len(_PREF_FIELDS))})
+        ON CONFLICT(user_id) {on_conflict}
+    """
 
 
 @api_method('preferences_set', require='user')
@@ -53,8 +186,11 @@ def preferences_set(volume=None, shuffle=None, repeat_mode=None, radio_eopp=None
                     replay_gain_fallback=None, radio_algorithm=None,
                     ai_search_max=None, ai_search_diversity=None, ai_radio_queue_diversity=None,
                     details=None, _conn=None):
-    """Update user preferences."""
-    own_conn = _conn is None
+    """Update user preferences.
+
+    Only the supplied fields are changed. A user without a preferences row
+    gets one, with defaults for the fields that were not supplied.
+    """
     conn = _conn if _conn else get_db()
     cur = conn.cursor()
     user_id = details['user_id']
@@ -63,133 +199,114 @@ def preferences_set(volume=None, shuffle=None, repeat_mode=None, radio_eopp=None
     if radio_algorithm is not None and radio_algorithm not in ('sca', 'clap'):
         raise ValueError("radio_algorithm must be 'sca' or 'clap'")
 
-    try:
-        if own_conn:
-            cur.execute("BEGIN IMMEDIATE")
-
-        # Check if row exists
-        cur.execute("SELECT user_id FROM user_preferences WHERE user_id = ?", (user_id,))
-        exists = cur.fetchone()
-
-        if exists:
-            updates = []
-            params = []
-
-            if volume is not None:
-                updates.append("volume = ?")
-                params.append(volume)
-            if shuffle is not None:
-                updates.append("shuffle = ?")
-                params.append(1 if shuffle else 0)
-            if repeat_mode is not None:
-                updates.append("repeat_mode = ?")
-                params.append(repeat_mode)
-            if radio_eopp is not None:
-                updates.append("radio_eopp = ?")
-                params.append(1 if radio_eopp else 0)
-            if dark_mode is not None:
-                updates.append("dark_mode = ?")
-                params.append(1 if dark_mode else 0)
-            if replay_gain_mode is not None:
-                updates.append("replay_gain_mode = ?")
-                params.append(replay_gain_mode)
-            if replay_gain_preamp is not None:
-                updates.append("replay_gain_preamp = ?")
-                params.append(replay_gain_preamp)
-            if replay_gain_fallback is not None:
-                updates.append("replay_gain_fallback = ?")
-                params.append(replay_gain_fallback)
-            if radio_algorithm is not None:
-                updates.append("radio_algorithm = ?")
-                params.append(radio_algorithm)
-            if ai_search_max is not None:
-                updates.append("ai_search_max = ?")
-                params.append(int(ai_search_max))
-            if ai_search_diversity is not None:
-                updates.append("ai_search_diversity = ?")
-                params.append(float(ai_search_diversity))
-            if ai_radio_queue_diversity is not None:
-                updates.append("ai_radio_queue_diversity = ?")
-                params.append(float(ai_radio_queue_diversity))
-
-            if updates:
-                params.append(user_id)
-                cur.execute(f"UPDATE user_preferences SET {', '.join(updates)} WHERE user_id = ?", params)
-        else:
-            cur.execute("""
-                INSERT INTO user_preferences (user_id, volume, shuffle, repeat_mode, radio_eopp,
-                                             dark_mode, replay_gain_mode, replay_gain_preamp, replay_gain_fallback,
-                                             radio_algorithm, ai_search_max, ai_search_diversity, ai_radio_queue_diversity)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                user_id,
-                volume if volume is not None else 1.0,
-                1 if shuffle else 0,
-                repeat_mode or 'none',
-                1 if radio_eopp else 0,
-                1 if dark_mode else 0,
-                replay_gain_mode or 'off',
-                replay_gain_preamp if replay_gain_preamp is not None else 0.0,
-                replay_gain_fallback if replay_gain_fallback is not None else -6.0,
-                radio_algorithm or 'sca',
-                ai_search_max if ai_search_max is not None else 2000,
-                ai_search_diversity if ai_search_diversity is not None else 0.3,
-                ai_radio_queue_diversity if ai_radio_queue_diversity is not None else 0.3
-            ))
-
-        if own_conn:
-            cur.execute("COMMIT")
-        return {'success': True}
-    except Exception as e:
-        if own_conn:
-            try:
-                cur.execute("ROLLBACK")
-            except:
-                pass
-        raise
+    supplied = (volume, shuffle, repeat_mode, radio_eopp, dark_mode,
+                replay_gain_mode, replay_gain_preamp, replay_gain_fallback,
+                radio_algorithm, ai_search_max, ai_search_diversity,
+                ai_radio_queue_diversity)
+    updates = tuple(field[0] for field, value in zip(_PREF_FIELDS, supplied)
+                    if value is not None)
+    values = [default if value is None else coerce(value)
+              for (_, coerce, default), value in zip(_PREF_FIELDS, supplied)]
+
+    # One statement creates or updates the row, so no explicit transaction
+    # is needed to keep the existence check and the write together
+    cur.execute(_preferences_upsert_sql(updates), (user_id, *values))
+    with _prefs_cache_lock:
+        _prefs_cache.pop(user_id, None)
+
+    return {'success': True}
 
 
 # EQ Presets
 
-@api_method('eq_presets_list', require='user')
-def eq_presets_list(details=None):
-    """List EQ presets for the current user."""
-    import json as json_module
+# Band fields kept when a preset is saved, in stored order. Bands are stored
+# as arrays of these values and expanded back to objects when listed; any
+# other keys the client attached are UI state and are dropped.
+_BAND_KEYS = ('type', 'frequency', 'gain', 'q', 'enabled')
+
+
+def _compact_bands(bands):
+    """Bands as stored: each band object becomes an array of _BAND_KEYS values."""
+    return [[band.get(key) for key in _BAND_KEYS] if isinstance(band, dict) else band
+            for band in bands]
+
+
+def _expand_band(band):
+    """Stored band back to an object; missing fields stay missing."""
+    if isinstance(band, list):
+        return {key: value for key, value in zip(_BAND_KEYS, band) if value is not None}
+    return band
+
+
+@lru_cache(maxsize=256)
+def _frozen_bands(bands):
+    """A preset's stored band list, parsed and expanded; presets change rarely,
+    so keep results. Band objects are kept as tuples of their items so no
+    caller can change the cached copy. None if the bands aren't a list.
+    """
+    parsed = json_loads(bands)
+    if not isinstance(parsed, list):
+        return None
+    return tuple(tuple(band.items()) if isinstance(band, dict) else band
+                 for band in map(_expand_band, parsed))
+
+
+def _parse_bands(bands):
+    """Parse a preset's stored bands into band objects of the caller's own."""
+    frozen = _frozen_bands(bands)
+    if frozen is None:
+        return json_loads(bands)
+    return [dict(band) if isinstance(band, tuple) else band for band in frozen]
 
-    conn = get_db()
+
+@api_method('eq_presets_list', require='user', raw_json=True)
+def eq_presets_list(summary=False, details=None):
+    """List EQ presets for the current user.
+
+    With summary, each preset carries band_count instead of its bands.
+    Bands that are not valid JSON are listed as empty.
+    """
+    conn = get_read_db()
     cur = conn.cursor()
     user_id = details['user_id']
 
-    cur.execute("""
-        SELECT uuid, name, bands, created_at, updated_at
-        FROM eq_presets WHERE user_id = ?
-        ORDER BY name
-    """, (user_id,))
-
-    rows = cur.fetchall()
-
-    # Parse bands JSON for each preset
-    presets = []
-    for row in rows:
-        preset = dict(row)
-        if preset.get('bands'):
-            try:
-                preset['bands'] = json_module.loads(preset['bands'])
-            except (json_module.JSONDecodeError, TypeError):
-                preset['bands'] = []
-        else:
-            preset['bands'] = []
-        presets.append(preset)
+    if summary:
+        cur.execute(_EQ_SUMMARY, (user_id,))
+        return {'presets': rows_to_list(cur, cursor_columns(cur))}
+
+    cur.execute(_EQ_LIST, (user_id,))
+
+    parse = _parse_bands
+    presets = [{
+        'uuid': uuid,
+        'name': name,
+        'bands': parse(bands) if bands else [],
+        'created_at': created_at,
+        'updated_at': updated_at
+    } for uuid, name, bands, created_at, updated_at in cur]
 
     return {'presets': presets}
 
 
+def _encode_bands(bands):
+    """Encode bands for storage in compact form.
+
+    Bands may arrive as a list or as a JSON string; a string that doesn't
+    parse is stored as-is (and listed as empty).
+    """
+    if isinstance(bands, str):
+        try:
+            bands = json_loads(bands)
+        except ValueError:
+            return bands
+    if isinstance(bands, list):
+        bands = _compact_bands(bands)
+    return json_dumpb(bands)
+
+
 @api_method('eq_presets_save', require='user')
 def eq_presets_save(uuid=None, name=None, bands=None, details=None, _conn=None):
     """Create or update an EQ preset."""
-    import json
-
-    own_conn = _conn is None
     conn = _conn if _conn else get_db()
     cur = conn.cursor()
     user_id = details['user_id']
@@ -197,81 +314,78 @@ def eq_presets_save(uuid=None, name=None, bands=None, details=None, _conn=None):
     if not name or not str(name).strip():
         raise ValueError('Preset name is required')
 
-    # Validate bands (should be JSON string, dict, or list)
-    if isinstance(bands, (dict, list)):
-        bands_json = json.dumps(bands)
+    bands_json = _encode_bands(bands)
+
+    # Either branch is a single statement, so it needs no transaction of its own
+    if uuid:
+        # Update existing
+        cur.execute(_EQ_UPDATE, (name.strip(), bands_json, uuid, user_id))
+
+        if cur.rowcount == 0:
+            raise ValueError('Preset not found or access denied')
     else:
-        bands_json = bands
-
-    now = datetime.utcnow()
-
-    try:
-        if own_conn:
-            cur.execute("BEGIN IMMEDIATE")
-
-        if uuid:
-            # Update existing
-            cur.execute("""
-                UPDATE eq_presets SET name = ?, bands = ?, updated_at = ?
-                WHERE uuid = ? AND user_id = ?
-            """, (name.strip(), bands_json, now, uuid, user_id))
-
-            if cur.rowcount == 0:
-                if own_conn:
-                    cur.execute("ROLLBACK")
-                raise ValueError('Preset not found or access denied')
-        else:
-            # Create new
-            uuid = secrets.token_urlsafe(16)
-            cur.execute("""
-                INSERT INTO eq_presets (uuid, user_id, name, bands, created_at, updated_at)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (uuid, user_id, name.strip(), bands_json, now, now))
-
-        if own_conn:
-            cur.execute("COMMIT")
-        return {'uuid': uuid, 'name': name.strip()}
-    except ValueError:
-        raise
-    except Exception as e:
-        if own_conn:
-            try:
-                cur.execute("ROLLBACK")
-            except:
-                pass
-        raise
+        # Create new
+        uuid = secrets.token_urlsafe(16)
+        cur.execute(_EQ_INSERT, (uuid, user_id, name.strip(), bands_json))
+
+    return {'uuid': uuid, 'name': name.strip()}
 
 
 @api_method('eq_presets_delete', require='user')
 def eq_presets_delete(uuid, details=None, _conn=None):
     """Delete an EQ preset."""
-    own_conn = _conn is None
     conn = _conn if _conn else get_db()
     cur = conn.cursor()
     user_id = details['user_id']
 
-    try:
-        if own_conn:
-            cur.execute("BEGIN IMMEDIATE")
+    # A single statement, so it needs no transaction of its own
+    cur.execute(_EQ_DELETE, (uuid, user_id))
 
-        cur.execute("""
-            DELETE FROM eq_presets WHERE uuid = ? AND user_id = ?
-        """, (uuid, user_id))
+    if cur.rowcount == 0:
+        raise ValueError('Preset not found or access denied')
 
-        if cur.rowcount == 0:
-            if own_conn:
-                cur.execute("ROLLBACK")
+    return {'success': True}
+
+
+@api_method('eq_presets_save_bulk', require='user')
+def eq_presets_save_bulk(presets, details=None, _conn=None):
+    """Create or update several EQ presets in one transaction.
+
+    Each preset is a {uuid, name, bands} dict. A preset without a uuid gets
+    a new one; a uuid that doesn't exist yet is created under that uuid.
+    Fails as a whole if any uuid belongs to another user.
+    """
+    own_conn = _conn is None
+    conn = _conn if _conn else get_db()
+    cur = conn.cursor()
+    user_id = details['user_id']
+
+    rows = []
+    for preset in presets:
+        name = preset.get('name')
+        if not name or not str(name).strip():
+            raise ValueError('Preset name is required')
+        rows.append((preset.get('uuid') or secrets.token_urlsafe(16), user_id,
+                     str(name).strip(), _encode_bands(preset.get('bands'))))
+
+    with write_transaction(conn, own_conn):
+        cur.executemany(_EQ_UPSERT, rows)
+        if cur.rowcount != len(rows):
             raise ValueError('Preset not found or access denied')
 
-        if own_conn:
-            cur.execute("COMMIT")
-        return {'success': True}
-    except ValueError:
-        raise
-    except Exception as e:
-        if own_conn:
-            try:
-                cur.execute("ROLLBACK")
-            except:
-                pass
-        raise
+    return {'presets': [{'uuid': row[0], 'name': row[2]} for row in rows]}
+
+
+@api_method('eq_presets_delete_bulk', require='user')
+def eq_presets_delete_bulk(uuids, details=None, _conn=None):
+    """Delete several EQ presets. Returns how many were deleted."""
+    own_conn = _conn is None
+    conn = _conn if _conn else get_db()
+    cur = conn.cursor()
+    user_id = details['user_id']
+
+    with write_transaction(conn, own_conn):
+        cur.executemany(_EQ_DELETE, [(uuid, user_id) for uuid in uuids])
+        deleted = cur.rowcount
+
+    return {'success': True, 'deleted': deleted}
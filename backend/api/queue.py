@@ -4,54 +4,131 @@ Queue API module for mrepo.
 Provides server-side queue management for playback.
 """
 
-from datetime import datetime
+import json
+import random
 
 from ..app import api_method
-from ..db import get_db, rows_to_list
+from ..db import cursor_columns, get_db, rows_to_list, write_transaction
+from ..jsonutil import JSONStream, json_dumpb
 
+_INSERT_QUEUE = """
+    INSERT INTO user_queue (user_id, song_uuid, position)
+    VALUES (?, ?, ?)
+"""
 
-@api_method('queue_list', require='user')
-def queue_list(cursor=None, limit=None, details=None):
-    """Get the current user's queue."""
-    # Note: cursor/limit ignored - queue is returned in full
-    conn = get_db()
-    cur = conn.cursor()
-    user_id = details['user_id']
 
+def _rank_queue(cur, user_id, order_by='q.position', join='', params=()):
+    """Rewrite a user's queue positions to a contiguous 0-based sequence in
+    `order_by` order (an SQL ORDER BY list over user_queue q plus any `join`,
+    whose placeholders take `params`), in place. Only rows whose position
+    actually changes are written; rows are matched by rowid so duplicate
+    song_uuids stay distinct, and a two-pass negative range dodges the
+    (user_id, position) PRIMARY KEY mid-rewrite."""
+    cur.execute(f"""
+        UPDATE user_queue SET position = -ranked.rn
+        FROM (
+            SELECT q.rowid AS rid, ROW_NUMBER() OVER (ORDER BY {order_by}) AS rn
+            FROM user_queue q {join}
+            WHERE q.user_id = ?
+        ) AS ranked
+        WHERE user_queue.rowid = ranked.rid AND user_queue.position != ranked.rn - 1
+    """, (*params, user_id))
     cur.execute("""
-        SELECT s.uuid, s.type, s.category, s.genre, s.artist, s.album, s.title,
-               s.file, s.album_artist, s.track_number, s.disc_number, s.year,
-               s.duration_seconds, s.seekable, s.replay_gain_track, s.replay_gain_album,
-               s.key, s.bpm, q.position
-        FROM user_queue q
-        JOIN songs s ON q.song_uuid = s.uuid
-        WHERE q.user_id = ?
-        ORDER BY q.position
+        UPDATE user_queue SET position = -position - 1
+        WHERE user_id = ? AND position < 0
     """, (user_id,))
 
-    rows = cur.fetchall()
 
-    # Get playback state
-    cur.execute("""
-        SELECT queue_index, play_mode, sca_enabled, volume, active_device_id, active_device_seq
-        FROM user_playback_state WHERE user_id = ?
-    """, (user_id,))
-    state = cur.fetchone()
+def _queue_length(cur, user_id):
+    """Length of a user's queue. Positions are kept dense from 0, so this is
+    one seek on the (user_id, position) key instead of a COUNT(*) walk."""
+    cur.execute("SELECT MAX(position) FROM user_queue WHERE user_id = ?", (user_id,))
+    max_pos = cur.fetchone()[0]
+    return 0 if max_pos is None else max_pos + 1
+
+
+# Playback state rides along on every queue row (LEFT JOIN, so a user with
+# no state row still gets their queue); queue_list peels it off the first row.
+_QUEUE_LIST = """
+    SELECT {song_columns}, q.position,
+           ps.user_id, ps.queue_index, ps.play_mode, ps.sca_enabled, ps.volume,
+           ps.active_device_id, ps.active_device_seq
+    FROM user_queue q
+    JOIN songs s ON q.song_uuid = s.uuid
+    LEFT JOIN user_playback_state ps ON ps.user_id = q.user_id
+    WHERE q.user_id = ?
+    ORDER BY q.position
+"""
+_QUEUE_LIST_FULL = _QUEUE_LIST.format(song_columns="""
+           s.uuid, s.type, s.category, s.genre, s.artist, s.album, s.title,
+           s.file, s.album_artist, s.track_number, s.disc_number, s.year,
+           s.duration_seconds, s.seekable, s.replay_gain_track, s.replay_gain_album,
+           s.key, s.bpm""")
+# Just what a queue listing displays
+_QUEUE_LIST_MINIMAL = _QUEUE_LIST.format(
+    song_columns="s.uuid, s.title, s.artist, s.album, s.duration_seconds")
+_QUEUE_STATE = """
+    SELECT user_id, queue_index, play_mode, sca_enabled, volume,
+           active_device_id, active_device_seq
+    FROM user_playback_state WHERE user_id = ?
+"""
+_STATE_COLUMNS = 7
+# Queue rows fetched and encoded per streamed chunk
+_QUEUE_LIST_BATCH = 256
+
 
-    active_device_id = state['active_device_id'] if state else None
-    active_device_seq = state['active_device_seq'] if state else 0
+@api_method('queue_list', require='user', raw_json=True)
+def queue_list(cursor=None, limit=None, minimal=False, details=None):
+    """Get the current user's queue.
 
-    return {
-        'items': rows_to_list(rows),
-        'queueIndex': state['queue_index'] if state else 0,
+    Pass minimal=True to get only uuid, title, artist, album,
+    duration_seconds and position for each item. The result is a JSONStream:
+    items are encoded a batch at a time as the response is sent.
+    """
+    # Note: cursor/limit ignored - queue is returned in full
+    conn = get_db()
+    cur = conn.cursor()
+    user_id = details['user_id']
+
+    # Plain tuples: every row is zipped into a dict below anyway
+    cur.row_factory = None
+    cur.execute(_QUEUE_LIST_MINIMAL if minimal else _QUEUE_LIST_FULL, (user_id,))
+    split = len(cur.description) - _STATE_COLUMNS
+    columns = cursor_columns(cur)[:split]
+    # The first batch is read here so query errors surface before streaming
+    rows = cur.fetchmany(_QUEUE_LIST_BATCH)
+
+    if rows:
+        state = rows[0][split:]
+    else:
+        cur.execute(_QUEUE_STATE, (user_id,))
+        state = cur.fetchone() or (None,) * _STATE_COLUMNS
+    (state_user, queue_index, play_mode, sca_enabled, volume,
+     active_device_id, active_device_seq) = state
+    has_state = state_user is not None
+
+    trailer = {
+        'queueIndex': queue_index if has_state else 0,
         'activeDeviceId': active_device_id,
-        'activeDeviceSeq': active_device_seq,
-        'playMode': state['play_mode'] if state else 'sequential',
-        'scaEnabled': bool(state['sca_enabled']) if state else False,
-        'volume': state['volume'] if state else 1.0,
+        'activeDeviceSeq': active_device_seq if has_state else 0,
+        'playMode': play_mode if has_state else 'sequential',
+        'scaEnabled': bool(sca_enabled) if has_state else False,
+        'volume': volume if has_state else 1.0,
         'nextCursor': None,
         'hasMore': False
     }
+    return JSONStream(_queue_list_chunks(cur, columns, rows, trailer))
+
+
+def _queue_list_chunks(cur, columns, rows, trailer):
+    yield b'{"items":['
+    sep = b''
+    while rows:
+        # zip stops at the song columns, leaving the state tail behind
+        yield sep + json_dumpb(rows_to_list(rows, columns))[1:-1]
+        sep = b','
+        rows = cur.fetchmany(_QUEUE_LIST_BATCH)
+    yield b'],' + json_dumpb(trailer)[1:]
 
 
 @api_method('queue_add', require='user')
@@ -79,26 +156,28 @@ def queue_add(song_uuids, position=None, details=None, _conn=None):
             # Append to end
             insert_pos = max_pos + 1
         else:
-            # Insert at position, shift existing
+            # Insert at position, shift existing. Clamped to the queue so
+            # positions stay dense (stale offline replays can send one past
+            # the end). The shift goes through negative positions, as in
+            # _rank_queue, so no row lands on its neighbour's key mid-update
+            position = max(0, min(int(position), max_pos + 1))
             cur.execute("""
                 UPDATE user_queue
-                SET position = position + ?
+                SET position = -(position + ?) - 1
                 WHERE user_id = ? AND position >= ?
             """, (len(song_uuids), user_id, position))
+            cur.execute("""
+                UPDATE user_queue SET position = -position - 1
+                WHERE user_id = ? AND position < 0
+            """, (user_id,))
             insert_pos = position
 
-        added = 0
-        for uuid in song_uuids:
-            cur.execute("""
-                INSERT INTO user_queue (user_id, song_uuid, position)
-                VALUES (?, ?, ?)
-            """, (user_id, uuid, insert_pos))
-            insert_pos += 1
-            added += 1
+        cur.executemany(_INSERT_QUEUE, [
+            (user_id, uuid, insert_pos + i) for i, uuid in enumerate(song_uuids)])
+        added = len(song_uuids)
 
-        # Get final queue length
-        cur.execute("SELECT COUNT(*) FROM user_queue WHERE user_id = ?", (user_id,))
-        queue_length = cur.fetchone()[0]
+        # Positions are dense from 0, so the old length was max_pos + 1
+        queue_length = max_pos + 1 + added
 
         if own_conn:
             cur.execute("COMMIT")
@@ -120,16 +199,23 @@ def queue_add_by_path(path, position=None, limit=1000, details=None):
 
     limit = min(int(limit), 5000)
 
-    cur.execute("""
-        SELECT uuid FROM songs WHERE file LIKE ? ORDER BY file LIMIT ?
-    """, (path + '%', limit))
+    # Every file under the path sorts in [path, path with its last character
+    # bumped), so this is a range scan over idx_songs_file rather than a LIKE
+    # (which can't use the index and reads '%'/'_' in paths as wildcards)
+    upper = path[:-1] + chr(ord(path[-1]) + 1) if path else '\U0010ffff'
+
+    # One transaction for the lookup and the insert
+    with write_transaction(conn):
+        cur.execute("""
+            SELECT uuid FROM songs WHERE file >= ? AND file < ? ORDER BY file LIMIT ?
+        """, (path, upper, limit))
 
-    uuids = [row['uuid'] for row in cur.fetchall()]
+        uuids = [row['uuid'] for row in cur.fetchall()]
 
-    if not uuids:
-        return {'added': 0, 'queueLength': 0}
+        if not uuids:
+            return {'added': 0, 'queueLength': 0}
 
-    return queue_add(uuids, position=position, details=details)
+        return queue_add(uuids, position=position, details=details, _conn=conn)
 
 
 @api_method('queue_add_by_filter', require='user')
@@ -160,16 +246,17 @@ def queue_add_by_filter(category=None, genre=None, artist=None, album=None,
     where_clause = " AND ".join(conditions) if conditions else "1=1"
     order_by = "artist, album, disc_number, track_number"
 
-    cur.execute(f"""
-        SELECT uuid FROM songs WHERE {where_clause} ORDER BY {order_by} LIMIT ?
-    """, params + [limit])
+    with write_transaction(conn):
+        cur.execute(f"""
+            SELECT uuid FROM songs WHERE {where_clause} ORDER BY {order_by} LIMIT ?
+        """, params + [limit])
 
-    uuids = [row['uuid'] for row in cur.fetchall()]
+        uuids = [row['uuid'] for row in cur.fetchall()]
 
-    if not uuids:
-        return {'added': 0, 'queueLength': 0}
+        if not uuids:
+            return {'added': 0, 'queueLength': 0}
 
-    return queue_add(uuids, position=position, details=details)
+        return queue_add(uuids, position=position, details=details, _conn=conn)
 
 
 @api_method('queue_add_by_playlist', require='user')
@@ -179,33 +266,35 @@ def queue_add_by_playlist(playlist_id, position=None, shuffle=False, details=Non
     cur = conn.cursor()
     user_id = details['user_id']
 
-    # Check access
-    cur.execute("""
-        SELECT user_id, is_public FROM playlists WHERE id = ?
-    """, (playlist_id,))
-    playlist = cur.fetchone()
-
-    if not playlist:
-        raise ValueError('Playlist not found')
-    # Compare as strings since user_id column is TEXT
-    if str(playlist['user_id']) != str(user_id) and not playlist['is_public']:
-        raise ValueError('Access denied')
+    # The access check, the song read and the insert share one transaction,
+    # so the playlist can't change underneath them
+    with write_transaction(conn):
+        cur.execute("""
+            SELECT user_id, is_public FROM playlists WHERE id = ?
+        """, (playlist_id,))
+        playlist = cur.fetchone()
 
-    order_by = "RANDOM()" if shuffle else "ps.position"
+        if not playlist:
+            raise ValueError('Playlist not found')
+        # Compare as strings since user_id column is TEXT
+        if str(playlist['user_id']) != str(user_id) and not playlist['is_public']:
+            raise ValueError('Access denied')
 
-    cur.execute(f"""
-        SELECT ps.song_uuid
-        FROM playlist_songs ps
-        WHERE ps.playlist_id = ?
-        ORDER BY {order_by}
-    """, (playlist_id,))
+        cur.execute("""
+            SELECT ps.song_uuid
+            FROM playlist_songs ps
+            WHERE ps.playlist_id = ?
+            ORDER BY ps.position
+        """, (playlist_id,))
 
-    uuids = [row['song_uuid'] for row in cur.fetchall()]
+        uuids = [row['song_uuid'] for row in cur.fetchall()]
+        if shuffle:
+            random.shuffle(uuids)
 
-    if not uuids:
-        return {'success': True, 'added': 0}
+        if not uuids:
+            return {'success': True, 'added': 0}
 
-    return queue_add(uuids, position=position, details=details)
+        return queue_add(uuids, position=position, details=details, _conn=conn)
 
 
 @api_method('queue_remove', require='user')
@@ -217,35 +306,24 @@ def queue_remove(positions, details=None, _conn=None):
     user_id = details['user_id']
 
     if not positions:
-        cur.execute("SELECT COUNT(*) FROM user_queue WHERE user_id = ?", (user_id,))
-        queue_length = cur.fetchone()[0]
+        queue_length = _queue_length(cur, user_id)
         return {'removed': 0, 'queueLength': queue_length}
 
     try:
         if own_conn:
             cur.execute("BEGIN IMMEDIATE")
 
-        # Sort descending to remove from end first
-        positions = sorted(positions, reverse=True)
-
-        for pos in positions:
-            cur.execute("""
-                DELETE FROM user_queue WHERE user_id = ? AND position = ?
-            """, (user_id, pos))
-
-        # Reorder positions
+        # One DELETE for every position; the list rides in as JSON so its
+        # length never runs into the bound-parameter limit
+        positions = [int(p) for p in positions]
         cur.execute("""
-            SELECT song_uuid FROM user_queue WHERE user_id = ? ORDER BY position
-        """, (user_id,))
-        songs = cur.fetchall()
+            DELETE FROM user_queue
+            WHERE user_id = ? AND position IN (SELECT value FROM json_each(?))
+        """, (user_id, json.dumps(positions)))
 
-        cur.execute("DELETE FROM user_queue WHERE user_id = ?", (user_id,))
-
-        for i, song in enumerate(songs):
-            cur.execute("""
-                INSERT INTO user_queue (user_id, song_uuid, position)
-                VALUES (?, ?, ?)
-            """, (user_id, song['song_uuid'], i))
+        # Close the gaps, shifting down only the rows after a removed slot
+        _rank_queue(cur, user_id)
+        queue_length = _queue_length(cur, user_id)
 
         # Maintain the currently-playing index across renumbering. Removal
         # preserves relative order, so the current song shifts left by the
@@ -259,16 +337,16 @@ def queue_remove(positions, details=None, _conn=None):
             current_index = idx_row['queue_index'] or 0
             removed_before = sum(1 for p in positions if p < current_index)
             new_index = current_index - removed_before
-            new_index = 0 if not songs else max(0, min(new_index, len(songs) - 1))
+            new_index = 0 if not queue_length else max(0, min(new_index, queue_length - 1))
             cur.execute("""
                 UPDATE user_playback_state
-                SET queue_index = ?, updated_at = ?
+                SET queue_index = ?, updated_at = CURRENT_TIMESTAMP
                 WHERE user_id = ?
-            """, (new_index, datetime.utcnow(), user_id))
+            """, (new_index, user_id))
 
         if own_conn:
             cur.execute("COMMIT")
-        return {'removed': len(positions), 'queueLength': len(songs)}
+        return {'removed': len(positions), 'queueLength': queue_length}
     except Exception as e:
         if own_conn:
             try:
@@ -290,11 +368,8 @@ def queue_clear(details=None, _conn=None):
         if own_conn:
             cur.execute("BEGIN IMMEDIATE")
 
-        # Get count before clearing
-        cur.execute("SELECT COUNT(*) FROM user_queue WHERE user_id = ?", (user_id,))
-        count = cur.fetchone()[0]
-
         cur.execute("DELETE FROM user_queue WHERE user_id = ?", (user_id,))
+        count = cur.rowcount
 
         # Reset queue index. NOTE: never use INSERT OR REPLACE on
         # user_playback_state — it deletes and re-inserts the row, silently
@@ -302,12 +377,12 @@ def queue_clear(details=None, _conn=None):
         # Changing the queue index must not wipe the active device, or the next
         # focus refresh misdetects the active device and jumps position.
         cur.execute("""
-            INSERT INTO user_playback_state (user_id, queue_index, updated_at)
-            VALUES (?, 0, ?)
+            INSERT INTO user_playback_state (user_id, queue_index)
+            VALUES (?, 0)
             ON CONFLICT(user_id) DO UPDATE SET
                 queue_index = 0,
-                updated_at = excluded.updated_at
-        """, (user_id, datetime.utcnow()))
+                updated_at = CURRENT_TIMESTAMP
+        """, (user_id,))
 
         if own_conn:
             cur.execute("COMMIT")
@@ -333,33 +408,33 @@ def queue_reorder(from_pos, to_pos, details=None, _conn=None):
         if own_conn:
             cur.execute("BEGIN IMMEDIATE")
 
-        # Get all songs
-        cur.execute("""
-            SELECT song_uuid FROM user_queue WHERE user_id = ? ORDER BY position
-        """, (user_id,))
-        songs = [row['song_uuid'] for row in cur.fetchall()]
+        queue_length = _queue_length(cur, user_id)
 
-        if from_pos < 0 or from_pos >= len(songs):
+        if from_pos < 0 or from_pos >= queue_length:
             if own_conn:
                 cur.execute("ROLLBACK")
             raise ValueError('Invalid from_pos')
-        if to_pos < 0 or to_pos >= len(songs):
+        if to_pos < 0 or to_pos >= queue_length:
             if own_conn:
                 cur.execute("ROLLBACK")
             raise ValueError('Invalid to_pos')
 
-        # Reorder in memory
-        song = songs.pop(from_pos)
-        songs.insert(to_pos, song)
-
-        # Update database
-        cur.execute("DELETE FROM user_queue WHERE user_id = ?", (user_id,))
-
-        for i, uuid in enumerate(songs):
-            cur.execute("""
-                INSERT INTO user_queue (user_id, song_uuid, position)
-                VALUES (?, ?, ?)
-            """, (user_id, uuid, i))
+        # Only the rows between the two slots move: the song itself jumps to
+        # to_pos and everything it passes over shifts one step towards
+        # from_pos. Stage through negative positions as in _rank_queue.
+        cur.execute("""
+            UPDATE user_queue SET position = -1 - CASE
+                WHEN position = ? THEN ?
+                WHEN ? < ? THEN position - 1
+                ELSE position + 1
+            END
+            WHERE user_id = ? AND position BETWEEN ? AND ?
+        """, (from_pos, to_pos, from_pos, to_pos, user_id,
+              min(from_pos, to_pos), max(from_pos, to_pos)))
+        cur.execute("""
+            UPDATE user_queue SET position = -position - 1
+            WHERE user_id = ? AND position < 0
+        """, (user_id,))
 
         # Maintain queue_index so the currently-playing song stays anchored
         # after the move (otherwise the stored index keeps pointing at whatever
@@ -376,12 +451,12 @@ def queue_reorder(from_pos, to_pos, details=None, _conn=None):
             else:
                 # Moving up: items in [to_pos, from_pos) shift right by one
                 new_index = ci + 1 if to_pos <= ci < from_pos else ci
-            new_index = max(0, min(new_index, len(songs) - 1)) if songs else 0
+            new_index = max(0, min(new_index, queue_length - 1))
             cur.execute("""
                 UPDATE user_playback_state
-                SET queue_index = ?, updated_at = ?
+                SET queue_index = ?, updated_at = CURRENT_TIMESTAMP
                 WHERE user_id = ?
-            """, (new_index, datetime.utcnow(), user_id))
+            """, (new_index, user_id))
 
         if own_conn:
             cur.execute("COMMIT")
@@ -412,28 +487,20 @@ def queue_reorder_batch(from_positions, to_position, details=None, _conn=None):
         if own_conn:
             cur.execute("BEGIN IMMEDIATE")
 
-        # Get all songs
-        cur.execute("""
-            SELECT song_uuid FROM user_queue WHERE user_id = ? ORDER BY position
-        """, (user_id,))
-        all_uuids = [row['song_uuid'] for row in cur.fetchall()]
+        queue_length = _queue_length(cur, user_id)
 
         # Deduplicate/normalize the source positions and drop out-of-range ones
         from_positions_sorted = sorted(set(int(p) for p in from_positions))
         to_position = int(to_position)
-        valid_positions = [p for p in from_positions_sorted if 0 <= p < len(all_uuids)]
+        valid_positions = [p for p in from_positions_sorted if 0 <= p < queue_length]
 
         if not valid_positions:
             if own_conn:
                 cur.execute("COMMIT")
             return {'success': True, 'moved': 0}
 
-        # Extract items to move (maintaining relative order)
-        items_to_move = [all_uuids[p] for p in valid_positions]
-
-        # Create new list without the moved items
         positions_set = set(valid_positions)
-        remaining = [uuid for i, uuid in enumerate(all_uuids) if i not in positions_set]
+        remaining_count = queue_length - len(valid_positions)
 
         # Calculate adjusted target (account for removed items before target).
         # This matches the frontend reorderQueueBatch math so client and server
@@ -442,19 +509,20 @@ def queue_reorder_batch(from_positions, to_position, details=None, _conn=None):
         for pos in valid_positions:
             if pos < to_position:
                 adjusted_target -= 1
-        adjusted_target = max(0, min(adjusted_target, len(remaining)))
+        adjusted_target = max(0, min(adjusted_target, remaining_count))
 
-        # Build new queue: items before target, moved items, items after target
-        new_queue = remaining[:adjusted_target] + items_to_move + remaining[adjusted_target:]
-
-        # Update database
-        cur.execute("DELETE FROM user_queue WHERE user_id = ?", (user_id,))
-
-        for i, uuid in enumerate(new_queue):
-            cur.execute("""
-                INSERT INTO user_queue (user_id, song_uuid, position)
-                VALUES (?, ?, ?)
-            """, (user_id, uuid, i))
+        # The block lands just before the adjusted_target-th unmoved row, i.e.
+        # before the original position `anchor` (queue_length when it lands at
+        # the end). Sorting the moved rows at anchor - 0.5, ties broken by
+        # position, gives the new order in one ranked UPDATE.
+        anchor = adjusted_target
+        for pos in valid_positions:
+            if pos <= anchor:
+                anchor += 1
+        _rank_queue(cur, user_id, """
+            CASE WHEN q.position IN (SELECT value FROM json_each(?))
+                 THEN ? - 0.5 ELSE q.position END, q.position
+        """, params=(json.dumps(valid_positions), anchor))
 
         # Maintain queue_index across the batch move (positional, exact).
         cur.execute("SELECT queue_index FROM user_playback_state WHERE user_id = ?", (user_id,))
@@ -472,17 +540,17 @@ def queue_reorder_batch(from_positions, to_position, details=None, _conn=None):
                 # lands at/before the current slot.
                 moved_before = sum(1 for p in valid_positions if p < ci)
                 rem_idx = ci - moved_before
-                new_index = rem_idx if rem_idx < adjusted_target else rem_idx + len(items_to_move)
-            new_index = max(0, min(new_index, len(new_queue) - 1)) if new_queue else 0
+                new_index = rem_idx if rem_idx < adjusted_target else rem_idx + len(valid_positions)
+            new_index = max(0, min(new_index, queue_length - 1))
             cur.execute("""
                 UPDATE user_playback_state
-                SET queue_index = ?, updated_at = ?
+                SET queue_index = ?, updated_at = CURRENT_TIMESTAMP
                 WHERE user_id = ?
-            """, (new_index, datetime.utcnow(), user_id))
+            """, (new_index, user_id))
 
         if own_conn:
             cur.execute("COMMIT")
-        return {'success': True, 'moved': len(items_to_move)}
+        return {'success': True, 'moved': len(valid_positions)}
     except Exception as e:
         if own_conn:
             try:
@@ -492,6 +560,29 @@ def queue_reorder_batch(from_positions, to_position, details=None, _conn=None):
         raise
 
 
+# Claims seq for the device only if it is newer than the stored one; returns
+# a row when the claim went through and nothing for a stale or replayed seq
+_DEVICE_SEQ_CLAIM = """
+    INSERT INTO device_queue_seqs (user_id, device_id, seq)
+    VALUES (?, ?, ?)
+    ON CONFLICT(user_id, device_id) DO UPDATE SET seq = excluded.seq
+    WHERE excluded.seq > device_queue_seqs.seq
+    RETURNING seq
+"""
+# Shared by the device-tracked and legacy paths: a NULL device leaves the
+# active device columns as they were (and inserts the column defaults).
+_SET_QUEUE_INDEX = """
+    INSERT INTO user_playback_state (user_id, queue_index, active_device_id, active_device_seq)
+    VALUES (?, ?, ?, COALESCE(?, 0))
+    ON CONFLICT(user_id) DO UPDATE SET
+        queue_index = excluded.queue_index,
+        updated_at = CURRENT_TIMESTAMP,
+        active_device_id = COALESCE(excluded.active_device_id, active_device_id),
+        active_device_seq = CASE WHEN excluded.active_device_id IS NULL
+                                 THEN active_device_seq ELSE excluded.active_device_seq END
+"""
+
+
 @api_method('queue_set_index', require='user')
 def queue_set_index(index, device_id=None, seq=None, details=None, _conn=None):
     """Set the current playback position in the queue.
@@ -506,49 +597,28 @@ def queue_set_index(index, device_id=None, seq=None, details=None, _conn=None):
     cur = conn.cursor()
     user_id = details['user_id']
 
+    # Legacy path: no device tracking, and a lone upsert needs no transaction
+    if device_id is None or seq is None:
+        cur.execute(_SET_QUEUE_INDEX, (user_id, index, None, None))
+        return {'success': True, 'skipped': False}
+
     try:
+        # Each device has its own sequence counter; claiming the seq and moving
+        # the index commit together
         if own_conn:
             cur.execute("BEGIN IMMEDIATE")
 
-        # New device+seq approach: each device has its own sequence counter
-        if device_id is not None and seq is not None:
-            # Get stored seq for this device
-            cur.execute("""
-                SELECT seq FROM device_queue_seqs WHERE user_id = ? AND device_id = ?
-            """, (user_id, device_id))
-            row = cur.fetchone()
-            stored_seq = row['seq'] if row else 0
-
-            # Reject if seq is not higher (stale or replay)
-            if seq <= stored_seq:
-                if own_conn:
-                    cur.execute("ROLLBACK")
-                return {'success': True, 'skipped': True, 'reason': 'stale_seq'}
-
-            # Update this device's seq
-            cur.execute("""
-                INSERT INTO device_queue_seqs (user_id, device_id, seq)
-                VALUES (?, ?, ?)
-                ON CONFLICT(user_id, device_id) DO UPDATE SET seq = ?
-            """, (user_id, device_id, seq, seq))
-
-            # Update position and mark this device as active
-            cur.execute("""
-                INSERT INTO user_playback_state (user_id, queue_index, updated_at, active_device_id, active_device_seq)
-                VALUES (?, ?, ?, ?, ?)
-                ON CONFLICT(user_id) DO UPDATE SET queue_index = ?, updated_at = ?, active_device_id = ?, active_device_seq = ?
-            """, (user_id, index, datetime.utcnow(), device_id, seq, index, datetime.utcnow(), device_id, seq))
-
+        # Reject if seq is not higher than this device's last one (stale or
+        # replay); an unseen device starts from 0
+        claimed = seq > 0 and cur.execute(
+            _DEVICE_SEQ_CLAIM, (user_id, device_id, seq)).fetchall()
+        if not claimed:
             if own_conn:
-                cur.execute("COMMIT")
-            return {'success': True, 'skipped': False}
+                cur.execute("ROLLBACK")
+            return {'success': True, 'skipped': True, 'reason': 'stale_seq'}
 
-        # Legacy path: no device tracking, just update
-        cur.execute("""
-            INSERT INTO user_playback_state (user_id, queue_index, updated_at)
-            VALUES (?, ?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET queue_index = ?, updated_at = ?
-        """, (user_id, index, datetime.utcnow(), index, datetime.utcnow()))
+        # Update position and mark this device as active
+        cur.execute(_SET_QUEUE_INDEX, (user_id, index, device_id, seq))
 
         if own_conn:
             cur.execute("COMMIT")
@@ -583,28 +653,16 @@ def queue_sort(sort_by='artist', order='asc', details=None):
 
 
 def _queue_sort_locked(cur, user_id, sort_by, order):
-    # Get current playing song UUID before sorting
+    # Remember the physical row that is playing (rowid, so a duplicated song
+    # resolves to the exact copy) and read its position back after the sort.
+    # No playback state row means index 0, as everywhere else.
     cur.execute("""
-        SELECT queue_index FROM user_playback_state WHERE user_id = ?
+        SELECT q.rowid FROM user_queue q
+        LEFT JOIN user_playback_state ps ON ps.user_id = q.user_id
+        WHERE q.user_id = ? AND q.position = COALESCE(ps.queue_index, 0)
     """, (user_id,))
-    state = cur.fetchone()
-    current_index = state['queue_index'] if state else 0
-
-    cur.execute("""
-        SELECT song_uuid FROM user_queue WHERE user_id = ? AND position = ?
-    """, (user_id, current_index))
     current_song = cur.fetchone()
-    current_uuid = current_song['song_uuid'] if current_song else None
-
-    # Count which occurrence of this UUID we're at (1st, 2nd, 3rd, etc.)
-    # This handles duplicate songs in the queue correctly
-    current_occurrence = 0
-    if current_uuid:
-        cur.execute("""
-            SELECT COUNT(*) FROM user_queue
-            WHERE user_id = ? AND song_uuid = ? AND position <= ?
-        """, (user_id, current_uuid, current_index))
-        current_occurrence = cur.fetchone()[0]  # 1-based count
+    current_rowid = current_song[0] if current_song else None
 
     sort_map = {
         'title': 's.title',
@@ -613,56 +671,59 @@ def _queue_sort_locked(cur, user_id, sort_by, order):
         'track': 's.artist, s.album, s.disc_number, s.track_number',
         'year': 's.year',
         'duration': 's.duration_seconds',
-        'random': 'RANDOM()',
     }
-    order_by = sort_map.get(sort_by, 's.artist, s.album, s.disc_number, s.track_number')
-    order_dir = 'DESC' if order.lower() == 'desc' else 'ASC'
+    join = 'LEFT JOIN songs s ON q.song_uuid = s.uuid'
+    params = ()
+    if sort_by == 'random':
+        # Shuffle the rowids here and rank by their index in the shuffled
+        # list, rather than sorting every row on RANDOM()
+        cur.execute("SELECT rowid FROM user_queue WHERE user_id = ?", (user_id,))
+        rowids = [row[0] for row in cur.fetchall()]
+        random.shuffle(rowids)
+        order_by = 'j.key'
+        join += ' JOIN json_each(?) j ON j.value = q.rowid'
+        params = (json.dumps(rowids),)
+    else:
+        order_by = sort_map.get(sort_by, 's.artist, s.album, s.disc_number, s.track_number')
+        order_dir = 'DESC' if order.lower() == 'desc' else 'ASC'
+        # Ties keep their current relative order
+        order_by = f'{order_by} {order_dir}, q.position'
+
+    # Queue rows whose song has vanished from the library sink to the end
+    _rank_queue(cur, user_id, f's.uuid IS NULL, {order_by}', join=join, params=params)
+    queue_length = _queue_length(cur, user_id)
 
-    cur.execute(f"""
-        SELECT q.song_uuid
-        FROM user_queue q
-        JOIN songs s ON q.song_uuid = s.uuid
-        WHERE q.user_id = ?
-        ORDER BY {order_by} {order_dir if sort_by != 'random' else ''}
-    """, (user_id,))
-
-    songs = [row['song_uuid'] for row in cur.fetchall()]
-
-    # Update positions
-    cur.execute("DELETE FROM user_queue WHERE user_id = ?", (user_id,))
-
-    for i, uuid in enumerate(songs):
-        cur.execute("""
-            INSERT INTO user_queue (user_id, song_uuid, position)
-            VALUES (?, ?, ?)
-        """, (user_id, uuid, i))
-
-    # Find new index of current song (handling duplicates)
     new_index = 0
-    if current_uuid and current_uuid in songs:
-        # Find the nth occurrence of this UUID in the sorted list
-        occurrence_count = 0
-        for i, uuid in enumerate(songs):
-            if uuid == current_uuid:
-                occurrence_count += 1
-                if occurrence_count == current_occurrence:
-                    new_index = i
-                    break
-        else:
-            # If exact occurrence not found, use last occurrence
-            for i in range(len(songs) - 1, -1, -1):
-                if songs[i] == current_uuid:
-                    new_index = i
-                    break
+    if current_rowid is not None:
+        cur.execute("SELECT position FROM user_queue WHERE rowid = ?", (current_rowid,))
+        new_index = cur.fetchone()[0]
 
     # Update queue_index to point to the same song
     cur.execute("""
-        UPDATE user_playback_state SET queue_index = ?, updated_at = ?
+        UPDATE user_playback_state SET queue_index = ?, updated_at = CURRENT_TIMESTAMP
         WHERE user_id = ?
-    """, (new_index, datetime.utcnow(), user_id))
+    """, (new_index, user_id))
 
     cur.execute("COMMIT")
-    return {'success': True, 'queueLength': len(songs), 'newIndex': new_index}
+    return {'success': True, 'queueLength': queue_length, 'newIndex': new_index}
+
+
+# Lowest counter >= 2 for which "<name> (<counter>)" is not one of the user's
+# playlist names. A gap always sits at 2 or just above a taken counter, so
+# only those candidates are checked.
+_FREE_NAME_COUNTER = """
+    WITH taken(n) AS (
+        SELECT CAST(substr(name, :len + 3, length(name) - :len - 3) AS INTEGER)
+        FROM playlists
+        WHERE user_id = :user_id
+          AND substr(name, 1, :len + 2) = :name || ' ('
+          AND substr(name, -1) = ')'
+          AND substr(name, :len + 3, length(name) - :len - 3) GLOB '[1-9]*'
+          AND substr(name, :len + 3, length(name) - :len - 3) NOT GLOB '*[^0-9]*'
+    )
+    SELECT MIN(c) FROM (SELECT 2 AS c UNION ALL SELECT n + 1 FROM taken)
+    WHERE c NOT IN (SELECT n FROM taken)
+"""
 
 
 @api_method('queue_save_as_playlist', require='user')
@@ -677,38 +738,30 @@ def queue_save_as_playlist(name, description='', is_public=False, details=None):
 
     final_name = name.strip()
 
-    # Handle duplicate names by appending (2), (3), etc.
-    cur.execute("""
-        SELECT name FROM playlists WHERE user_id = ? AND name LIKE ?
-    """, (user_id, final_name + '%'))
-    existing = [row['name'] for row in cur.fetchall()]
-
-    if final_name in existing:
-        counter = 2
-        while f"{final_name} ({counter})" in existing:
-            counter += 1
-        final_name = f"{final_name} ({counter})"
-
-    # Create playlist
-    cur.execute("""
-        INSERT INTO playlists (user_id, name, description, is_public)
-        VALUES (?, ?, ?, ?)
-    """, (user_id, final_name, description or '', 1 if is_public else 0))
-    playlist_id = cur.lastrowid
-
-    # Preserve the full queue order INCLUDING duplicates - a playlist may
-    # legitimately contain the same song more than once, so saving a queue that
-    # repeats a song must keep every copy.
-    cur.execute("""
-        SELECT song_uuid FROM user_queue WHERE user_id = ? ORDER BY position
-    """, (user_id,))
-    songs = cur.fetchall()
-
-    # Add songs to playlist
-    for i, song in enumerate(songs):
+    # Name check, playlist row and song copy commit together
+    with write_transaction(conn):
+        # Handle duplicate names by appending the lowest free (2), (3), etc.
+        cur.execute("SELECT 1 FROM playlists WHERE user_id = ? AND name = ? LIMIT 1",
+                    (user_id, final_name))
+        if cur.fetchone():
+            cur.execute(_FREE_NAME_COUNTER, {'user_id': user_id, 'name': final_name,
+                                             'len': len(final_name)})
+            final_name = f"{final_name} ({cur.fetchone()[0]})"
+
+        # Create playlist
+        cur.execute("""
+            INSERT INTO playlists (user_id, name, description, is_public)
+            VALUES (?, ?, ?, ?)
+        """, (user_id, final_name, description or '', 1 if is_public else 0))
+        playlist_id = cur.lastrowid
+
+        # Preserve the full queue order INCLUDING duplicates - a playlist may
+        # legitimately contain the same song more than once, so saving a queue that
+        # repeats a song must keep every copy.
         cur.execute("""
             INSERT INTO playlist_songs (playlist_id, song_uuid, position)
-            VALUES (?, ?, ?)
-        """, (playlist_id, song['song_uuid'], i))
+            SELECT ?, song_uuid, ROW_NUMBER() OVER (ORDER BY position) - 1
+            FROM user_queue WHERE user_id = ?
+        """, (playlist_id, user_id))
 
-    return {'playlist_id': playlist_id, 'name': final_name, 'songs_added': len(songs)}
+        return {'playlist_id': playlist_id, 'name': final_name, 'songs_added': cur.rowcount}
@@ -5,14 +5,145 @@ Provides radio mode using filter-based song selection.
 API-compatible with the original swapi-apps music.py radio methods.
 """
 
+import json
+import os
+import queue
+import random
 import secrets
 import re
-from datetime import datetime
+import threading
+from array import array
+from collections import OrderedDict
+from functools import lru_cache
 
 from ..app import api_method
-from ..db import get_db, rows_to_list, row_to_dict
+from ..db import cursor_columns, get_data_version, get_db, rows_to_list, write_transaction
+
+# SQL is kept in module constants so every call sends identical text and is
+# served from the connection's prepared-statement cache
+_SONG_COLUMN_NAMES = (
+    'uuid', 'type', 'category', 'genre', 'artist', 'album', 'title', 'file',
+    'album_artist', 'track_number', 'disc_number', 'year', 'duration_seconds',
+    'seekable', 'replay_gain_track', 'replay_gain_album', 'key', 'bpm')
+_SONG_COLUMNS = ', '.join(_SONG_COLUMN_NAMES)
+_S_SONG_COLUMNS = ', '.join(f's.{c}' for c in _SONG_COLUMN_NAMES)
+
+_SONG_BY_UUID = f"SELECT {_SONG_COLUMNS} FROM songs WHERE uuid = ?"
+
+# Songs for a JSON list of uuids, in list order
+_SONGS_BY_UUIDS = f"""
+    SELECT {_S_SONG_COLUMNS}
+    FROM json_each(?) j JOIN songs s ON s.uuid = j.value
+    ORDER BY j.key
+"""
+
+_RADIO_QUEUE_ITEMS = f"""
+    SELECT {_S_SONG_COLUMNS}
+    FROM radio_queue rq
+    JOIN radio_sessions rs ON rs.session_id = rq.session_id
+    JOIN songs s ON rq.song_uuid = s.uuid
+    WHERE rq.session_id = ? AND rs.user_id = ?
+    ORDER BY rq.position
+    LIMIT ?
+"""
+
+# Random pool songs not yet in the user's queue
+_RANDOM_POOL_SONGS = f"""
+    SELECT {_S_SONG_COLUMNS}
+    FROM songs s
+    JOIN sca_song_pool p ON s.uuid = p.song_uuid
+    WHERE p.user_id = ?
+      AND s.uuid NOT IN (SELECT song_uuid FROM user_queue WHERE user_id = ?)
+    ORDER BY RANDOM()
+    LIMIT ?
+"""
 
+# Turns SCA mode on at the head of the queue; a new state row gets its
+# updated_at from the column default
+_ENABLE_SCA = """
+    INSERT INTO user_playback_state (user_id, sca_enabled, queue_index)
+    VALUES (?, 1, 0)
+    ON CONFLICT(user_id) DO UPDATE SET
+        sca_enabled = 1, queue_index = 0, updated_at = CURRENT_TIMESTAMP
+"""
+
+# Append a JSON list of uuids after the current last position, numbering
+# them in list order; the MAX is an uncorrelated subquery, read once
+_APPEND_RADIO_QUEUE = """
+    INSERT INTO radio_queue (session_id, song_uuid, position)
+    SELECT ?, j.value,
+           (SELECT COALESCE(MAX(position), -1) + 1 FROM radio_queue WHERE session_id = ?) + j.key
+    FROM json_each(?) j
+"""
+_APPEND_USER_QUEUE = """
+    INSERT INTO user_queue (user_id, song_uuid, position)
+    SELECT ?, j.value,
+           (SELECT COALESCE(MAX(position), -1) + 1 FROM user_queue WHERE user_id = ?) + j.key
+    FROM json_each(?) j
+"""
 
+# Run with executemany; the pool and seeds are sets, so repeats are dropped
+_INSERT_SCA_POOL = "INSERT OR IGNORE INTO sca_song_pool (user_id, song_uuid) VALUES (?, ?)"
+_INSERT_SCA_SEED = "INSERT OR IGNORE INTO sca_original_seeds (user_id, song_uuid) VALUES (?, ?)"
+
+_INSERT_USER_QUEUE = """
+    INSERT INTO user_queue (user_id, song_uuid, position)
+    VALUES (?, ?, ?)
+"""
+
+# Removes and returns the first song of a radio session's queue, skipping
+# entries whose song has left the library
+_POP_RADIO_QUEUE = """
+    DELETE FROM radio_queue
+    WHERE session_id = ? AND position = (
+        SELECT MIN(rq.position) FROM radio_queue rq
+        JOIN songs s ON rq.song_uuid = s.uuid
+        WHERE rq.session_id = ?
+    )
+    RETURNING song_uuid
+"""
+
+# Songs for a random sample of rowids (a JSON list), kept in sample order;
+# the second form skips songs already in a radio session's queue or in a
+# second JSON list of uuids
+_SONGS_BY_ROWIDS = """
+    WITH picked(pos, rid) AS (SELECT key, value FROM json_each(?))
+    SELECT {columns}
+    FROM picked JOIN songs ON songs.rowid = picked.rid
+    {exclude}
+    ORDER BY picked.pos
+    LIMIT ?
+"""
+_UNQUEUED_SONGS_BY_ROWIDS = _SONGS_BY_ROWIDS.format(
+    columns=_SONG_COLUMNS,
+    exclude="""WHERE uuid NOT IN (SELECT song_uuid FROM radio_queue WHERE session_id = ?)
+      AND uuid NOT IN (SELECT value FROM json_each(?))""")
+_SONGS_BY_ROWIDS = _SONGS_BY_ROWIDS.format(columns=_SONG_COLUMNS, exclude='')
+
+# Rowids of the songs matching each radio filter, cached under keys that start
+# with the database data version (as browse does), so any write retires them.
+# Random picks sample this list and fetch just the chosen rows, instead of
+# having SQLite give every matching row a RANDOM() value and sort them all.
+_ROWID_CACHE_SIZE = 32
+_rowid_cache = OrderedDict()
+_rowid_lock = threading.Lock()
+
+_AND_SPLIT = re.compile(r'\s+AND\s+', re.IGNORECASE)
+_FILTER_PART = re.compile(r'^(\w+):(\w+):(.+)$')
+
+# Field abbreviations in filter queries, mapped to song column names
+_FILTER_FIELDS = {
+    'c': 'category',
+    'g': 'genre',
+    'a': 'artist',
+    'aa': 'album_artist',
+    'al': 'album',
+    't': 'title',
+    'year': 'year',
+}
+
+
+@lru_cache(maxsize=512)
 def _parse_filter_query(filter_query):
     """
     Parse a filter query string into SQL conditions.
@@ -26,16 +157,17 @@ def _parse_filter_query(filter_query):
     - year:lte:Value - year <= value
     - AND/OR connectors
 
-    Returns (where_clause, params)
+    Returns (where_clause, params), with params as a tuple since results
+    are cached per filter string.
     """
     if not filter_query:
-        return "1=1", []
+        return "1=1", ()
 
     conditions = []
     params = []
 
     # Split by AND/OR (simple parsing)
-    parts = re.split(r'\s+AND\s+', filter_query, flags=re.IGNORECASE)
+    parts = _AND_SPLIT.split(filter_query)
 
     for part in parts:
         part = part.strip()
@@ -43,24 +175,13 @@ def _parse_filter_query(filter_query):
             continue
 
         # Parse field:op:value format
-        match = re.match(r'^(\w+):(\w+):(.+)$', part)
+        match = _FILTER_PART.match(part)
         if not match:
             continue
 
         field, op, value = match.groups()
 
-        # Map field abbreviations to column names
-        field_map = {
-            'c': 'category',
-            'g': 'genre',
-            'a': 'artist',
-            'aa': 'album_artist',
-            'al': 'album',
-            't': 'title',
-            'year': 'year',
-        }
-
-        column = field_map.get(field.lower(), field.lower())
+        column = _FILTER_FIELDS.get(field.lower(), field.lower())
 
         if op == 'eq':
             conditions.append(f"{column} = ?")
@@ -76,49 +197,95 @@ def _parse_filter_query(filter_query):
             params.append(value)
 
     if not conditions:
-        return "1=1", []
+        return "1=1", ()
+
+    return " AND ".join(conditions), tuple(params)
+
 
-    return " AND ".join(conditions), params
+def _fetch_songs(cur):
+    """The song rows of the last query as dicts.
+
+    Every song query here selects _SONG_COLUMN_NAMES, so the names are
+    zipped with each row rather than read off every Row's keys.
+    """
+    return rows_to_list(cur.fetchall(), _SONG_COLUMN_NAMES)
 
 
 def _get_song_by_uuid(cur, uuid):
     """Get full song details by UUID."""
-    cur.execute("""
-        SELECT uuid, type, category, genre, artist, album, title, file,
-               album_artist, track_number, disc_number, year, duration_seconds,
-               seekable, replay_gain_track, replay_gain_album, key, bpm
-        FROM songs WHERE uuid = ?
-    """, (uuid,))
-    return cur.fetchone()
+    cur.execute(_SONG_BY_UUID, (uuid,))
+    songs = _fetch_songs(cur)
+    return songs[0] if songs else None
+
+
+def _songs_by_uuids(cur, uuids):
+    """Full song details for a list of UUIDs, in list order (missing ones skipped)."""
+    cur.execute(_SONGS_BY_UUIDS, (json.dumps(uuids),))
+    return _fetch_songs(cur)
+
+
+def _append_user_queue(cur, user_id, songs):
+    """Append songs to the end of the user's queue, in order."""
+    cur.execute(_APPEND_USER_QUEUE, (
+        user_id, user_id, json.dumps([song['uuid'] for song in songs])))
+
+
+def _matching_rowids(cur, where_clause, params):
+    """Rowids of the songs matching where_clause (cached until the database changes)."""
+    key = (get_data_version(), where_clause, tuple(params))
+    with _rowid_lock:
+        rowids = _rowid_cache.get(key)
+        if rowids is not None:
+            _rowid_cache.move_to_end(key)
+            return rowids
+    cur.execute(f"SELECT rowid FROM songs WHERE {where_clause}", params)
+    rowids = array('q', (row[0] for row in cur))
+    with _rowid_lock:
+        _rowid_cache[key] = rowids
+        while len(_rowid_cache) > _ROWID_CACHE_SIZE:
+            _rowid_cache.popitem(last=False)
+    return rowids
+
+
+def _random_songs(cur, where_clause, params, count, session_id=None, exclude=()):
+    """Up to count distinct songs matching where_clause, in random order.
+
+    With session_id, songs already in that session's radio queue, or whose
+    uuid is in exclude, are skipped in SQL; extra rowids are sampled so
+    they don't leave it short.
+    """
+    rowids = _matching_rowids(cur, where_clause, params)
+    sample_size = count * 3 + len(exclude) if session_id is not None else count
+    picked = random.sample(rowids, min(sample_size, len(rowids)))
+    if not picked:
+        return []
+    if session_id is None:
+        cur.execute(_SONGS_BY_ROWIDS, (json.dumps(picked), count))
+    else:
+        cur.execute(_UNQUEUED_SONGS_BY_ROWIDS, (
+            json.dumps(picked), session_id, json.dumps(list(exclude)), count))
+    return _fetch_songs(cur)
 
 
-def _get_random_song(cur, filter_query=None):
-    """Get a random song, optionally filtered."""
-    where_clause, params = _parse_filter_query(filter_query)
-    cur.execute(f"""
-        SELECT uuid, type, category, genre, artist, album, title, file,
-               album_artist, track_number, disc_number, year, duration_seconds,
-               seekable, replay_gain_track, replay_gain_album, key, bpm
-        FROM songs WHERE {where_clause}
-        ORDER BY RANDOM() LIMIT 1
-    """, params)
-    return cur.fetchone()
+def _get_random_song(cur, filter_query=None, parsed=None):
+    """Get a random song, optionally filtered.
+
+    parsed is the (where_clause, params) of filter_query, for callers
+    that have already parsed it.
+    """
+    where_clause, params = parsed or _parse_filter_query(filter_query)
+    songs = _random_songs(cur, where_clause, params, 1)
+    return songs[0] if songs else None
 
 
-def _populate_queue(cur, session_id, seed_song, count=10, filter_query=None):
+def _populate_queue(cur, session_id, seed_song, count=10, filter_query=None, parsed=None):
     """
     Populate the radio queue with songs similar to the seed.
 
     Simple algorithm: find songs in the same category/genre as seed,
-    excluding already-queued songs.
+    excluding already-queued songs. parsed is as for _get_random_song.
     """
-    where_clause, params = _parse_filter_query(filter_query)
-
-    # Get existing queue UUIDs to exclude
-    cur.execute("""
-        SELECT song_uuid FROM radio_queue WHERE session_id = ?
-    """, (session_id,))
-    existing = {row['song_uuid'] for row in cur.fetchall()}
+    where_clause, params = parsed or _parse_filter_query(filter_query)
 
     # Start with filter conditions
     conditions = [where_clause] if where_clause != "1=1" else []
@@ -135,52 +302,98 @@ def _populate_queue(cur, session_id, seed_song, count=10, filter_query=None):
 
     final_where = " AND ".join(conditions) if conditions else "1=1"
 
-    # Get candidate songs
-    cur.execute(f"""
-        SELECT uuid, type, category, genre, artist, album, title, file,
-               album_artist, track_number, disc_number, year, duration_seconds,
-               seekable, replay_gain_track, replay_gain_album, key, bpm
-        FROM songs
-        WHERE {final_where}
-        ORDER BY RANDOM()
-        LIMIT ?
-    """, query_params + [count * 3])  # Get extra to filter out existing
-
-    candidates = [row for row in cur.fetchall() if row['uuid'] not in existing]
+    # Get candidate songs not already queued
+    candidates = _random_songs(cur, final_where, query_params, count, session_id)
 
     # If not enough songs, try without category/genre filter
+    # (skipping the ones already picked, which aren't queued yet)
     if len(candidates) < count and filter_query is None:
-        cur.execute("""
-            SELECT uuid, type, category, genre, artist, album, title, file,
-                   album_artist, track_number, disc_number, year, duration_seconds,
-                   seekable, replay_gain_track, replay_gain_album, key, bpm
-            FROM songs
-            ORDER BY RANDOM()
-            LIMIT ?
-        """, (count * 3,))
-        more = [row for row in cur.fetchall()
-                if row['uuid'] not in existing and row['uuid'] not in {c['uuid'] for c in candidates}]
-        candidates.extend(more)
-
-    # Take only what we need
-    selected = candidates[:count]
-
-    # Get max position
+        candidates += _random_songs(cur, "1=1", (), count - len(candidates), session_id,
+                                    exclude=[c['uuid'] for c in candidates])
+
+    # Append to the end of the queue
+    cur.execute(_APPEND_RADIO_QUEUE, (
+        session_id, session_id, json.dumps([song['uuid'] for song in candidates])))
+
+    return candidates
+
+
+def _fill_radio_pool(cur, user_id):
+    """
+    Fill an empty SCA pool with the songs matching the user's newest radio
+    filter, so sca_populate_queue can keep adding songs during playback.
+
+    Does nothing unless SCA is on and the pool is still empty, so a late
+    fill can't clobber a pool that sca_start_* or a newer radio_start has
+    since set up. Call inside a write transaction. Returns the number of
+    songs added.
+    """
     cur.execute("""
-        SELECT MAX(position) FROM radio_queue WHERE session_id = ?
-    """, (session_id,))
-    result = cur.fetchone()
-    next_pos = (result[0] or -1) + 1
+        SELECT rs.filter_query FROM radio_sessions rs
+        WHERE rs.user_id = ?
+          AND EXISTS (SELECT 1 FROM user_playback_state
+                      WHERE user_id = rs.user_id AND sca_enabled = 1)
+          AND NOT EXISTS (SELECT 1 FROM sca_song_pool WHERE user_id = rs.user_id)
+        ORDER BY rs.rowid DESC
+        LIMIT 1
+    """, (user_id,))
+    session = cur.fetchone()
+    if not session:
+        return 0
+
+    where_clause, params = _parse_filter_query(session['filter_query'])
+    cur.execute(f"""
+        INSERT INTO sca_song_pool (user_id, song_uuid)
+        SELECT ?, uuid FROM songs WHERE {where_clause}
+    """, (user_id, *params))
+    return cur.rowcount
 
-    # Insert into queue
-    for song in selected:
-        cur.execute("""
-            INSERT INTO radio_queue (session_id, song_uuid, position)
-            VALUES (?, ?, ?)
-        """, (session_id, song['uuid'], next_pos))
-        next_pos += 1
 
-    return [row_to_dict(s) for s in selected]
+class _PoolFiller:
+    """Fills radio SCA pools off the request path.
+
+    Every song matching a radio filter goes into the pool, which on an
+    unfiltered library is the whole library. radio_start hands that to
+    this thread once its session and first queue are committed, so the
+    response doesn't wait on it. sca_populate_queue fills the pool itself
+    if it finds it still empty (e.g. when another worker took the call).
+    """
+
+    def __init__(self):
+        self.pending = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name='radio-pool-filler', daemon=True)
+        self.thread.start()
+
+    def submit(self, user_id):
+        """Queue a pool fill for the user."""
+        self.pending.put(user_id)
+
+    def _run(self):
+        while True:
+            user_id = self.pending.get()
+            try:
+                conn = get_db()
+                with write_transaction(conn):
+                    _fill_radio_pool(conn.cursor(), user_id)
+            except Exception as e:
+                print(f"Radio pool fill failed: {e}")
+            finally:
+                self.pending.task_done()
+
+
+_pool_filler = None
+_pool_filler_pid = None
+_pool_filler_lock = threading.Lock()
+
+
+def _get_pool_filler():
+    """The pool filler for this process (started lazily, after any fork)."""
+    global _pool_filler, _pool_filler_pid
+    with _pool_filler_lock:
+        if _pool_filler is None or _pool_filler_pid != os.getpid():
+            _pool_filler = _PoolFiller()
+            _pool_filler_pid = os.getpid()
+        return _pool_filler
 
 
 @api_method('radio_start', require='user')
@@ -200,57 +413,50 @@ def radio_start(seed_uuid=None, filter_query=None, details=None):
     user_id = details['user_id']
 
     session_id = secrets.token_urlsafe(16)
+    parsed = _parse_filter_query(filter_query)
 
-    # Get or select seed song
-    if seed_uuid:
-        seed = _get_song_by_uuid(cur, seed_uuid)
-    else:
-        seed = _get_random_song(cur, filter_query)
+    # Session, queue and state are written as one transaction
+    with write_transaction(conn):
+        # Get or select seed song
+        if seed_uuid:
+            seed = _get_song_by_uuid(cur, seed_uuid)
+        else:
+            seed = _get_random_song(cur, filter_query, parsed=parsed)
 
-    if not seed:
-        return {'error': 'No songs found matching filter'}
+        if not seed:
+            return {'error': 'No songs found matching filter'}
 
-    # Create session
-    cur.execute("""
-        INSERT INTO radio_sessions (session_id, user_id, filter_query, seed_uuid)
-        VALUES (?, ?, ?, ?)
-    """, (session_id, user_id, filter_query, seed['uuid']))
+        # Create session
+        cur.execute("""
+            INSERT INTO radio_sessions (session_id, user_id, filter_query, seed_uuid)
+            VALUES (?, ?, ?, ?)
+        """, (session_id, user_id, filter_query, seed['uuid']))
 
-    # Populate initial queue
-    queue = _populate_queue(cur, session_id, seed, count=10, filter_query=filter_query)
+        # Populate initial queue
+        queue = _populate_queue(cur, session_id, seed, count=10,
+                                filter_query=filter_query, parsed=parsed)
 
-    # Sync radio queue to user_queue table so it persists across refreshes
-    # Clear existing queue
-    cur.execute("DELETE FROM user_queue WHERE user_id = ?", (user_id,))
+        # Sync radio queue to user_queue table so it persists across refreshes
+        # Clear existing queue
+        cur.execute("DELETE FROM user_queue WHERE user_id = ?", (user_id,))
 
-    # Add seed song first, then queue songs
-    all_songs = [row_to_dict(seed)] + queue
-    for i, song in enumerate(all_songs):
-        cur.execute("""
-            INSERT INTO user_queue (user_id, song_uuid, position)
-            VALUES (?, ?, ?)
-        """, (user_id, song['uuid'], i))
+        # Add seed song first, then queue songs
+        all_songs = [seed] + queue
+        cur.executemany(_INSERT_USER_QUEUE, [
+            (user_id, song['uuid'], i) for i, song in enumerate(all_songs)])
 
-    # Populate sca_song_pool with songs matching the filter
-    # This allows sca_populate_queue to add more songs during playback
-    cur.execute("DELETE FROM sca_song_pool WHERE user_id = ?", (user_id,))
+        # Empty the old sca_song_pool; it is refilled with the songs matching
+        # the filter after this commits (see _PoolFiller)
+        cur.execute("DELETE FROM sca_song_pool WHERE user_id = ?", (user_id,))
 
-    where_clause, params = _parse_filter_query(filter_query)
-    cur.execute(f"""
-        INSERT INTO sca_song_pool (user_id, song_uuid)
-        SELECT ?, uuid FROM songs WHERE {where_clause}
-    """, [user_id] + params)
+        # Enable SCA mode in playback state so it persists across refreshes
+        cur.execute(_ENABLE_SCA, (user_id,))
 
-    # Enable SCA mode in playback state so it persists across refreshes
-    cur.execute("""
-        INSERT INTO user_playback_state (user_id, sca_enabled, queue_index, updated_at)
-        VALUES (?, 1, 0, ?)
-        ON CONFLICT(user_id) DO UPDATE SET sca_enabled = 1, queue_index = 0, updated_at = ?
-    """, (user_id, datetime.utcnow(), datetime.utcnow()))
+    _get_pool_filler().submit(user_id)
 
     return {
         'session_id': session_id,
-        'seed': row_to_dict(seed),
+        'seed': seed,
         'queue': queue
     }
 
@@ -266,76 +472,49 @@ def radio_next(session_id, details=None):
     cur = conn.cursor()
     user_id = details['user_id']
 
-    # Get session
-    cur.execute("""
-        SELECT session_id, filter_query, seed_uuid FROM radio_sessions
-        WHERE session_id = ? AND user_id = ?
-    """, (session_id, user_id))
-    session = cur.fetchone()
+    with write_transaction(conn):
+        # Get session
+        cur.execute("""
+            SELECT session_id, filter_query, seed_uuid FROM radio_sessions
+            WHERE session_id = ? AND user_id = ?
+        """, (session_id, user_id))
+        session = cur.fetchone()
 
-    if not session:
-        return {'error': 'Session not found'}
+        if not session:
+            return {'error': 'Session not found'}
 
-    # Get next from queue
-    cur.execute("""
-        SELECT rq.position, s.uuid, s.type, s.category, s.genre, s.artist, s.album,
-               s.title, s.file, s.album_artist, s.track_number, s.disc_number,
-               s.year, s.duration_seconds, s.seekable,
-               s.replay_gain_track, s.replay_gain_album, s.key, s.bpm
-        FROM radio_queue rq
-        JOIN songs s ON rq.song_uuid = s.uuid
-        WHERE rq.session_id = ?
-        ORDER BY rq.position
-        LIMIT 1
-    """, (session_id,))
-    next_item = cur.fetchone()
+        # Pop the next queued song still in the library
+        cur.execute(_POP_RADIO_QUEUE, (session_id, session_id))
+        popped = cur.fetchone()
 
-    if not next_item:
-        # Queue empty, try to populate more
-        seed = _get_song_by_uuid(cur, session['seed_uuid'])
-        _populate_queue(cur, session_id, seed, count=10, filter_query=session['filter_query'])
-
-        # Try again
-        cur.execute("""
-            SELECT rq.position, s.uuid, s.type, s.category, s.genre, s.artist, s.album,
-                   s.title, s.file, s.album_artist, s.track_number, s.disc_number,
-                   s.year, s.duration_seconds, s.seekable,
-                   s.replay_gain_track, s.replay_gain_album, s.key, s.bpm
-            FROM radio_queue rq
-            JOIN songs s ON rq.song_uuid = s.uuid
-            WHERE rq.session_id = ?
-            ORDER BY rq.position
-            LIMIT 1
-        """, (session_id,))
-        next_item = cur.fetchone()
+        if not popped:
+            # Queue empty, try to populate more
+            seed = _get_song_by_uuid(cur, session['seed_uuid'])
+            _populate_queue(cur, session_id, seed, count=10, filter_query=session['filter_query'])
 
-    if not next_item:
-        return {'error': 'No more songs available'}
+            # Try again
+            cur.execute(_POP_RADIO_QUEUE, (session_id, session_id))
+            popped = cur.fetchone()
 
-    # Remove from queue
-    cur.execute("""
-        DELETE FROM radio_queue WHERE session_id = ? AND position = ?
-    """, (session_id, next_item['position']))
+        if not popped:
+            return {'error': 'No more songs available'}
 
-    # Update session activity and seed
-    cur.execute("""
-        UPDATE radio_sessions SET last_activity = ?, seed_uuid = ?
-        WHERE session_id = ?
-    """, (datetime.utcnow(), next_item['uuid'], session_id))
+        next_item = _get_song_by_uuid(cur, popped['song_uuid'])
 
-    # Check if queue is running low, repopulate if needed
-    cur.execute("""
-        SELECT COUNT(*) FROM radio_queue WHERE session_id = ?
-    """, (session_id,))
-    remaining = cur.fetchone()[0]
+        # Update session activity and seed, reading back how many songs remain
+        cur.execute("""
+            UPDATE radio_sessions SET last_activity = CURRENT_TIMESTAMP, seed_uuid = ?
+            WHERE session_id = ?
+            RETURNING (SELECT COUNT(*) FROM radio_queue WHERE session_id = ?)
+        """, (next_item['uuid'], session_id, session_id))
+        remaining = cur.fetchone()[0]
 
-    if remaining < 5:
-        _populate_queue(cur, session_id, next_item, count=10 - remaining,
-                       filter_query=session['filter_query'])
+        # Repopulate if the queue is running low
+        if remaining < 5:
+            _populate_queue(cur, session_id, next_item, count=10 - remaining,
+                           filter_query=session['filter_query'])
 
-    result = row_to_dict(next_item)
-    del result['position']
-    return result
+    return next_item
 
 
 @api_method('radio_skip', require='user')
@@ -345,13 +524,17 @@ def radio_skip(session_id, song_uuid, position_seconds=0, details=None):
     cur = conn.cursor()
     user_id = details['user_id']
 
-    # Record in history as skipped (if we have the record)
+    # Record in history as skipped (if we have the record). UPDATE ... LIMIT
+    # needs a compile-time option, so the latest play is picked in a subquery
     cur.execute("""
         UPDATE play_history
         SET skipped = 1, play_duration_seconds = ?
-        WHERE user_id = ? AND song_uuid = ?
-        ORDER BY played_at DESC
-        LIMIT 1
+        WHERE id = (
+            SELECT id FROM play_history
+            WHERE user_id = ? AND song_uuid = ?
+            ORDER BY played_at DESC
+            LIMIT 1
+        )
     """, (position_seconds, user_id, song_uuid))
 
     return {'success': True}
@@ -364,28 +547,20 @@ def radio_queue(session_id, limit=10, details=None):
     cur = conn.cursor()
     user_id = details['user_id']
 
-    # Verify session ownership
-    cur.execute("""
-        SELECT session_id FROM radio_sessions WHERE session_id = ? AND user_id = ?
-    """, (session_id, user_id))
-
-    if not cur.fetchone():
-        return {'items': [], 'session_id': None}
+    # Session ownership is checked by the join; only an empty result needs
+    # a second look to tell an unknown session from an empty queue
+    cur.execute(_RADIO_QUEUE_ITEMS, (session_id, user_id, limit))
+    items = _fetch_songs(cur)
 
-    cur.execute("""
-        SELECT s.uuid, s.type, s.category, s.genre, s.artist, s.album, s.title,
-               s.file, s.album_artist, s.duration_seconds, s.seekable,
-               s.track_number, s.disc_number, s.year,
-               s.replay_gain_track, s.replay_gain_album, s.key, s.bpm
-        FROM radio_queue rq
-        JOIN songs s ON rq.song_uuid = s.uuid
-        WHERE rq.session_id = ?
-        ORDER BY rq.position
-        LIMIT ?
-    """, (session_id, limit))
+    if not items:
+        cur.execute("""
+            SELECT 1 FROM radio_sessions WHERE session_id = ? AND user_id = ?
+        """, (session_id, user_id))
+        if not cur.fetchone():
+            return {'items': [], 'session_id': None}
 
     return {
-        'items': rows_to_list(cur.fetchall()),
+        'items': items,
         'session_id': session_id
     }
 
@@ -399,11 +574,7 @@ def _setup_rolling_seed_mode(cur, user_id, song_uuids, pool_size):
     """Set up rolling seed mode for small pools."""
     # Clear and set up original seeds
     cur.execute("DELETE FROM sca_original_seeds WHERE user_id = ?", (user_id,))
-    for uuid in song_uuids:
-        cur.execute("""
-            INSERT OR IGNORE INTO sca_original_seeds (user_id, song_uuid)
-            VALUES (?, ?)
-        """, (user_id, uuid))
+    cur.executemany(_INSERT_SCA_SEED, [(user_id, uuid) for uuid in song_uuids])
 
     # Enable rolling seed mode
     cur.execute("""
@@ -434,7 +605,7 @@ def _regenerate_rolling_seed_pool(cur, user_id):
     cur.execute("""
         SELECT song_uuid FROM sca_original_seeds WHERE user_id = ?
     """, (user_id,))
-    original_seeds = [row['song_uuid'] for row in cur.fetchall()]
+    original_seeds = [row[0] for row in cur]
 
     if not original_seeds:
         return 0
@@ -446,14 +617,13 @@ def _regenerate_rolling_seed_pool(cur, user_id):
         ORDER BY position DESC
         LIMIT ?
     """, (user_id, len(original_seeds)))
-    recent_songs = [row['song_uuid'] for row in cur.fetchall()]
+    recent_songs = [row[0] for row in cur]
 
     # Calculate how many from each source
     # Half from recent songs, half from original seeds
     half_size = max(len(original_seeds) // 2, 10)
 
     # Sample from recent songs (if we have any)
-    import random
     recent_sample = random.sample(recent_songs, min(half_size, len(recent_songs))) if recent_songs else []
 
     # Sample from original seeds
@@ -464,11 +634,7 @@ def _regenerate_rolling_seed_pool(cur, user_id):
 
     # Clear current pool and repopulate
     cur.execute("DELETE FROM sca_song_pool WHERE user_id = ?", (user_id,))
-    for uuid in new_pool:
-        cur.execute("""
-            INSERT OR IGNORE INTO sca_song_pool (user_id, song_uuid)
-            VALUES (?, ?)
-        """, (user_id, uuid))
+    cur.executemany(_INSERT_SCA_POOL, [(user_id, uuid) for uuid in new_pool])
 
     return len(new_pool)
 
@@ -487,50 +653,44 @@ def sca_start_from_queue(details=None):
     cur = conn.cursor()
     user_id = details['user_id']
 
-    # Get queue songs first (before clearing). The queue may contain the same
-    # song more than once; the pool/seed tables are keyed on (user_id,
-    # song_uuid), so dedupe (order-preserving) or the INSERTs below raise and
-    # radio fails to start.
-    cur.execute("SELECT song_uuid FROM user_queue WHERE user_id = ? ORDER BY position", (user_id,))
-    queue_uuids = list(dict.fromkeys(row['song_uuid'] for row in cur.fetchall()))
-    queue_size = len(queue_uuids)
-
-    if not queue_uuids:
-        return {'error': 'Queue is empty'}
-
-    # Clear existing pool and original seeds
-    cur.execute("DELETE FROM sca_song_pool WHERE user_id = ?", (user_id,))
-    cur.execute("DELETE FROM sca_original_seeds WHERE user_id = ?", (user_id,))
-
-    # Copy queue to pool
-    for uuid in queue_uuids:
-        cur.execute("INSERT INTO sca_song_pool (user_id, song_uuid) VALUES (?, ?)", (user_id, uuid))
-
-    # For rolling seed mode: also store as original seeds
-    if queue_size < ROLLING_SEED_THRESHOLD:
-        for uuid in queue_uuids:
-            cur.execute("INSERT INTO sca_original_seeds (user_id, song_uuid) VALUES (?, ?)", (user_id, uuid))
-        # Enable rolling seed mode
-        cur.execute("""
-            INSERT INTO sca_rolling_seed_state (user_id, rolling_seed_enabled, original_pool_size)
-            VALUES (?, 1, ?)
-            ON CONFLICT(user_id) DO UPDATE SET rolling_seed_enabled = 1, original_pool_size = ?
-        """, (user_id, queue_size, queue_size))
-    else:
-        _clear_rolling_seed_mode(cur, user_id)
+    # Committed before the AI check and populate, so no write lock is held
+    # across HTTP calls and sca_populate_queue sees the new pool
+    with write_transaction(conn):
+        # Get queue songs first (before clearing). The queue may contain the same
+        # song more than once; the pool/seed tables are keyed on (user_id,
+        # song_uuid), so dedupe (order-preserving) or the INSERTs below raise and
+        # radio fails to start.
+        cur.execute("SELECT song_uuid FROM user_queue WHERE user_id = ? ORDER BY position", (user_id,))
+        queue_uuids = list(dict.fromkeys(row[0] for row in cur))
+        queue_size = len(queue_uuids)
+
+        if not queue_uuids:
+            return {'error': 'Queue is empty'}
+
+        # Clear existing pool and original seeds
+        cur.execute("DELETE FROM sca_song_pool WHERE user_id = ?", (user_id,))
+        cur.execute("DELETE FROM sca_original_seeds WHERE user_id = ?", (user_id,))
+
+        # Copy queue to pool
+        cur.executemany(_INSERT_SCA_POOL, [(user_id, uuid) for uuid in queue_uuids])
+
+        # For rolling seed mode: also store as original seeds
+        if queue_size < ROLLING_SEED_THRESHOLD:
+            cur.executemany(_INSERT_SCA_SEED, [(user_id, uuid) for uuid in queue_uuids])
+            # Enable rolling seed mode
+            cur.execute("""
+                INSERT INTO sca_rolling_seed_state (user_id, rolling_seed_enabled, original_pool_size)
+                VALUES (?, 1, ?)
+                ON CONFLICT(user_id) DO UPDATE SET rolling_seed_enabled = 1, original_pool_size = ?
+            """, (user_id, queue_size, queue_size))
+        else:
+            _clear_rolling_seed_mode(cur, user_id)
 
-    # Clear the queue (will be repopulated with similar songs)
-    cur.execute("DELETE FROM user_queue WHERE user_id = ?", (user_id,))
+        # Clear the queue (will be repopulated with similar songs)
+        cur.execute("DELETE FROM user_queue WHERE user_id = ?", (user_id,))
 
-    # Enable SCA mode
-    cur.execute("""
-        INSERT INTO user_playback_state (user_id, sca_enabled, queue_index, updated_at)
-        VALUES (?, 1, 0, ?)
-        ON CONFLICT(user_id) DO UPDATE SET sca_enabled = 1, queue_index = 0, updated_at = ?
-    """, (user_id, datetime.utcnow(), datetime.utcnow()))
-
-    # Commit before populating (so sca_populate_queue sees the changes)
-    conn.commit()
+        # Enable SCA mode
+        cur.execute(_ENABLE_SCA, (user_id,))
 
     # Check if CLAP mode is enabled and warn if seeds aren't analyzed
     from ..config import get_config
@@ -594,49 +754,43 @@ def sca_start_from_playlist(playlist_id, details=None):
     if str(playlist['user_id']) != str(user_id) and not playlist['is_public']:
         raise ValueError('Access denied')
 
-    # Get playlist songs. Playlists support duplicate entries; the pool/seed
-    # tables are keyed on (user_id, song_uuid), so dedupe (order-preserving)
-    # or the INSERTs below raise and radio fails to start.
-    cur.execute("SELECT song_uuid FROM playlist_songs WHERE playlist_id = ? ORDER BY position", (playlist_id,))
-    playlist_uuids = list(dict.fromkeys(row['song_uuid'] for row in cur.fetchall()))
-    playlist_size = len(playlist_uuids)
-
-    if not playlist_uuids:
-        return {'error': 'Playlist is empty'}
-
-    # Clear existing pool and original seeds
-    cur.execute("DELETE FROM sca_song_pool WHERE user_id = ?", (user_id,))
-    cur.execute("DELETE FROM sca_original_seeds WHERE user_id = ?", (user_id,))
-
-    # Copy playlist to pool
-    for uuid in playlist_uuids:
-        cur.execute("INSERT INTO sca_song_pool (user_id, song_uuid) VALUES (?, ?)", (user_id, uuid))
-
-    # For rolling seed mode: also store as original seeds
-    if playlist_size < ROLLING_SEED_THRESHOLD:
-        for uuid in playlist_uuids:
-            cur.execute("INSERT INTO sca_original_seeds (user_id, song_uuid) VALUES (?, ?)", (user_id, uuid))
-        # Enable rolling seed mode
-        cur.execute("""
-            INSERT INTO sca_rolling_seed_state (user_id, rolling_seed_enabled, original_pool_size)
-            VALUES (?, 1, ?)
-            ON CONFLICT(user_id) DO UPDATE SET rolling_seed_enabled = 1, original_pool_size = ?
-        """, (user_id, playlist_size, playlist_size))
-    else:
-        _clear_rolling_seed_mode(cur, user_id)
-
-    # Clear the queue (will be repopulated with similar songs)
-    cur.execute("DELETE FROM user_queue WHERE user_id = ?", (user_id,))
+    # Committed before the AI check and populate, so no write lock is held
+    # across HTTP calls and sca_populate_queue sees the new pool
+    with write_transaction(conn):
+        # Get playlist songs. Playlists support duplicate entries; the pool/seed
+        # tables are keyed on (user_id, song_uuid), so dedupe (order-preserving)
+        # or the INSERTs below raise and radio fails to start.
+        cur.execute("SELECT song_uuid FROM playlist_songs WHERE playlist_id = ? ORDER BY position", (playlist_id,))
+        playlist_uuids = list(dict.fromkeys(row[0] for row in cur))
+        playlist_size = len(playlist_uuids)
+
+        if not playlist_uuids:
+            return {'error': 'Playlist is empty'}
+
+        # Clear existing pool and original seeds
+        cur.execute("DELETE FROM sca_song_pool WHERE user_id = ?", (user_id,))
+        cur.execute("DELETE FROM sca_original_seeds WHERE user_id = ?", (user_id,))
+
+        # Copy playlist to pool
+        cur.executemany(_INSERT_SCA_POOL, [(user_id, uuid) for uuid in playlist_uuids])
+
+        # For rolling seed mode: also store as original seeds
+        if playlist_size < ROLLING_SEED_THRESHOLD:
+            cur.executemany(_INSERT_SCA_SEED, [(user_id, uuid) for uuid in playlist_uuids])
+            # Enable rolling seed mode
+            cur.execute("""
+                INSERT INTO sca_rolling_seed_state (user_id, rolling_seed_enabled, original_pool_size)
+                VALUES (?, 1, ?)
+                ON CONFLICT(user_id) DO UPDATE SET rolling_seed_enabled = 1, original_pool_size = ?
+            """, (user_id, playlist_size, playlist_size))
+        else:
+            _clear_rolling_seed_mode(cur, user_id)
 
-    # Enable SCA mode
-    cur.execute("""
-        INSERT INTO user_playback_state (user_id, sca_enabled, queue_index, updated_at)
-        VALUES (?, 1, 0, ?)
-        ON CONFLICT(user_id) DO UPDATE SET sca_enabled = 1, queue_index = 0, updated_at = ?
-    """, (user_id, datetime.utcnow(), datetime.utcnow()))
+        # Clear the queue (will be repopulated with similar songs)
+        cur.execute("DELETE FROM user_queue WHERE user_id = ?", (user_id,))
 
-    # Commit before populating (so sca_populate_queue sees the changes)
-    conn.commit()
+        # Enable SCA mode
+        cur.execute(_ENABLE_SCA, (user_id,))
 
     # Check if CLAP mode is enabled and warn if seeds aren't analyzed
     from ..config import get_config
@@ -688,7 +842,6 @@ def _clap_find_similar(seed_uuids, exclude_uuids, count, diversity=0.3):
 
     # Use last 5 seeds plus some random earlier ones if available
     if len(seed_uuids) > 10:
-        import random
         seeds = seed_uuids[-5:] + random.sample(seed_uuids[:-5], min(5, len(seed_uuids) - 5))
     else:
         seeds = seed_uuids
@@ -759,7 +912,7 @@ def sca_populate_queue(count=5, details=None):
 
     # Get current queue UUIDs (for exclusion and seeds)
     cur.execute("SELECT song_uuid FROM user_queue WHERE user_id = ? ORDER BY position", (user_id,))
-    queue_uuids = [row['song_uuid'] for row in cur.fetchall()]
+    queue_uuids = [row[0] for row in cur]
     exclude_uuids = set(queue_uuids)
 
     songs = []
@@ -770,11 +923,10 @@ def sca_populate_queue(count=5, details=None):
         ai_attempted = True
         # Check for original seeds - presence indicates rolling seed mode (small playlist/queue)
         cur.execute("SELECT song_uuid FROM sca_original_seeds WHERE user_id = ?", (user_id,))
-        original_seeds = [row['song_uuid'] for row in cur.fetchall()]
+        original_seeds = [row[0] for row in cur]
 
         if original_seeds:
             # Rolling seed mode: search entire library using mix of original + recent seeds
-            import random
             recent_seeds = queue_uuids[-10:] if queue_uuids else []
 
             # Mix: half recent, half original (for variety)
@@ -783,8 +935,7 @@ def sca_populate_queue(count=5, details=None):
 
             # Exclude the original seeds (pool songs) to get new discoveries
             cur.execute("SELECT song_uuid FROM sca_song_pool WHERE user_id = ?", (user_id,))
-            pool_uuids = [row['song_uuid'] for row in cur.fetchall()]
-            full_exclude = exclude_uuids | set(pool_uuids)
+            full_exclude = exclude_uuids.union(row[0] for row in cur)
 
             selected_uuids = _clap_find_similar(
                 seed_uuids=seed_sample,
@@ -796,17 +947,7 @@ def sca_populate_queue(count=5, details=None):
             if selected_uuids:
                 ai_used = True
                 # Get full song metadata
-                placeholders = ','.join('?' * len(selected_uuids))
-                cur.execute(f"""
-                    SELECT uuid, type, category, genre, artist, album, title,
-                           file, album_artist, track_number, disc_number, year,
-                           duration_seconds, seekable, replay_gain_track, replay_gain_album,
-                           key, bpm
-                    FROM songs WHERE uuid IN ({placeholders})
-                """, selected_uuids)
-
-                uuid_to_song = {row['uuid']: row_to_dict(row) for row in cur.fetchall()}
-                songs = [uuid_to_song[u] for u in selected_uuids if u in uuid_to_song]
+                songs = _songs_by_uuids(cur, selected_uuids)
 
         elif queue_uuids:
             # Large pool mode (filter-based): search within pool using CLAP
@@ -814,9 +955,9 @@ def sca_populate_queue(count=5, details=None):
                 SELECT song_uuid FROM sca_song_pool
                 WHERE user_id = ? AND song_uuid NOT IN (SELECT song_uuid FROM user_queue WHERE user_id = ?)
             """, (user_id, user_id))
-            pool_uuids = [row['song_uuid'] for row in cur.fetchall()]
+            pool_set = {row[0] for row in cur}
 
-            if pool_uuids:
+            if pool_set:
                 selected_uuids = _clap_find_similar(
                     seed_uuids=queue_uuids[-5:],
                     exclude_uuids=exclude_uuids,
@@ -826,84 +967,50 @@ def sca_populate_queue(count=5, details=None):
 
                 # Filter to pool only
                 if selected_uuids:
-                    pool_set = set(pool_uuids)
                     selected_uuids = [u for u in selected_uuids if u in pool_set][:count]
 
                     if selected_uuids:
                         ai_used = True
-                        placeholders = ','.join('?' * len(selected_uuids))
-                        cur.execute(f"""
-                            SELECT uuid, type, category, genre, artist, album, title,
-                                   file, album_artist, track_number, disc_number, year,
-                                   duration_seconds, seekable, replay_gain_track, replay_gain_album,
-                                   key, bpm
-                            FROM songs WHERE uuid IN ({placeholders})
-                        """, selected_uuids)
-
-                        uuid_to_song = {row['uuid']: row_to_dict(row) for row in cur.fetchall()}
-                        songs = [uuid_to_song[u] for u in selected_uuids if u in uuid_to_song]
-
-    # Fallback to random SCA if CLAP didn't work or not enabled
-    if not songs:
-        # Get random songs from pool that aren't already in queue
-        cur.execute("""
-            SELECT s.uuid, s.type, s.category, s.genre, s.artist, s.album, s.title,
-                   s.file, s.album_artist, s.track_number, s.disc_number, s.year,
-                   s.duration_seconds, s.seekable, s.replay_gain_track, s.replay_gain_album,
-                   s.key, s.bpm
-            FROM songs s
-            JOIN sca_song_pool p ON s.uuid = p.song_uuid
-            WHERE p.user_id = ?
-              AND s.uuid NOT IN (SELECT song_uuid FROM user_queue WHERE user_id = ?)
-            ORDER BY RANDOM()
-            LIMIT ?
-        """, (user_id, user_id, count))
-
-        songs = rows_to_list(cur.fetchall())
+                        songs = _songs_by_uuids(cur, selected_uuids)
 
+    # Only the pool pick and the inserts run in the write transaction; the
+    # CLAP lookups above are HTTP calls and must not hold the write lock
+    with write_transaction(conn):
+        # Fallback to random SCA if CLAP didn't work or not enabled
         if not songs:
-            # Pool exhausted - check if rolling seed mode is enabled
-            cur.execute("""
-                SELECT rolling_seed_enabled FROM sca_rolling_seed_state WHERE user_id = ?
-            """, (user_id,))
-            state = cur.fetchone()
-
-            if state and state['rolling_seed_enabled']:
-                # Regenerate pool from rolling seeds
-                new_pool_size = _regenerate_rolling_seed_pool(cur, user_id)
-                if new_pool_size > 0:
-                    # Retry getting songs from the regenerated pool
-                    cur.execute("""
-                        SELECT s.uuid, s.type, s.category, s.genre, s.artist, s.album, s.title,
-                               s.file, s.album_artist, s.track_number, s.disc_number, s.year,
-                               s.duration_seconds, s.seekable, s.replay_gain_track, s.replay_gain_album,
-                               s.key, s.bpm
-                        FROM songs s
-                        JOIN sca_song_pool p ON s.uuid = p.song_uuid
-                        WHERE p.user_id = ?
-                          AND s.uuid NOT IN (SELECT song_uuid FROM user_queue WHERE user_id = ?)
-                        ORDER BY RANDOM()
-                        LIMIT ?
-                    """, (user_id, user_id, count))
-                    songs = rows_to_list(cur.fetchall())
+            # Get random songs from pool that aren't already in queue
+            cur.execute(_RANDOM_POOL_SONGS, (user_id, user_id, count))
 
-            if not songs:
-                message = 'Pool exhausted'
-                if ai_attempted:
-                    message = 'Pool exhausted. AI search failed - ensure songs are analyzed from Admin page.'
-                return {'added': 0, 'songs': [], 'message': message, 'ai_used': False, 'ai_attempted': ai_attempted}
+            songs = _fetch_songs(cur)
 
-    # Add songs to queue
-    cur.execute("SELECT MAX(position) FROM user_queue WHERE user_id = ?", (user_id,))
-    result = cur.fetchone()
-    next_pos = (result[0] or -1) + 1
+            if not songs and _fill_radio_pool(cur, user_id):
+                # The pool from radio_start hadn't been filled yet
+                cur.execute(_RANDOM_POOL_SONGS, (user_id, user_id, count))
+                songs = _fetch_songs(cur)
 
-    for song in songs:
-        cur.execute("""
-            INSERT INTO user_queue (user_id, song_uuid, position)
-            VALUES (?, ?, ?)
-        """, (user_id, song['uuid'], next_pos))
-        next_pos += 1
+            if not songs:
+                # Pool exhausted - check if rolling seed mode is enabled
+                cur.execute("""
+                    SELECT rolling_seed_enabled FROM sca_rolling_seed_state WHERE user_id = ?
+                """, (user_id,))
+                state = cur.fetchone()
+
+                if state and state['rolling_seed_enabled']:
+                    # Regenerate pool from rolling seeds
+                    new_pool_size = _regenerate_rolling_seed_pool(cur, user_id)
+                    if new_pool_size > 0:
+                        # Retry getting songs from the regenerated pool
+                        cur.execute(_RANDOM_POOL_SONGS, (user_id, user_id, count))
+                        songs = _fetch_songs(cur)
+
+                if not songs:
+                    message = 'Pool exhausted'
+                    if ai_attempted:
+                        message = 'Pool exhausted. AI search failed - ensure songs are analyzed from Admin page.'
+                    return {'added': 0, 'songs': [], 'message': message, 'ai_used': False, 'ai_attempted': ai_attempted}
+
+        # Add songs to queue
+        _append_user_queue(cur, user_id, songs)
 
     return {'added': len(songs), 'songs': songs, 'ai_used': ai_used}
 
@@ -915,14 +1022,15 @@ def sca_stop(details=None):
     cur = conn.cursor()
     user_id = details['user_id']
 
-    # Disable SCA
-    cur.execute("""
-        UPDATE user_playback_state SET sca_enabled = 0, updated_at = ?
-        WHERE user_id = ?
-    """, (datetime.utcnow(), user_id))
+    with write_transaction(conn):
+        # Disable SCA
+        cur.execute("""
+            UPDATE user_playback_state SET sca_enabled = 0, updated_at = CURRENT_TIMESTAMP
+            WHERE user_id = ?
+        """, (user_id,))
 
-    # Clear pool
-    cur.execute("DELETE FROM sca_song_pool WHERE user_id = ?", (user_id,))
+        # Clear pool
+        cur.execute("DELETE FROM sca_song_pool WHERE user_id = ?", (user_id,))
 
     return {'success': True}
 
@@ -943,8 +1051,7 @@ def sca_get_pool(details=None):
         ORDER BY s.artist, s.album, s.title
     """, (user_id,))
 
-    rows = cur.fetchall()
-    return {'items': rows_to_list(rows)}
+    return {'items': rows_to_list(cur.fetchall(), cursor_columns(cur))}
 
 
 @api_method('sca_populate_queue_ai', require='user')
@@ -1005,7 +1112,7 @@ def sca_populate_queue_ai(count=5, seed_uuid=None, diversity=0.3, details=None):
         WHERE p.user_id = ?
           AND p.song_uuid NOT IN (SELECT song_uuid FROM user_queue WHERE user_id = ?)
     """, (user_id, user_id))
-    pool_uuids = [row['song_uuid'] for row in cur.fetchall()]
+    pool_uuids = [row[0] for row in cur]
 
     if not pool_uuids:
         return {'added': 0, 'songs': [], 'message': 'Pool exhausted', 'ai_used': False}
@@ -1028,31 +1135,11 @@ def sca_populate_queue_ai(count=5, seed_uuid=None, diversity=0.3, details=None):
 
             if similar_uuids:
                 # Get full song metadata
-                placeholders = ','.join('?' * len(similar_uuids))
-                cur.execute(f"""
-                    SELECT uuid, type, category, genre, artist, album, title,
-                           file, album_artist, track_number, disc_number, year,
-                           duration_seconds, seekable, replay_gain_track, replay_gain_album,
-                           key, bpm
-                    FROM songs WHERE uuid IN ({placeholders})
-                """, similar_uuids)
-
-                # Preserve order from AI results
-                uuid_to_song = {row['uuid']: row_to_dict(row) for row in cur.fetchall()}
-                songs = [uuid_to_song[u] for u in similar_uuids if u in uuid_to_song]
+                songs = _songs_by_uuids(cur, similar_uuids)
 
                 if songs:
                     # Add to queue
-                    cur.execute("SELECT MAX(position) FROM user_queue WHERE user_id = ?", (user_id,))
-                    result = cur.fetchone()
-                    next_pos = (result[0] or -1) + 1
-
-                    for song in songs:
-                        cur.execute("""
-                            INSERT INTO user_queue (user_id, song_uuid, position)
-                            VALUES (?, ?, ?)
-                        """, (user_id, song['uuid'], next_pos))
-                        next_pos += 1
+                    _append_user_queue(cur, user_id, songs)
 
                     return {'added': len(songs), 'songs': songs, 'ai_used': True}
 
@@ -4,14 +4,17 @@ Flask application factory and API dispatcher for mrepo.
 Maintains JSON-RPC style API compatibility with the original frontend.
 """
 
+import hashlib
+import inspect
 import json
 import os
 from pathlib import Path
 
-from flask import Flask, request, jsonify, send_from_directory, Response
+from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context
 
 from .config import config
 from .db import get_db, close_db, init_db
+from .jsonutil import JSONStream, json_dumpb
 from .auth import (
     get_current_user, has_capability, is_setup_required,
     create_user, authenticate_user, login_user, logout_user, list_users,
@@ -24,24 +27,46 @@ from .auth import (
 API_METHODS = {}
 
 
-def api_method(name, require='user', public=False):
+def api_method(name, require='user', public=False, etag=None, raw_json=False):
     """Decorator to register an API method.
 
     Args:
         name: The method name as called from frontend
         require: Required capability ('user', 'admin', None)
         public: If True, method is accessible without authentication
+        etag: Optional callable returning a version token for the data the
+            method reads (e.g. db.get_data_version). The response gets an
+            ETag derived from it and the call's kwargs, and a request whose
+            If-None-Match matches is answered with 304 without running the
+            handler. Only for methods whose result depends on nothing else.
+        raw_json: If True, the result is encoded with jsonutil (orjson when
+            installed) straight to response bytes instead of through Flask's
+            JSON provider. Only for methods whose result is built from plain
+            JSON types (no datetimes, Decimals or other objects Flask adapts).
+            Such a method may also return a jsonutil.JSONStream, which is
+            streamed into the response as its chunks are produced.
     """
     def decorator(fn):
         API_METHODS[name] = {
             'handler': fn,
             'require': require,
-            'public': public
+            'public': public,
+            'etag': etag,
+            'raw_json': raw_json,
+            # Whether to inject the caller's details, decided once here
+            # rather than by inspecting the handler on every request
+            'details': 'details' in inspect.signature(fn).parameters
         }
         return fn
     return decorator
 
 
+def _api_etag(method_name, version, kwargs):
+    """ETag for a call: the method, its kwargs and the data version."""
+    key = json.dumps([method_name, version, kwargs], sort_keys=True, default=str)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
 def create_app(config_path=None):
     """Create and configure the Flask application."""
 
@@ -157,10 +182,17 @@ def create_app(config_path=None):
         if require and not has_capability(user, require):
             return jsonify({'success': False, 'error': 'NotAuthorized'})
 
+        # Conditional request: skip the handler if the client's copy is current
+        etag = None
+        if method_config.get('etag'):
+            etag = _api_etag(method_name, method_config['etag'](), kwargs)
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+
         # Inject user info if handler expects it
-        import inspect
-        sig = inspect.signature(handler)
-        if 'details' in sig.parameters:
+        if method_config['details']:
             kwargs['details'] = {
                 'user': user['username'] if user else None,
                 'user_id': user['id'] if user else None,
@@ -170,7 +202,19 @@ def create_app(config_path=None):
         # Call handler
         try:
             result = handler(**kwargs)
-            return jsonify({'success': True, 'result': result})
+            if isinstance(result, JSONStream):
+                # The handler's request context (and its pooled connection)
+                # stays open until the last chunk is sent
+                response = Response(stream_with_context(_stream_envelope(result)),
+                                    mimetype='application/json')
+            elif method_config['raw_json']:
+                response = Response(json_dumpb({'success': True, 'result': result}),
+                                    mimetype='application/json')
+            else:
+                response = jsonify({'success': True, 'result': result})
+            if etag:
+                response.set_etag(etag)
+            return response
         except TypeError as e:
             # Parameter mismatch
             return jsonify({'success': False, 'error': 'InvalidParameters',
@@ -196,6 +240,13 @@ def create_app(config_path=None):
     return app
 
 
+def _stream_envelope(result):
+    """Wrap a streamed result in the standard success envelope."""
+    yield b'{"success":true,"result":'
+    yield from result
+    yield b'}'
+
+
 def _register_api_modules():
     """Import all API modules to register their methods."""
     # Import each API module - they register methods via @api_method decorator
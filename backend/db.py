@@ -5,8 +5,12 @@ Uses SQLite with WAL mode for concurrent access.
 Thread-local connections for WSGI compatibility.
 """
 
+import atexit
+import os
+import secrets
 import sqlite3
 import threading
+from contextlib import contextmanager
 from pathlib import Path
 
 from flask import current_app, g
@@ -15,30 +19,102 @@ from flask import current_app, g
 # Thread-local storage for connections outside Flask context
 _local = threading.local()
 
+# Prepared statements kept per connection. The API builds its SQL from a
+# bounded set of templates, so a cache large enough to hold all of them means
+# every statement is compiled once per connection rather than once per call.
+STATEMENT_CACHE_SIZE = 256
+
+# Page cache size in KiB (negative value tells SQLite the unit is KiB)
+PAGE_CACHE_KIB = 65536
+
+# Memory-mapped I/O window per connection (bytes)
+MMAP_SIZE = 268435456
+
+# Connections used only to read PRAGMA data_version, keyed by (pid, db path).
+# A connection's data_version changes whenever *another* connection commits;
+# these never write, so their counter moves on every change to the database.
+_version_conns = {}
+_version_lock = threading.Lock()
+
+# Idle request connections, keyed by (pid, db path). Requests take the most
+# recently returned connection so its page cache and prepared statements are
+# still warm; connections beyond the pool size are closed when returned.
+POOL_SIZE = os.cpu_count() or 4
+_pools = {}
+_pool_lock = threading.Lock()
+
 
 def get_db():
     """Get a database connection for the current context.
 
-    In Flask request context, stores connection in g.
+    In Flask request context, stores connection in g, taking it from the
+    connection pool; close_db hands it back at teardown.
     Outside Flask, uses thread-local storage.
     """
     try:
         # Try Flask context first
         if 'db' not in g:
-            g.db = _create_connection(current_app.config['DATABASE_PATH'],
+            g.db = _acquire_connection(current_app.config['DATABASE_PATH'],
                                        current_app.config['DATABASE_TIMEOUT'])
         return g.db
     except RuntimeError:
         # Outside Flask context, use thread-local
         if not hasattr(_local, 'db') or _local.db is None:
-            from .config import config
-            _local.db = _create_connection(
-                config.get('database', 'path'),
-                config.get('database', 'timeout')
-            )
+            _local.db = _create_connection(*_db_settings())
         return _local.db
 
 
+def get_read_db():
+    """Get a read-only database connection for the current thread.
+
+    Reader connections are opened with query_only and kept for the life of
+    the thread, so read-only endpoints reuse their prepared statements and
+    page cache across requests. Under WAL they never wait on writers.
+    Only use this for requests that don't write.
+    """
+    path, timeout = _db_settings()
+    key = (os.getpid(), path)
+    reader = getattr(_local, 'reader', None)
+    if reader is None or reader[0] != key:
+        # A reader inherited across fork() belongs to the parent; drop it
+        # without closing.
+        if reader is not None and reader[0][0] == key[0]:
+            reader[1].close()
+        conn = _create_connection(path, timeout)
+        conn.execute('PRAGMA query_only=1')
+        reader = (key, conn)
+        _local.reader = reader
+    return reader[1]
+
+
+def _db_settings():
+    """Return (path, timeout) for the database of the current context."""
+    try:
+        return current_app.config['DATABASE_PATH'], current_app.config['DATABASE_TIMEOUT']
+    except RuntimeError:
+        from .config import config
+        return config.get('database', 'path'), config.get('database', 'timeout')
+
+
+def get_data_version():
+    """Return a token that changes whenever the database is modified.
+
+    Intended as a cache key for data derived from the database. Each
+    watcher connection gets a random prefix, so tokens from different
+    processes (or a reopened watcher) never compare equal by accident.
+    """
+    path, timeout = _db_settings()
+    key = (os.getpid(), path)
+    with _version_lock:
+        entry = _version_conns.get(key)
+        if entry is None:
+            entry = (_create_connection(path, timeout), secrets.token_hex(4))
+            _version_conns[key] = entry
+        conn, prefix = entry
+        version = conn.execute('PRAGMA data_version').fetchone()[0]
+    return f'{prefix}-{version}'
+
+
 def _create_connection(db_path, timeout=30):
     """Create a new database connection with proper settings."""
     # Ensure directory exists
@@ -48,22 +124,108 @@ def _create_connection(db_path, timeout=30):
         db_path,
         timeout=timeout,
         check_same_thread=False,
-        isolation_level=None  # Autocommit mode
+        isolation_level=None,  # Autocommit mode
+        cached_statements=STATEMENT_CACHE_SIZE
     )
     conn.row_factory = sqlite3.Row
 
     # Enable WAL mode and set busy timeout
     conn.execute('PRAGMA journal_mode=WAL')
     conn.execute(f'PRAGMA busy_timeout={timeout * 1000}')
+    # In WAL mode NORMAL only syncs at checkpoints, not on every commit; a
+    # power loss can drop the last transactions but never corrupts the file
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA cache_size=-{PAGE_CACHE_KIB}')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute(f'PRAGMA mmap_size={MMAP_SIZE}')
+    # foreign_keys is deliberately left off: the schema declares ON DELETE
+    # CASCADE from songs, so enabling it would make the scanner's cleanup of
+    # missing files also delete users' history, queue and playlist rows
 
     return conn
 
 
+def _acquire_connection(db_path, timeout):
+    """Take an idle connection from the pool, or open a new one."""
+    key = (os.getpid(), db_path)
+    with _pool_lock:
+        pool = _pools.get(key)
+        if pool:
+            return pool.pop()
+    return _create_connection(db_path, timeout)
+
+
+def _release_connection(db_path, conn):
+    """Return a connection to the pool, closing it if the pool is full."""
+    try:
+        if conn.in_transaction:
+            # A handler failed mid-transaction; don't leak its locks
+            conn.rollback()
+    except sqlite3.Error:
+        conn.close()
+        return
+    key = (os.getpid(), db_path)
+    with _pool_lock:
+        pool = _pools.setdefault(key, [])
+        if len(pool) < POOL_SIZE:
+            pool.append(conn)
+            return
+    _retire_connection(conn)
+
+
+def _retire_connection(conn):
+    """Close a connection, first letting SQLite refresh planner statistics."""
+    try:
+        conn.execute('PRAGMA optimize')
+    except sqlite3.Error:
+        pass
+    conn.close()
+
+
+@atexit.register
+def _close_idle_connections():
+    """Close this process's pooled connections when it exits.
+
+    Each worker keeps its pool for its whole life, so this is where the
+    PRAGMA optimize for those connections runs.
+    """
+    pid = os.getpid()
+    with _pool_lock:
+        pools = [pool for (owner, _), pool in _pools.items() if owner == pid]
+        idle = [conn for pool in pools for conn in pool]
+        for pool in pools:
+            pool.clear()
+    for conn in idle:
+        _retire_connection(conn)
+
+
 def close_db(e=None):
-    """Close the database connection."""
+    """Return the request's database connection to the pool."""
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        _release_connection(current_app.config['DATABASE_PATH'], db)
+
+
+@contextmanager
+def write_transaction(conn, own=True):
+    """Run the block in a BEGIN IMMEDIATE transaction on conn.
+
+    Commits when the block finishes and rolls back if it raises (including
+    the ValueErrors handlers use for not-found/access-denied). Pass
+    own=False when the caller supplied _conn: the surrounding batch owns
+    the transaction and the block just runs inside it.
+    """
+    if not own:
+        yield
+        return
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
 
 
 def init_db(app):
@@ -132,7 +294,6 @@ def _run_migrations(db):
             )
         ''')
         cur.execute('CREATE INDEX idx_songs_title ON songs(title)')
-        cur.execute('CREATE INDEX idx_songs_artist ON songs(artist)')
         cur.execute('CREATE INDEX idx_songs_album ON songs(album)')
         cur.execute('CREATE INDEX idx_songs_genre ON songs(genre)')
         cur.execute('CREATE INDEX idx_songs_category ON songs(category)')
@@ -214,7 +375,6 @@ def _run_migrations(db):
                 FOREIGN KEY (song_uuid) REFERENCES songs(uuid) ON DELETE CASCADE
             )
         ''')
-        cur.execute('CREATE INDEX idx_user_queue_user ON user_queue(user_id)')
 
     # User playback state table
     if 'user_playback_state' not in existing_tables:
@@ -264,7 +424,6 @@ def _run_migrations(db):
                 FOREIGN KEY (song_uuid) REFERENCES songs(uuid) ON DELETE CASCADE
             )
         ''')
-        cur.execute('CREATE INDEX idx_play_history_user ON play_history(user_id)')
         cur.execute('CREATE INDEX idx_play_history_time ON play_history(played_at)')
 
     # User preferences table
@@ -295,7 +454,6 @@ def _run_migrations(db):
                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
-        cur.execute('CREATE INDEX idx_eq_presets_user ON eq_presets(user_id)')
 
     # Tags table
     if 'tags' not in existing_tables:
@@ -446,6 +604,102 @@ def _run_migrations(db):
         if 'bpm' not in columns:
             cur.execute("ALTER TABLE songs ADD COLUMN bpm REAL")
 
+    # Migration: file basename as a virtual generated column, so the display
+    # name fallback for untitled songs is computed inside SQLite. Generated
+    # columns only show up in table_xinfo, not table_info.
+    cur.execute("PRAGMA table_xinfo(songs)")
+    columns = {row[1] for row in cur.fetchall()}
+    if 'basename' not in columns:
+        cur.execute("""
+            ALTER TABLE songs ADD COLUMN basename TEXT
+            GENERATED ALWAYS AS (substr(file, length(rtrim(file, replace(file, '/', ''))) + 1)) VIRTUAL
+        """)
+
+    # Migration: parent directory of the file (no trailing slash, '' for files
+    # at the top level), indexed so browse_path can find a folder's files and
+    # subfolders with index lookups instead of LIKE scans over every path
+    if 'parent_dir' not in columns:
+        cur.execute("""
+            ALTER TABLE songs ADD COLUMN parent_dir TEXT
+            GENERATED ALWAYS AS (substr(file, 1, length(rtrim(file, replace(file, '/', ''))) - 1)) VIRTUAL
+        """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_songs_parent_dir ON songs(parent_dir)")
+
+    # Migration: maintained per-genre song counts for the normalized genre
+    # tables. Those tables only exist in databases imported from the original
+    # service; browse_genres_normalized reads the counter instead of joining.
+    if 'genres' in existing_tables and 'song_genres' in existing_tables:
+        cur.execute("PRAGMA table_info(genres)")
+        columns = {row[1] for row in cur.fetchall()}
+        if 'song_count' not in columns:
+            cur.execute("ALTER TABLE genres ADD COLUMN song_count INTEGER NOT NULL DEFAULT 0")
+            cur.execute("""
+                UPDATE genres SET song_count = (
+                    SELECT COUNT(*) FROM song_genres WHERE genre_id = genres.id
+                )
+            """)
+        cur.execute('''
+            CREATE TRIGGER IF NOT EXISTS song_genres_count_ai AFTER INSERT ON song_genres BEGIN
+                UPDATE genres SET song_count = song_count + 1 WHERE id = NEW.genre_id;
+            END
+        ''')
+        cur.execute('''
+            CREATE TRIGGER IF NOT EXISTS song_genres_count_ad AFTER DELETE ON song_genres BEGIN
+                UPDATE genres SET song_count = song_count - 1 WHERE id = OLD.genre_id;
+            END
+        ''')
+        cur.execute('''
+            CREATE TRIGGER IF NOT EXISTS song_genres_count_au AFTER UPDATE OF genre_id ON song_genres BEGIN
+                UPDATE genres SET song_count = song_count - 1 WHERE id = OLD.genre_id;
+                UPDATE genres SET song_count = song_count + 1 WHERE id = NEW.genre_id;
+            END
+        ''')
+
+    # Migration: maintained per-playlist song counts, so playlist listings read
+    # a column instead of counting playlist_songs for every row
+    cur.execute("PRAGMA table_info(playlists)")
+    columns = {row[1] for row in cur.fetchall()}
+    if 'song_count' not in columns:
+        cur.execute("ALTER TABLE playlists ADD COLUMN song_count INTEGER NOT NULL DEFAULT 0")
+        cur.execute("""
+            UPDATE playlists SET song_count = (
+                SELECT COUNT(*) FROM playlist_songs WHERE playlist_id = playlists.id
+            )
+        """)
+    cur.execute('''
+        CREATE TRIGGER IF NOT EXISTS playlist_songs_count_ai AFTER INSERT ON playlist_songs BEGIN
+            UPDATE playlists SET song_count = song_count + 1 WHERE id = NEW.playlist_id;
+        END
+    ''')
+    cur.execute('''
+        CREATE TRIGGER IF NOT EXISTS playlist_songs_count_ad AFTER DELETE ON playlist_songs BEGIN
+            UPDATE playlists SET song_count = song_count - 1 WHERE id = OLD.playlist_id;
+        END
+    ''')
+    cur.execute('''
+        CREATE TRIGGER IF NOT EXISTS playlist_songs_count_au AFTER UPDATE OF playlist_id ON playlist_songs BEGIN
+            UPDATE playlists SET song_count = song_count - 1 WHERE id = OLD.playlist_id;
+            UPDATE playlists SET song_count = song_count + 1 WHERE id = NEW.playlist_id;
+        END
+    ''')
+
+    # Migration: next free position per playlist, so appends reserve positions
+    # with one UPDATE instead of reading MAX(position). Always above every
+    # position in use; the trigger covers inserts that pick their own position.
+    if 'next_position' not in columns:
+        cur.execute("ALTER TABLE playlists ADD COLUMN next_position INTEGER NOT NULL DEFAULT 1")
+        cur.execute("""
+            UPDATE playlists SET next_position = COALESCE((
+                SELECT MAX(position) FROM playlist_songs WHERE playlist_id = playlists.id
+            ), 0) + 1
+        """)
+    cur.execute('''
+        CREATE TRIGGER IF NOT EXISTS playlist_songs_next_position_ai AFTER INSERT ON playlist_songs BEGIN
+            UPDATE playlists SET next_position = NEW.position + 1
+            WHERE id = NEW.playlist_id AND next_position <= NEW.position;
+        END
+    ''')
+
     # Migration: fix radio_sessions schema (change from INTEGER id to TEXT session_id)
     if 'radio_sessions' in existing_tables:
         cur.execute("PRAGMA table_info(radio_sessions)")
@@ -481,7 +735,79 @@ def _run_migrations(db):
     # Add missing indexes if tables exist
     _create_index_if_not_exists(cur, 'idx_playlists_public', 'playlists', 'is_public')
     _create_index_if_not_exists(cur, 'idx_play_history_song', 'play_history', 'song_uuid')
-    _create_index_if_not_exists(cur, 'idx_user_queue_user', 'user_queue', 'user_id')
+
+    # Per-user history: a covering index in played_at order for the listings,
+    # and (user_id, song_uuid) for the per-song grouping. They replace the
+    # plain user_id index and its (user_id, played_at) successor.
+    cur.execute("SELECT name FROM sqlite_master WHERE type='index' AND name='idx_play_history_user_played'")
+    if not cur.fetchone():
+        cur.execute('''
+            CREATE INDEX idx_play_history_user_played ON play_history(
+                user_id, played_at, song_uuid, skipped, source, play_duration_seconds)
+        ''')
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_play_history_user_song ON play_history(user_id, song_uuid)')
+        cur.execute('DROP INDEX IF EXISTS idx_play_history_user_time')
+        cur.execute('DROP INDEX IF EXISTS idx_play_history_user')
+        cur.execute('ANALYZE play_history')
+
+    # The latest play of one song (radio_skip marks it skipped) is a seek on
+    # (user_id, song_uuid, played_at); the per-song grouping uses its prefix,
+    # so it replaces the (user_id, song_uuid) index.
+    cur.execute("SELECT name FROM sqlite_master WHERE type='index' AND name='idx_play_history_user_song_played'")
+    if not cur.fetchone():
+        cur.execute('''
+            CREATE INDEX idx_play_history_user_song_played ON play_history(
+                user_id, song_uuid, played_at)
+        ''')
+        cur.execute('DROP INDEX IF EXISTS idx_play_history_user_song')
+        cur.execute('ANALYZE play_history')
+
+    # Queue reads walk one user's rows in position order for the song_uuid
+    # (the join key into songs); carrying it in the index keeps that walk off
+    # the table. The user_id prefix makes the plain user_id index redundant.
+    cur.execute("SELECT name FROM sqlite_master WHERE type='index' AND name='idx_user_queue_user_pos'")
+    if not cur.fetchone():
+        cur.execute('CREATE INDEX idx_user_queue_user_pos ON user_queue(user_id, position, song_uuid)')
+        cur.execute('DROP INDEX IF EXISTS idx_user_queue_user')
+
+    # Radio and SCA picks skip songs already in the user's queue; this turns
+    # that NOT IN into a probe per candidate instead of a walk of the queue.
+    cur.execute("SELECT name FROM sqlite_master WHERE type='index' AND name='idx_user_queue_user_song'")
+    if not cur.fetchone():
+        cur.execute('CREATE INDEX idx_user_queue_user_song ON user_queue(user_id, song_uuid)')
+        cur.execute('ANALYZE user_queue')
+
+    # Radio filters and the genre browser narrow by category, then genre.
+    # The composite index serves both; it replaces the plain category index,
+    # which is its prefix.
+    cur.execute("SELECT name FROM sqlite_master WHERE type='index' AND name='idx_songs_category_genre'")
+    if not cur.fetchone():
+        cur.execute('CREATE INDEX idx_songs_category_genre ON songs(category, genre)')
+        cur.execute('DROP INDEX IF EXISTS idx_songs_category')
+        cur.execute('ANALYZE songs')
+
+    # Filtered song lists (queue_add_by_filter and friends) sort by artist,
+    # album, disc, track; with uuid carried along an artist filter, or no
+    # filter at all, walks this index in order and stops at the LIMIT. It
+    # replaces the plain artist index, which is its prefix.
+    cur.execute("SELECT name FROM sqlite_master WHERE type='index' AND name='idx_songs_artist_album_track'")
+    if not cur.fetchone():
+        cur.execute('''
+            CREATE INDEX idx_songs_artist_album_track ON songs(
+                artist, album, disc_number, track_number, uuid)
+        ''')
+        cur.execute('DROP INDEX IF EXISTS idx_songs_artist')
+
+    # EQ presets are listed per user in name order; this index returns them
+    # already sorted and covers everything but the bands. It replaces the
+    # plain user_id index.
+    cur.execute("SELECT name FROM sqlite_master WHERE type='index' AND name='idx_eq_presets_user_name'")
+    if not cur.fetchone():
+        cur.execute('''
+            CREATE INDEX idx_eq_presets_user_name ON eq_presets(
+                user_id, name, uuid, created_at, updated_at)
+        ''')
+        cur.execute('DROP INDEX IF EXISTS idx_eq_presets_user')
 
     # AI embeddings table - tracks which songs have CLAP embeddings
     if 'ai_embeddings' not in existing_tables:
@@ -569,6 +895,17 @@ def row_to_dict(row):
     return dict(row)
 
 
-def rows_to_list(rows):
-    """Convert a list of sqlite3.Row to a list of dictionaries."""
-    return [dict(row) for row in rows]
+def rows_to_list(rows, columns=None):
+    """Convert a list of sqlite3.Row to a list of dictionaries.
+
+    Pass the column names (see cursor_columns) to zip them with each row
+    instead of looking every key up through the Row mapping interface.
+    """
+    if columns is None:
+        return [dict(row) for row in rows]
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def cursor_columns(cur):
+    """Return the column names of the cursor's current result set."""
+    return tuple(d[0] for d in cur.description)
@@ -0,0 +1,59 @@
+"""
+JSON encoding helpers for mrepo.
+
+Uses orjson when it is installed and falls back to the standard library
+otherwise. json_loads accepts str or bytes; json_dumps returns str, so the
+result can go into TEXT columns or responses unchanged, and json_dumpb
+returns the UTF-8 bytes for callers that can use them without decoding.
+JSONStream marks a document that is produced piece by piece.
+"""
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+import json
+
+
+if orjson is not None:
+    def json_loads(data):
+        """Parse a JSON document from str or bytes."""
+        return orjson.loads(data)
+
+    def json_dumps(obj):
+        """Serialize obj to a compact JSON string."""
+        return orjson.dumps(obj).decode('utf-8')
+
+    def json_dumpb(obj):
+        """Serialize obj to compact JSON as UTF-8 bytes."""
+        return orjson.dumps(obj)
+else:
+    def json_loads(data):
+        """Parse a JSON document from str or bytes."""
+        return json.loads(data)
+
+    def json_dumps(obj):
+        """Serialize obj to a compact JSON string."""
+        return json.dumps(obj, separators=(',', ':'))
+
+    def json_dumpb(obj):
+        """Serialize obj to compact JSON as UTF-8 bytes."""
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+class JSONStream:
+    """A JSON document as an iterable of already-encoded byte chunks.
+
+    raw_json API methods may return one instead of a plain result; the
+    dispatcher then streams the chunks into the response as they are
+    produced rather than holding the whole document in memory.
+    """
+
+    __slots__ = ('chunks',)
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def __iter__(self):
+        return iter(self.chunks)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Tests for the browse API (backend/api/browse.py) against a scratch database.
+
+Covers the paths where browse trades simple Python for SQL: file listings
+paginated in SQL, aggregates cached by database version, and the fused
+album page + totals query. The request connection plumbing in db.py that
+browse runs on is tested here too, on the same scratch library.
+
+Run: python3 backend/test_browse.py   (from the mrepo-web repo root)
+"""
+
+import sqlite3
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+from flask import Flask
+
+_repo_root = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(_repo_root))
+
+from backend import db as db_mod  # noqa: E402
+from backend.api import browse as browse_mod  # noqa: E402
+
+
+class _LibraryTestCase(unittest.TestCase):
+    """A scratch library database served through a Flask app context."""
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = str(Path(self._tmpdir.name) / 'music.db')
+
+        self.conn = sqlite3.connect(self.db_path, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        db_mod._run_migrations(self.conn)
+
+        songs = []
+        for i in range(12):
+            folder = 'Rock' if i % 2 else 'Jazz'
+            songs.append((f'song-{i}', f'/music/{folder}/track{i:02d}.flac',
+                          f'Track {i:02d}' if i % 3 else None,
+                          'Artist A' if i < 6 else 'Artist B', f'Album {i % 3}', 'Music'))
+        songs.append(('loose', '/music/loose.flac', 'Loose', 'Artist A', '', 'Music'))
+        self.conn.executemany(
+            "INSERT INTO songs (uuid, file, title, artist, album, category) VALUES (?, ?, ?, ?, ?, ?)",
+            songs)
+
+        self.app = Flask(__name__)
+        self.app.config['DATABASE_PATH'] = self.db_path
+        self.app.config['DATABASE_TIMEOUT'] = 5
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+
+    def tearDown(self):
+        self.ctx.pop()
+        self.conn.close()
+        self._tmpdir.cleanup()
+
+
+class BrowseTest(_LibraryTestCase):
+    def test_path_pages_match_single_listing(self):
+        full = browse_mod.browse_path('/music/Rock', limit=1000)
+        self.assertEqual(full['totalCount'], len(full['items']))
+        self.assertFalse(full['hasMore'])
+
+        paged, cursor = [], None
+        while True:
+            page = browse_mod.browse_path('/music/Rock', cursor=cursor, limit=4)
+            paged.extend(page['items'])
+            if not page['hasMore']:
+                break
+            cursor = page['nextCursor']
+        self.assertEqual(paged, full['items'])
+
+    def test_path_lists_directories_before_files(self):
+        result = browse_mod.browse_path('/music', limit=2)
+        self.assertEqual([i['type'] for i in result['items']], ['directory', 'directory'])
+        self.assertEqual(result['totalCount'], 3)
+
+        rest = browse_mod.browse_path('/music', cursor=result['nextCursor'], limit=2)
+        self.assertEqual(rest['items'][0]['name'], 'Loose')
+        self.assertFalse(rest['hasMore'])
+
+    def test_path_folds_nested_directories(self):
+        self.conn.executemany(
+            "INSERT INTO songs (uuid, file, title) VALUES (?, ?, ?)",
+            [('deep-1', '/music/Rock/Live/1999/a.flac', 'A'),
+             ('deep-2', '/music/Rock/Live/b.flac', 'B'),
+             ('wild', '/music/RockXLive/c.flac', 'C')])
+        result = browse_mod.browse_path('/music/Rock', limit=100)
+        dirs = [i for i in result['items'] if i['type'] == 'directory']
+        self.assertEqual(dirs, [{'type': 'directory', 'name': 'Live',
+                                 'song_count': 2}])
+        self.assertEqual(len(browse_mod.browse_path('/music/Rock_Live', limit=100)['items']), 0)
+
+    def test_untitled_files_use_basename(self):
+        items = browse_mod.browse_path('/music/Jazz', limit=100)['items']
+        names = {i['uuid']: i['name'] for i in items}
+        self.assertEqual(names['song-0'], 'track00.flac')
+        self.assertEqual(names['song-2'], 'Track 02')
+
+    def test_album_songs_columnar_matches_items(self):
+        rows = browse_mod.browse_album_songs('Album 1', limit=3)
+        columnar = browse_mod.browse_album_songs('Album 1', limit=3, format='columnar')
+        self.assertNotIn('items', columnar)
+        self.assertEqual([dict(zip(columnar['columns'], r)) for r in columnar['rows']], rows['items'])
+        self.assertEqual(columnar['nextCursor'], rows['nextCursor'])
+
+    def test_aggregates_refresh_after_write(self):
+        before = browse_mod.browse_categories()
+        self.assertEqual(before['items'], [{'name': 'Music', 'song_count': 13}])
+        self.assertEqual(browse_mod.browse_categories(), before)
+
+        self.conn.execute(
+            "INSERT INTO songs (uuid, file, title, category) VALUES ('new', '/other/new.flac', 'New', 'Other')")
+        after = browse_mod.browse_categories()
+        self.assertEqual(after['totalCount'], 2)
+
+    def test_cached_listings_are_fresh_per_call(self):
+        for listing in (browse_mod.browse_categories, browse_mod.browse_genres):
+            first = listing()
+            expected = [dict(item) for item in first['items']]
+            first['items'][0]['song_count'] = -1
+            first['items'].append({'name': 'junk', 'song_count': 0})
+            first['extra'] = True
+            again = listing()
+            self.assertEqual(again['items'], expected)
+            self.assertNotIn('extra', again)
+
+    def test_albums_past_last_page_keeps_totals(self):
+        first = browse_mod.browse_albums(limit=100)
+        self.assertEqual(first['items'][0]['name'], '[All Albums]')
+        self.assertEqual(first['items'][0]['song_count'], 13)
+
+        past_end = browse_mod.browse_albums(cursor='500', limit=100)
+        self.assertEqual(past_end['items'], [])
+        self.assertEqual(past_end['totalCount'], first['totalCount'])
+
+
+class DbConnectionTest(_LibraryTestCase):
+    """Connection plumbing in backend/db.py: pooling, shutdown, PRAGMAs."""
+
+    def test_request_connections_are_pooled(self):
+        conn = db_mod.get_db()
+        conn.execute('BEGIN IMMEDIATE')
+        db_mod.close_db()
+
+        with self.app.app_context():
+            reused = db_mod.get_db()
+            self.assertIs(reused, conn)
+            self.assertFalse(reused.in_transaction)
+            db_mod.close_db()
+
+    def test_idle_connections_closed_at_exit(self):
+        conn = db_mod.get_db()
+        db_mod.close_db()
+        db_mod._close_idle_connections()
+        with self.assertRaises(sqlite3.ProgrammingError):
+            conn.execute('SELECT 1')
+
+    def test_connections_apply_pragmas(self):
+        conn = db_mod.get_db()
+        pragmas = {name: conn.execute(f'PRAGMA {name}').fetchone()[0]
+                   for name in ('journal_mode', 'synchronous', 'temp_store', 'foreign_keys')}
+        self.assertEqual(pragmas, {'journal_mode': 'wal', 'synchronous': 1,
+                                   'temp_store': 2, 'foreign_keys': 0})
+        self.assertEqual(conn.execute('PRAGMA busy_timeout').fetchone()[0], 5000)
+        db_mod.close_db()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -20,6 +20,7 @@ import json
 import sqlite3
 import sys
 import tempfile
+import threading
 import unittest
 import uuid as uuid_mod
 from pathlib import Path
@@ -40,11 +41,24 @@ from backend.api import history as history_mod  # noqa: E402
 USER = 'contract-test-user'
 DETAILS = {'user_id': USER}
 
-# Modules whose module-level get_db reference must be redirected to the scratch DB
+# Modules whose module-level get_db (and get_read_db, get_data_version)
+# references must be redirected to the scratch DB
 _PATCH_MODULES = [queue_mod, sync_mod, playlists_mod, preferences_mod,
                   playback_mod, history_mod]
 
 
+def _patch_db(modules, conn):
+    """Point each module's connection accessors at the scratch connection."""
+    for m in modules:
+        m.get_db = lambda c=conn: c
+        if hasattr(m, 'get_read_db'):
+            m.get_read_db = lambda c=conn: c
+        if hasattr(m, 'get_data_version'):
+            # Every write goes through the one connection, whose own
+            # data_version never moves; its change counter does
+            m.get_data_version = lambda c=conn: c.total_changes
+
+
 def _make_conn(db_path):
     # Mirror db._create_connection settings: autocommit + Row factory
     conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False,
@@ -69,8 +83,8 @@ class SyncContractTest(unittest.TestCase):
             "INSERT INTO songs (uuid, file, title) VALUES (?, ?, ?)",
             [(u, f'/music/{u}.flac', u) for u in self.songs])
 
-        for m in _PATCH_MODULES:
-            m.get_db = lambda c=self.conn: c
+        _patch_db(_PATCH_MODULES, self.conn)
+        preferences_mod._prefs_cache.clear()
 
     def tearDown(self):
         self.conn.close()
@@ -105,6 +119,10 @@ class SyncContractTest(unittest.TestCase):
         r = queue_mod.queue_add(uuids, None, details=DETAILS)
         self.assertFalse(r.get('error'), f'seed queue_add failed: {r}')
 
+    def _queue_list(self, **kwargs):
+        # queue_list streams its result; join the chunks as the response would
+        return json.loads(b''.join(queue_mod.queue_list(details=DETAILS, **kwargs)))
+
     def _set_index(self, index, device='dev-a', seq=1):
         r = queue_mod.queue_set_index(index, device, seq, details=DETAILS)
         self.assertFalse(r.get('error'), f'set_index failed: {r}')
@@ -118,6 +136,18 @@ class SyncContractTest(unittest.TestCase):
         self.assertEqual(result['executed'], 1)
         self.assertEqual(self._queue_uuids(), self.songs[:3])
 
+    def test_queue_add_past_end_keeps_positions_dense(self):
+        self._seed_queue(self.songs[:4])
+        r = queue_mod.queue_add([self.songs[4]], position=10, details=DETAILS)
+        self.assertEqual(r['queueLength'], 5)
+        self.assertEqual(self._queue_uuids(), self.songs[:5])
+        self.assertEqual(queue_mod.queue_remove([], details=DETAILS)['queueLength'], 5)
+        with self.assertRaises(ValueError):
+            queue_mod.queue_reorder(0, 7, details=DETAILS)
+        r = queue_mod.queue_add([self.songs[5]], position=-3, details=DETAILS)
+        self.assertEqual(r['queueLength'], 6)
+        self.assertEqual(self._queue_uuids(), [self.songs[5]] + self.songs[:5])
+
     def test_queue_remove_verified_payload(self):
         self._seed_queue(self.songs[:5])
         payload = {
@@ -201,6 +231,57 @@ class SyncContractTest(unittest.TestCase):
         self.assertEqual(row['active_device_id'], 'dev-a')
         self.assertEqual(row['active_device_seq'], 7)
 
+    def test_queue_add_by_playlist_runs_in_one_transaction(self):
+        pid = playlists_mod.playlists_create('p', '', False, details=DETAILS)['id']
+        playlists_mod.playlists_add_songs(
+            pid, [self.songs[1], self.songs[0], self.songs[1]], details=DETAILS)
+        self._seed_queue(self.songs[:1])
+        r = queue_mod.queue_add_by_playlist(pid, position=0, details=DETAILS)
+        self.assertEqual((r['added'], r['queueLength']), (3, 4))
+        self.assertEqual(self._queue_uuids(),
+                         [self.songs[1], self.songs[0], self.songs[1], self.songs[0]])
+
+        with self.assertRaises(ValueError):
+            queue_mod.queue_add_by_playlist(pid, details={'user_id': 'someone-else'})
+        self.assertFalse(self.conn.in_transaction)
+
+    def test_queue_add_by_path_is_a_literal_prefix(self):
+        self.assertEqual(queue_mod.queue_add_by_path('/music/song_1', details=DETAILS)['added'], 0)
+        r = queue_mod.queue_add_by_path('/music/song-1', details=DETAILS)
+        self.assertEqual(r['added'], 1)
+        queue_mod.queue_add_by_path('', details=DETAILS)
+        self.assertEqual(self._queue_uuids(), [self.songs[1]] + self.songs)
+
+    def test_queue_list_folds_in_playback_state(self):
+        empty = self._queue_list()
+        self.assertEqual((empty['items'], empty['queueIndex'], empty['playMode'],
+                          empty['volume']), ([], 0, 'sequential', 1.0))
+
+        self._seed_queue(self.songs[:3])
+        fresh = self._queue_list()
+        self.assertEqual((fresh['queueIndex'], fresh['activeDeviceSeq']), (0, 0))
+
+        self._set_index(2, device='dev-b', seq=4)
+        listed = self._queue_list()
+        self.assertEqual([i['uuid'] for i in listed['items']], self.songs[:3])
+        self.assertEqual(listed['items'][2]['position'], 2)
+        self.assertNotIn('queue_index', listed['items'][0])
+        self.assertEqual((listed['queueIndex'], listed['activeDeviceId'],
+                          listed['activeDeviceSeq']), (2, 'dev-b', 4))
+
+        queue_mod._QUEUE_LIST_BATCH, batch = 2, queue_mod._QUEUE_LIST_BATCH
+        try:
+            self._seed_queue(self.songs[3:])
+            self.assertEqual([i['uuid'] for i in self._queue_list()['items']],
+                             self.songs[:3] + self.songs[3:])
+        finally:
+            queue_mod._QUEUE_LIST_BATCH = batch
+
+        minimal = self._queue_list(minimal=True)
+        self.assertEqual(set(minimal['items'][0]),
+                         {'uuid', 'title', 'artist', 'album', 'duration_seconds', 'position'})
+        self.assertEqual(minimal['queueIndex'], 2)
+
     # ---- queue_index maintenance across mutations --------------------------
 
     def test_remove_before_current_shifts_index(self):
@@ -214,6 +295,19 @@ class SyncContractTest(unittest.TestCase):
         self.assertEqual(self._queue_uuids()[row['queue_index']], self.songs[3])
         self.assertEqual(row['queue_index'], 1)
 
+    def test_remove_shifts_only_rows_after_gap(self):
+        dupes = [self.songs[0], self.songs[1], self.songs[0], self.songs[2], self.songs[0]]
+        self._seed_queue(dupes)
+        before = self.conn.execute(
+            "SELECT rowid FROM user_queue WHERE user_id = ? ORDER BY position", (USER,)).fetchall()
+        r = queue_mod.queue_remove([3], details=DETAILS)
+        self.assertEqual(r['queueLength'], 4)
+        self.assertEqual(self._queue_uuids(), dupes[:3] + dupes[4:])
+        after = self.conn.execute(
+            "SELECT rowid FROM user_queue WHERE user_id = ? ORDER BY position", (USER,)).fetchall()
+        self.assertEqual([row[0] for row in after],
+                         [row[0] for row in before[:3] + before[4:]])
+
     def test_reorder_keeps_current_anchored(self):
         # Playing s0 (index 0). Move it to position 2 -> index follows to 2.
         self._seed_queue(self.songs[:4])
@@ -232,6 +326,47 @@ class SyncContractTest(unittest.TestCase):
         row = self._playback_row()
         self.assertEqual(self._queue_uuids()[row['queue_index']], self.songs[2])
 
+    def test_random_sort_shuffles_rows_in_place(self):
+        base = self.songs + [self.songs[0]]
+        self._seed_queue(base)
+        self._set_index(6)
+        playing = self.conn.execute(
+            "SELECT rowid FROM user_queue WHERE user_id = ? AND position = 6", (USER,)).fetchone()[0]
+        r = queue_mod.queue_sort('random', details=DETAILS)
+        self.assertEqual(sorted(self._queue_uuids()), sorted(base))
+        self.assertEqual(self.conn.execute(
+            "SELECT position FROM user_queue WHERE rowid = ?", (playing,)).fetchone()[0], r['newIndex'])
+
+    def test_reorder_batch_matches_list_splice(self):
+        base = self.songs[:4] + [self.songs[0]]
+        for moved in ([0], [4], [0, 4], [1, 2], [0, 2, 3], [1, 3, 4]):
+            for target in range(len(base) + 1):
+                with self.subTest(moved=moved, target=target):
+                    self.conn.execute("DELETE FROM user_queue")
+                    self._seed_queue(base)
+                    rest = [u for i, u in enumerate(base) if i not in moved]
+                    at = max(0, min(target - sum(p < target for p in moved), len(rest)))
+                    expected = rest[:at] + [base[p] for p in moved] + rest[at:]
+                    queue_mod.queue_reorder_batch(moved, target, details=DETAILS)
+                    self.assertEqual(self._queue_uuids(), expected)
+
+    def test_sort_keeps_playing_copy_anchored(self):
+        # Playing the second copy of s0; the sort must follow that copy
+        self._seed_queue([self.songs[2], self.songs[0], self.songs[1], self.songs[0]])
+        self._set_index(3)
+        self.conn.execute("INSERT INTO user_queue (user_id, song_uuid, position) "
+                          "VALUES (?, 'gone-uuid', 4)", (USER,))
+        r = queue_mod.queue_sort('title', details=DETAILS)
+        self.assertEqual((r['queueLength'], r['newIndex']), (5, 1))
+        self.assertEqual(self._queue_uuids(),
+                         [self.songs[0], self.songs[0], self.songs[1], self.songs[2], 'gone-uuid'])
+        self.assertEqual(self._playback_row()['queue_index'], 1)
+
+        r = queue_mod.queue_sort('title', 'desc', details=DETAILS)
+        self.assertEqual(r['newIndex'], 3)
+        self.assertEqual(self._queue_uuids()[:4],
+                         [self.songs[2], self.songs[1], self.songs[0], self.songs[0]])
+
     # ---- playlist ops -------------------------------------------------------
 
     def test_playlists_add_song_payload(self):
@@ -330,6 +465,147 @@ class SyncContractTest(unittest.TestCase):
         rows = self._playlist_rows(pid)
         self.assertEqual([u for u, _ in rows], [self.songs[1]])
 
+    def test_remove_songs_legacy_uuids_removes_all_copies(self):
+        created = playlists_mod.playlists_create('dupes', '', False, details=DETAILS)
+        pid = created['id']
+        playlists_mod.playlists_add_songs(
+            pid, [self.songs[0], self.songs[1], self.songs[2], self.songs[0]], details=DETAILS)
+        r = playlists_mod.playlists_remove_songs(
+            pid, [self.songs[0], self.songs[2], self.songs[0]], details=DETAILS)
+        self.assertEqual(r['removed'], 3)
+        self.assertEqual([u for u, _ in self._playlist_rows(pid)], [self.songs[1]])
+
+    def test_sort_keeps_duplicates_and_renumbers(self):
+        created = playlists_mod.playlists_create('dupes', '', False, details=DETAILS)
+        pid = created['id']
+        playlists_mod.playlists_add_songs(
+            pid, [self.songs[2], self.songs[0], self.songs[1], self.songs[0]], details=DETAILS)
+        r = playlists_mod.playlists_sort(pid, 'title', 'desc', details=DETAILS)
+        self.assertEqual(r['songCount'], 4)
+        rows = self._playlist_rows(pid)
+        self.assertEqual([u for u, _ in rows],
+                         [self.songs[2], self.songs[1], self.songs[0], self.songs[0]])
+        self.assertEqual([p for _, p in rows], [0, 1, 2, 3])
+
+    def test_history_cursor_pages_match_offset_pages(self):
+        # Same-second plays tie on played_at; the id breaks the tie.
+        self.conn.executemany(
+            "INSERT INTO play_history (user_id, song_uuid, played_at) VALUES (?, ?, ?)",
+            [(USER, self.songs[i % 3], f'2024-01-0{1 + i // 2} 10:00:00') for i in range(7)])
+        for fn in (history_mod.history_list, history_mod.history_grouped):
+            full = fn(limit=100, details=DETAILS)
+            paged, cursor = [], None
+            while True:
+                page = fn(cursor=cursor, limit=2, details=DETAILS)
+                paged.extend(page['items'])
+                if not page['hasMore']:
+                    break
+                cursor = page['nextCursor']
+            self.assertEqual(paged, full['items'])
+            self.assertEqual(full['totalCount'], len(full['items']))
+
+    def test_history_filters_agree_across_endpoints(self):
+        self.conn.executemany(
+            "INSERT INTO play_history (user_id, song_uuid, played_at, skipped) VALUES (?, ?, ?, ?)",
+            [(USER, self.songs[i % 3], f'2024-01-0{1 + i} 10:00:00', i % 2) for i in range(6)])
+        filters = {'start_date': '2024-01-02', 'end_date': '2024-01-05', 'exclude_skipped': True}
+        listed = history_mod.history_list(**filters, details=DETAILS)
+        self.assertEqual([i['played_at'][:10] for i in listed['items']],
+                         ['2024-01-05', '2024-01-03'])
+        uuids = history_mod.history_get_uuids(**filters, include_total=True, details=DETAILS)
+        self.assertEqual(uuids['uuids'], [i['uuid'] for i in listed['items']])
+        self.assertEqual(uuids['totalCount'], listed['totalCount'])
+        grouped = history_mod.history_grouped(**filters, details=DETAILS)
+        self.assertEqual(grouped['totalCount'], 2)
+
+    def test_playlist_songs_total_only_on_request(self):
+        pid = playlists_mod.playlists_create('p', '', False, details=DETAILS)['id']
+        playlists_mod.playlists_add_songs(pid, self.songs, details=DETAILS)
+        first = playlists_mod.playlists_get_songs(pid, limit=4, details=DETAILS)
+        self.assertEqual(first['totalCount'], len(self.songs))
+        rest = playlists_mod.playlists_get_songs(
+            pid, cursor=first['nextCursor'], limit=4, details=DETAILS)
+        self.assertIsNone(rest['totalCount'])
+        self.assertFalse(rest['hasMore'])
+        self.assertEqual(playlists_mod.playlists_get_songs(
+            pid, cursor=first['nextCursor'], include_total=True, details=DETAILS)['totalCount'],
+            len(self.songs))
+        self.assertIsNone(playlists_mod.playlists_get_songs(
+            pid, include_total=False, details=DETAILS)['totalCount'])
+
+    def test_playlist_song_count_follows_writes(self):
+        pid = playlists_mod.playlists_create('p', '', False, details=DETAILS)['id']
+
+        def listed_count():
+            items = playlists_mod.playlists_list(details=DETAILS)['items']
+            return next(p['song_count'] for p in items if p['id'] == pid)
+
+        playlists_mod.playlists_add_songs(pid, self.songs[:4] + self.songs[:1], details=DETAILS)
+        self.assertEqual(listed_count(), 5)
+        playlists_mod.playlists_remove_songs(pid, [self.songs[1]], indices=[1], details=DETAILS)
+        self.assertEqual(listed_count(), 4)
+        playlists_mod.playlists_reorder(pid, [
+            {'uuid': u, 'position': i}
+            for i, u in enumerate([self.songs[0], self.songs[0], self.songs[3], self.songs[2]])
+        ], details=DETAILS)
+        self.assertEqual(listed_count(), 4)
+        self.assertEqual(listed_count(), len(self._playlist_rows(pid)))
+
+    def test_history_record_batches_keep_ids(self):
+        results = []
+        errors = []
+
+        def record(song_uuid):
+            try:
+                results.append(
+                    (song_uuid, history_mod.history_record(song_uuid, details=DETAILS)['id']))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=record, args=(u,)) for u in self.songs * 3]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        stored = dict(self.conn.execute(
+            "SELECT id, song_uuid FROM play_history WHERE user_id = ?", (USER,)).fetchall())
+        self.assertEqual(len(stored), len(threads))
+        for song_uuid, history_id in results:
+            self.assertEqual(stored[history_id], song_uuid)
+        # song_uuid is NOT NULL; the writer hands the failure back to the caller
+        with self.assertRaises(sqlite3.IntegrityError):
+            history_mod.history_record(None, details=DETAILS)
+
+    def test_appends_after_reorder_and_other_inserts(self):
+        pid = playlists_mod.playlists_create('p', '', False, details=DETAILS)['id']
+        playlists_mod.playlists_add_songs(pid, self.songs[:2], details=DETAILS)
+        playlists_mod.playlists_reorder(pid, [
+            {'uuid': self.songs[1], 'position': 0},
+            {'uuid': self.songs[0], 'position': 10},
+        ], details=DETAILS)
+        self.conn.execute(
+            "INSERT INTO playlist_songs (playlist_id, song_uuid, position) VALUES (?, ?, 20)",
+            (pid, self.songs[2]))
+        r = playlists_mod.playlists_add_song(pid, self.songs[3], details=DETAILS)
+        self.assertEqual(r['position'], 21)
+        self.assertEqual([u for u, _ in self._playlist_rows(pid)],
+                         [self.songs[1], self.songs[0], self.songs[2], self.songs[3]])
+
+    def test_clone_copies_songs_and_checks_access(self):
+        pid = playlists_mod.playlists_create('p', '', False, details=DETAILS)['id']
+        playlists_mod.playlists_add_songs(pid, [self.songs[0], self.songs[1], self.songs[0]],
+                                          details=DETAILS)
+        r = playlists_mod.playlists_clone(pid, details=DETAILS)
+        self.assertEqual(r['name'], 'p (Copy)')
+        self.assertEqual(self._playlist_rows(r['id']), self._playlist_rows(pid))
+        added = playlists_mod.playlists_add_song(r['id'], self.songs[2], details=DETAILS)
+        self.assertEqual(added['position'], self._playlist_rows(pid)[-1][1] + 1)
+
+        with self.assertRaises(ValueError):
+            playlists_mod.playlists_clone(pid, details={'user_id': 'someone-else'})
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM playlists").fetchone()[0], 2)
+
     def test_queue_save_as_playlist_keeps_duplicates(self):
         self._seed_queue([self.songs[0], self.songs[1], self.songs[0]])
         r = queue_mod.queue_save_as_playlist('mixtape', details=DETAILS)
@@ -339,6 +615,14 @@ class SyncContractTest(unittest.TestCase):
         self.assertEqual([u for u, _ in rows],
                          [self.songs[0], self.songs[1], self.songs[0]])
 
+    def test_queue_save_as_playlist_picks_lowest_free_name(self):
+        self._seed_queue(self.songs[:1])
+        for name in ('mix (3)', 'mix (x)', 'Mix', 'mix (03)'):
+            playlists_mod.playlists_create(name, '', False, details=DETAILS)
+        names = [queue_mod.queue_save_as_playlist(' mix ', details=DETAILS)['name']
+                 for _ in range(4)]
+        self.assertEqual(names, ['mix', 'mix (2)', 'mix (4)', 'mix (5)'])
+
     def test_temp_playlist_id_resolution_and_map(self):
         result, _ = self._push_and_commit([
             ('playlists.create', {'name': 'road trip', 'description': '',
@@ -373,6 +657,80 @@ class SyncContractTest(unittest.TestCase):
         self.assertAlmostEqual(row['ai_search_diversity'], 0.7)
         self.assertAlmostEqual(row['ai_radio_queue_diversity'], 0.4)
 
+    def test_preferences_set_merges_supplied_fields(self):
+        preferences_mod.preferences_set(volume=0.5, details=DETAILS)
+        prefs = preferences_mod.preferences_get(details=DETAILS)
+        self.assertEqual((prefs['volume'], prefs['replay_gain_fallback']), (0.5, -6.0))
+
+        preferences_mod.preferences_set(shuffle=True, details=DETAILS)
+        preferences_mod.preferences_set(details=DETAILS)
+        prefs = preferences_mod.preferences_get(details=DETAILS)
+        self.assertEqual((prefs['volume'], prefs['shuffle'], prefs['radio_eopp']),
+                         (0.5, True, False))
+        self.assertIs(prefs['shuffle'], True)
+
+    def test_preferences_set_is_one_statement(self):
+        statements = []
+        self.conn.set_trace_callback(statements.append)
+        try:
+            preferences_mod.preferences_set(volume=0.5, details=DETAILS)
+            preferences_mod.preferences_set(dark_mode=True, details=DETAILS)
+        finally:
+            self.conn.set_trace_callback(None)
+        self.assertEqual(len(statements), 2)
+        self.assertTrue(all('ON CONFLICT' in sql for sql in statements))
+
+    def test_preferences_get_cache_sees_other_writers(self):
+        preferences_mod.preferences_set(volume=0.5, details=DETAILS)
+        self.assertEqual(preferences_mod.preferences_get(details=DETAILS)['volume'], 0.5)
+        self.conn.execute("UPDATE user_preferences SET volume = 0.25 WHERE user_id = ?", (USER,))
+        self.assertEqual(preferences_mod.preferences_get(details=DETAILS)['volume'], 0.25)
+
+    def test_eq_presets_round_trip_bands(self):
+        bands = [{'type': 'lowshelf', 'frequency': 60, 'gain': 2.5, 'q': 0.7},
+                 {'type': 'peaking', 'frequency': 1000, 'gain': -1, 'q': 1.4, 'enabled': False}]
+        preferences_mod.eq_presets_save(
+            name='warm', bands=[dict(b, label='UI only') for b in bands], details=DETAILS)
+        preferences_mod.eq_presets_save(name='broken', bands='{not json', details=DETAILS)
+        presets = {p['name']: p['bands']
+                   for p in preferences_mod.eq_presets_list(details=DETAILS)['presets']}
+        self.assertEqual(presets, {'warm': bands, 'broken': []})
+        self.assertEqual({r[0] for r in self.conn.execute("SELECT typeof(bands) FROM eq_presets")},
+                         {'text'})
+        counts = {p['name']: p['band_count'] for p in preferences_mod.eq_presets_list(
+            summary=True, details=DETAILS)['presets']}
+        self.assertEqual(counts, {'warm': 2, 'broken': 0})
+
+    def test_eq_presets_list_is_fresh_per_call(self):
+        bands = [{'type': 'peaking', 'frequency': 1000, 'gain': -1, 'q': 1.4}]
+        preferences_mod.eq_presets_save(name='a', bands=bands, details=DETAILS)
+        preferences_mod.eq_presets_save(name='b', bands=bands, details=DETAILS)
+        first = preferences_mod.eq_presets_list(details=DETAILS)['presets']
+        first[0]['bands'][0]['gain'] = 99
+        first[0]['bands'].append({'type': 'junk'})
+        again = preferences_mod.eq_presets_list(details=DETAILS)['presets']
+        self.assertEqual([p['bands'] for p in again], [bands, bands])
+
+    def test_eq_presets_bulk_save_and_delete(self):
+        first = preferences_mod.eq_presets_save_bulk(
+            [{'name': 'a', 'bands': [1]}, {'uuid': 'client-b', 'name': 'b', 'bands': [1, 2]}],
+            details=DETAILS)['presets']
+        self.assertEqual([p['name'] for p in first], ['a', 'b'])
+        preferences_mod.eq_presets_save_bulk(
+            [{'uuid': 'client-b', 'name': 'b2', 'bands': [3]}], details=DETAILS)
+        with self.assertRaises(ValueError):
+            preferences_mod.eq_presets_save_bulk(
+                [{'uuid': 'client-b', 'name': 'stolen', 'bands': []}],
+                details={'user_id': 'someone-else'})
+        presets = {p['uuid']: (p['name'], p['bands'])
+                   for p in preferences_mod.eq_presets_list(details=DETAILS)['presets']}
+        self.assertEqual(presets['client-b'], ('b2', [3]))
+
+        r = preferences_mod.eq_presets_delete_bulk(
+            [first[0]['uuid'], 'client-b', 'missing'], details=DETAILS)
+        self.assertEqual(r['deleted'], 2)
+        self.assertEqual(preferences_mod.eq_presets_list(details=DETAILS)['presets'], [])
+
     # ---- commit idempotency -------------------------------------------------
 
     def test_commit_is_idempotent(self):
@@ -483,6 +841,30 @@ class SyncContractTest(unittest.TestCase):
         self.assertEqual(row['queue_index'], 0)
         self.assertEqual(row['active_device_id'], 'dev-a')
 
+    def test_set_index_skips_stale_device_seq(self):
+        self._seed_queue(self.songs[:3])
+        self.assertTrue(queue_mod.queue_set_index(1, 'dev-a', 0, details=DETAILS)['skipped'])
+        self.assertFalse(queue_mod.queue_set_index(1, 'dev-a', 5, details=DETAILS)['skipped'])
+        for stale in (5, 4):
+            r = queue_mod.queue_set_index(2, 'dev-a', stale, details=DETAILS)
+            self.assertEqual(r['reason'], 'stale_seq')
+        self.assertFalse(queue_mod.queue_set_index(2, 'dev-b', 1, details=DETAILS)['skipped'])
+        row = self._playback_row()
+        self.assertEqual((row['queue_index'], row['active_device_id']), (2, 'dev-b'))
+        self.assertFalse(self.conn.in_transaction)
+
+    def test_legacy_set_index_preserves_device_columns(self):
+        self._seed_queue(self.songs[:3])
+        queue_mod.queue_set_index(0, details=DETAILS)
+        row = self._playback_row()
+        self.assertEqual((row['active_device_id'], row['active_device_seq']), (None, 0))
+
+        queue_mod.queue_set_index(1, 'dev-a', 5, details=DETAILS)
+        queue_mod.queue_set_index(2, details=DETAILS)
+        row = self._playback_row()
+        self.assertEqual((row['queue_index'], row['active_device_id'],
+                          row['active_device_seq']), (2, 'dev-a', 5))
+
 
 class QueueReorderDragContractTest(unittest.TestCase):
     """End-to-end contract guard for the drag -> store -> backend reorder chain.
@@ -511,8 +893,7 @@ class QueueReorderDragContractTest(unittest.TestCase):
         self.conn.executemany(
             "INSERT INTO songs (uuid, file, title) VALUES (?, ?, ?)",
             [(u, f'/music/{u}.flac', u) for u in self.songs])
-        for m in _PATCH_MODULES:
-            m.get_db = lambda c=self.conn: c
+        _patch_db(_PATCH_MODULES, self.conn)
 
     def tearDown(self):
         self.conn.close()
@@ -627,8 +1008,7 @@ class RadioDuplicatesContractTest(unittest.TestCase):
             [(u, f'/music/{u}.flac', u) for u in self.songs])
         from backend.api import radio as radio_mod
         self.radio = radio_mod
-        for m in _PATCH_MODULES + [radio_mod]:
-            m.get_db = lambda c=self.conn: c
+        _patch_db(_PATCH_MODULES + [radio_mod], self.conn)
 
     def tearDown(self):
         self.conn.close()
@@ -660,6 +1040,124 @@ class RadioDuplicatesContractTest(unittest.TestCase):
         self.assertEqual(self._pool_uuids(), sorted([self.songs[0], self.songs[1]]))
 
 
+class RadioContractTest(unittest.TestCase):
+    """Filter radio: random picks honour the filter and never repeat a queued song."""
+
+    def setUp(self):
+        self._tmp = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        self._tmp.close()
+        self.db_path = self._tmp.name
+        self.conn = _make_conn(self.db_path)
+        db_mod._run_migrations(self.conn)
+        self.rock = [f'rock-{i}' for i in range(30)]
+        self.jazz = [f'jazz-{i}' for i in range(5)]
+        self.conn.executemany(
+            "INSERT INTO songs (uuid, file, title, genre) VALUES (?, ?, ?, ?)",
+            [(u, f'/music/{u}.flac', u, u.split('-')[0]) for u in self.rock + self.jazz])
+        from backend.api import radio as radio_mod
+        self.radio = radio_mod
+        _patch_db(_PATCH_MODULES + [radio_mod], self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+        Path(self.db_path).unlink(missing_ok=True)
+
+    def _start(self, filter_query):
+        # The pool fill runs on the filler thread; let it finish before the
+        # test touches the shared connection again
+        r = self.radio.radio_start(filter_query=filter_query, details=DETAILS)
+        self.radio._get_pool_filler().pending.join()
+        return r
+
+    def _pool(self):
+        rows = self.conn.execute(
+            "SELECT song_uuid FROM sca_song_pool WHERE user_id = ?", (USER,)).fetchall()
+        return {row['song_uuid'] for row in rows}
+
+    def test_start_picks_only_matching_songs(self):
+        r = self._start('g:eq:jazz')
+        self.assertIn(r['seed']['uuid'], self.jazz)
+        queued = [s['uuid'] for s in r['queue']]
+        self.assertTrue(set(queued) <= set(self.jazz), queued)
+        self.assertEqual(len(queued), len(set(queued)), 'no song is queued twice')
+
+    def test_start_tops_up_small_genre_without_repeats(self):
+        # Only 5 jazz songs: the rest of the 10 come from the whole library
+        r = self.radio.radio_start(seed_uuid=self.jazz[0], details=DETAILS)
+        self.radio._get_pool_filler().pending.join()
+        queued = [s['uuid'] for s in r['queue']]
+        self.assertEqual(len(queued), 10)
+        self.assertEqual(len(queued), len(set(queued)), 'no song is queued twice')
+        self.assertTrue(set(self.jazz) <= set(queued), queued)
+
+    def test_next_refills_without_repeats(self):
+        r = self._start('g:eq:rock')
+        played = [self.radio.radio_next(r['session_id'], details=DETAILS)['uuid']
+                  for _ in range(8)]
+        self.assertTrue(set(played) <= set(self.rock), played)
+        queued = self.conn.execute(
+            "SELECT song_uuid FROM radio_queue WHERE session_id = ?",
+            (r['session_id'],)).fetchall()
+        queued = [row['song_uuid'] for row in queued]
+        self.assertEqual(len(queued), len(set(queued)))
+
+    def test_start_fills_pool_with_matching_songs(self):
+        self.conn.execute("INSERT INTO sca_song_pool (user_id, song_uuid) VALUES (?, ?)",
+                          (USER, self.rock[0]))
+        self._start('g:eq:jazz')
+        self.assertEqual(self._pool(), set(self.jazz))
+
+    def test_sca_populate_fills_pool_when_still_empty(self):
+        self._start('g:eq:rock')
+        self.conn.execute("DELETE FROM sca_song_pool WHERE user_id = ?", (USER,))
+        r = self.radio.sca_populate_queue(count=2, details=DETAILS)
+        self.assertEqual(r['added'], 2)
+        self.assertTrue({s['uuid'] for s in r['songs']} <= set(self.rock))
+        self.assertEqual(self._pool(), set(self.rock))
+
+    def test_sca_populate_appends_after_single_song_queue(self):
+        # MAX(position) = 0 used to be read as "empty" and collide with it
+        queue_mod.queue_add([self.rock[0]], None, details=DETAILS)
+        self.conn.executemany(
+            "INSERT INTO sca_song_pool (user_id, song_uuid) VALUES (?, ?)",
+            [(USER, u) for u in self.jazz])
+        r = self.radio.sca_populate_queue(count=3, details=DETAILS)
+        self.assertEqual(r['added'], 3)
+        rows = self.conn.execute(
+            "SELECT song_uuid, position FROM user_queue WHERE user_id = ? ORDER BY position",
+            (USER,)).fetchall()
+        self.assertEqual([row['position'] for row in rows], [0, 1, 2, 3])
+        self.assertEqual([row['song_uuid'] for row in rows],
+                         [self.rock[0]] + [s['uuid'] for s in r['songs']])
+
+    def test_skip_marks_only_latest_play(self):
+        self.conn.executemany(
+            "INSERT INTO play_history (user_id, song_uuid, played_at) VALUES (?, ?, ?)",
+            [(USER, self.rock[0], '2024-01-01 10:00:00'),
+             (USER, self.rock[0], '2024-01-02 10:00:00'),
+             (USER, self.rock[0], '2024-01-01 12:00:00')])
+        self.radio.radio_skip('any', self.rock[0], position_seconds=12, details=DETAILS)
+        rows = self.conn.execute(
+            "SELECT played_at, skipped, play_duration_seconds FROM play_history ORDER BY id"
+        ).fetchall()
+        self.assertEqual([tuple(r) for r in rows],
+                         [('2024-01-01 10:00:00', 0, None),
+                          ('2024-01-02 10:00:00', 1, 12),
+                          ('2024-01-01 12:00:00', 0, None)])
+
+    def test_queue_checks_session_owner(self):
+        r = self._start('g:eq:jazz')
+        sid = r['session_id']
+        mine = self.radio.radio_queue(sid, details=DETAILS)
+        self.assertEqual(mine['session_id'], sid)
+        self.assertEqual([s['uuid'] for s in mine['items']], [s['uuid'] for s in r['queue']])
+        other = self.radio.radio_queue(sid, details={'user_id': 'someone-else'})
+        self.assertEqual(other, {'items': [], 'session_id': None})
+        self.conn.execute("DELETE FROM radio_queue WHERE session_id = ?", (sid,))
+        self.assertEqual(self.radio.radio_queue(sid, details=DETAILS),
+                         {'items': [], 'session_id': sid})
+
+
 class ShareTokenContractTest(unittest.TestCase):
     """Least-privilege contract for share links (playlists_get_songs_by_token).
 
@@ -680,8 +1178,7 @@ class ShareTokenContractTest(unittest.TestCase):
         self.conn.executemany(
             "INSERT INTO songs (uuid, file, title) VALUES (?, ?, ?)",
             [(u, f'/music/{u}.flac', u) for u in self.songs])
-        for m in _PATCH_MODULES:
-            m.get_db = lambda c=self.conn: c
+        _patch_db(_PATCH_MODULES, self.conn)
         created = playlists_mod.playlists_create('shared', details=DETAILS)
         self.playlist_id = created['id']
         playlists_mod.playlists_add_songs(self.playlist_id, self.songs, details=DETAILS)
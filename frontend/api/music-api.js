@@ -17,6 +17,13 @@ function isWorkOfflineMode() {
     return localStorage.getItem('music-work-offline') === 'true';
 }
 
+/**
+ * Results of calls whose response carried an ETag, keyed by request body.
+ * Browsers don't revalidate POSTs on their own, so repeat calls send
+ * If-None-Match themselves and reuse the stored result on 304.
+ */
+const etagCache = new Map();
+
 /**
  * Make an API call to the backend.
  */
@@ -26,20 +33,31 @@ export async function apiCall(method, args = {}, kwargs = {}) {
         throw new Error('Network blocked: Work Offline mode is enabled');
     }
 
+    const body = JSON.stringify({
+        method,
+        args: Array.isArray(args) ? args : [],
+        kwargs: typeof args === 'object' && !Array.isArray(args) ? args : kwargs,
+        version: 2
+    });
+    const headers = {
+        'Content-Type': 'application/json',
+    };
+    const cached = etagCache.get(body);
+    if (cached) {
+        headers['If-None-Match'] = cached.etag;
+    }
+
     const response = await fetch(profile.endpoints.apiBase, {
         method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-        },
+        headers,
         credentials: 'include',
-        body: JSON.stringify({
-            method,
-            args: Array.isArray(args) ? args : [],
-            kwargs: typeof args === 'object' && !Array.isArray(args) ? args : kwargs,
-            version: 2
-        })
+        body
     });
 
+    if (response.status === 304 && cached) {
+        return structuredClone(cached.result);
+    }
+
     if (!response.ok) {
         throw new Error(`API error: ${response.status}`);
     }
@@ -52,6 +70,11 @@ export async function apiCall(method, args = {}, kwargs = {}) {
         throw new Error(data.message || data.error);
     }
 
+    const etag = response.headers.get('ETag');
+    if (etag) {
+        etagCache.set(body, { etag, result: structuredClone(data.result) });
+    }
+
     return data.result;
 }
 
@@ -298,9 +321,13 @@ export const playlists = {
     /**
      * Get songs in a playlist.
      * Supports offset-based pagination for jumping to specific positions.
+     * totalCount comes back on the first page only unless includeTotal is set
+     * (pass includeTotal: false to skip counting entirely).
      */
-    async getSongs(playlistId, { cursor, offset, limit = 100 } = {}) {
-        return apiCall('playlists_get_songs', { playlist_id: playlistId, cursor, offset, limit });
+    async getSongs(playlistId, { cursor, offset, limit = 100, includeTotal } = {}) {
+        return apiCall('playlists_get_songs', {
+            playlist_id: playlistId, cursor, offset, limit, include_total: includeTotal
+        });
     },
 
     /**
@@ -389,9 +416,9 @@ export const playlists = {
      * Get a shared playlist's songs by share token (no auth - the token is
      * the capability; same pagination shape as getSongs).
      */
-    async getSongsByToken(shareToken, { cursor, offset, limit = 100 } = {}) {
+    async getSongsByToken(shareToken, { cursor, offset, limit = 100, includeTotal } = {}) {
         return apiCall('playlists_get_songs_by_token', {
-            share_token: shareToken, cursor, offset, limit
+            share_token: shareToken, cursor, offset, limit, include_total: includeTotal
         });
     },
 
@@ -466,9 +493,10 @@ export const tags = {
 export const queue = {
     /**
      * Get the user's persistent queue.
+     * Pass minimal to get only uuid/title/artist/album/duration per item.
      */
-    async list({ cursor, limit = 100 } = {}) {
-        return apiCall('queue_list', { cursor, limit });
+    async list({ cursor, limit = 100, minimal = false } = {}) {
+        return apiCall('queue_list', minimal ? { cursor, limit, minimal } : { cursor, limit });
     },
 
     /**
@@ -735,39 +763,44 @@ export const history = {
     /**
      * Get paginated play history with date filtering.
      */
-    async list({ startDate, endDate, excludeSkipped = false, offset = 0, limit = 100 } = {}) {
+    async list({ startDate, endDate, excludeSkipped = false, cursor = null, offset = 0, limit = 100, includeTotal } = {}) {
         return apiCall('history_list', {
             start_date: startDate,
             end_date: endDate,
             exclude_skipped: excludeSkipped,
+            cursor,
             offset,
-            limit
+            limit,
+            include_total: includeTotal
         });
     },
 
     /**
      * Get unique songs with play counts, sorted by most played.
      */
-    async grouped({ startDate, endDate, excludeSkipped = false, offset = 0, limit = 100 } = {}) {
+    async grouped({ startDate, endDate, excludeSkipped = false, cursor = null, offset = 0, limit = 100, includeTotal } = {}) {
         return apiCall('history_grouped', {
             start_date: startDate,
             end_date: endDate,
             exclude_skipped: excludeSkipped,
+            cursor,
             offset,
-            limit
+            limit,
+            include_total: includeTotal
         });
     },
 
     /**
      * Get song UUIDs from history for batch add operations.
      */
-    async getUuids({ startDate, endDate, excludeSkipped = false, grouped = false, limit = 5000 } = {}) {
+    async getUuids({ startDate, endDate, excludeSkipped = false, grouped = false, limit = 5000, includeTotal = false } = {}) {
         return apiCall('history_get_uuids', {
             start_date: startDate,
             end_date: endDate,
             exclude_skipped: excludeSkipped,
             grouped,
-            limit
+            limit,
+            include_total: includeTotal
         });
     }
 };
@@ -812,9 +845,10 @@ export const preferences = {
 export const eqPresets = {
     /**
      * List all EQ presets for the current user.
+     * @param {boolean} [summary=false] - Return band_count instead of bands
      */
-    async list() {
-        return apiCall('eq_presets_list');
+    async list(summary = false) {
+        return apiCall('eq_presets_list', summary ? { summary } : {});
     },
 
     /**
@@ -834,6 +868,22 @@ export const eqPresets = {
      */
     async delete(uuid) {
         return apiCall('eq_presets_delete', { uuid });
+    },
+
+    /**
+     * Save several EQ presets in one request.
+     * @param {Array<{uuid?: string, name: string, bands: Array}>} presets
+     */
+    async saveBulk(presets) {
+        return apiCall('eq_presets_save_bulk', { presets });
+    },
+
+    /**
+     * Delete several EQ presets in one request.
+     * @param {string[]} uuids - The preset UUIDs to delete
+     */
+    async deleteBulk(uuids) {
+        return apiCall('eq_presets_delete_bulk', { uuids });
     }
 };
 
@@ -1047,7 +1047,7 @@ export const playlists = {
             const batchSize = 500;
 
             do {
-                const result = await api.playlists.getSongs(playlistId, { cursor, limit: batchSize });
+                const result = await api.playlists.getSongs(playlistId, { cursor, limit: batchSize, includeTotal: false });
                 const items = Array.isArray(result) ? result : (result.items || result.songs || []);
                 uuids.push(...items.map(s => s.uuid));
                 cursor = result.nextCursor;
@@ -286,7 +286,7 @@ async function fetchAllPlaylistSongs(playlistId) {
     const batchSize = 500;
 
     do {
-        const result = await api.playlists.getSongs(playlistId, { cursor, limit: batchSize });
+        const result = await api.playlists.getSongs(playlistId, { cursor, limit: batchSize, includeTotal: false });
         // Private returns inline {error} on rejection; without this the loop
         // treats it as an empty page and silently drops songs from the download.
         if (result?.error) throw new Error(result.error);
@@ -156,7 +156,7 @@ export class HistoryPage extends Component {
             requestAnimationFrame(() => this._win.refresh());
 
             if (result.hasMore) {
-                this._loadRemainingInBackground(100);
+                this._loadRemainingInBackground(result.items.length, result.nextCursor);
             }
         } catch (e) {
             console.error('Failed to load history:', e);
@@ -178,7 +178,7 @@ export class HistoryPage extends Component {
         }
     }
 
-    async _loadRemainingInBackground(currentOffset) {
+    async _loadRemainingInBackground(currentOffset, cursor) {
         const { startDate, endDate } = this.getDateRange();
         const excludeSkipped = this.state.hideSkipped;
         let offset = currentOffset;
@@ -189,12 +189,12 @@ export class HistoryPage extends Component {
                 if (this.state.viewMode === 'grouped') {
                     result = await historyApi.grouped({
                         startDate, endDate, excludeSkipped,
-                        offset, limit: 500
+                        cursor, limit: 500
                     });
                 } else {
                     result = await historyApi.list({
                         startDate, endDate, excludeSkipped,
-                        offset, limit: 500
+                        cursor, limit: 500
                     });
                 }
 
@@ -205,6 +205,7 @@ export class HistoryPage extends Component {
                 this.state.historyItems = items;
 
                 offset += result.items.length;
+                cursor = result.nextCursor;
 
                 if (!result.hasMore) break;
             } catch (e) {
@@ -4966,7 +4966,7 @@ class AudioController {
         let cursor = null;
 
         do {
-            const result = await playlistsApi.getSongs(playlistId, { cursor, limit: 500 });
+            const result = await playlistsApi.getSongs(playlistId, { cursor, limit: 500, includeTotal: false });
             if (result.error) break;
             // Handle both 'items' (offline-api) and 'songs' (direct api) response formats
             const songs = result.items || result.songs || [];